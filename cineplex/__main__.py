@@ -1,7 +1,12 @@
+from typing import List
 import typer
 
 #
 import youtube
+from cineplex import db, export
+from cineplex.backup import BackupLog
+from cineplex.youtube import playlist
+from cineplex.utils import green, blue, red, parse_duration
 
 #
 # CLI
@@ -10,6 +15,17 @@ import youtube
 cli = typer.Typer()
 cli.add_typer(youtube.cli, name='youtube')
 
+
+@cli.command()
+def refresh(older_than: str = typer.Option('7d', help="Re-sync what was last synced longer ago than this (e.g. 12h, 7d, 2w)")):
+    """Re-sync stale channels, playlists and videos"""
+    try:
+        age = parse_duration(older_than)
+    except ValueError as e:
+        raise typer.BadParameter(str(e), param_hint='--older-than')
+    playlist.refresh_stale(age)
+
+
 # @cli.command()
 # def deploy():
 #     ray.init(address="auto", namespace="serve")
@@ -25,11 +41,81 @@ cli.add_typer(youtube.cli, name='youtube')
 # Administration
 #
 
+db_cli = typer.Typer()
+cli.add_typer(db_cli, name='db')
 
-# @cli.command()
-# def init_db():
-#     """Initialize the database"""
-#     db.create_indices()
+
+@db_cli.command('init')
+def init_db(prune: bool = typer.Option(True, help="Drop indexes that are no longer declared")):
+    """Initialize the database (create or update its indexes)"""
+    for collection, actions in db.ensure_indexes(prune).items():
+        if actions:
+            typer.echo(f"🔧 {green(collection)}: {blue(', '.join(actions))}")
+        else:
+            typer.echo(f"✅ {green(collection)}: up to date")
+
+
+@db_cli.command('migrate-timestamps')
+def migrate_timestamps():
+    """Convert string as_of timestamps to UTC datetimes"""
+    for collection, count in db.migrate_timestamps().items():
+        typer.echo(f"✅ {green(collection)}: {blue(count)} converted")
+
+
+@db_cli.command('restore')
+def restore_db(collection: List[str] = typer.Option([], help="Only restore these collections"),
+               workers: int = typer.Option(4, help="Segments replayed in parallel")):
+    """Restore the latest backup of every document from the backup log"""
+    backup = BackupLog()
+    with typer.progressbar(length=len(backup.segments()), label='Restoring', fill_char=typer.style("█", fg="green"), show_pos=True) as bar:
+        counts = backup.restore(collection, workers,
+                                on_segment=lambda: bar.update(1))
+    for name, count in sorted(counts.items()):
+        typer.echo(f"✅ {green(name)}: {blue(count)} restored")
+
+    # backups of playlist items embed the items
+    if counts.get('yt_playlist_items'):
+        playlist.migrate_youtube_playlist_items()
+
+
+@db_cli.command('export')
+def export_db(dir: str,
+              collection: List[str] = typer.Option([], help="Only export these collections (default: all yt_*)"),
+              workers: int = typer.Option(4, help="Collections exported in parallel"),
+              chunk_size: int = typer.Option(100000, help="Documents per file")):
+    """Export the database as compressed NDJSON files"""
+    names = collection or export.export_collection_names()
+    total = sum(db.get_db()[x].estimated_document_count() for x in names)
+    with typer.progressbar(length=total, label='Exporting', fill_char=typer.style("█", fg="green"), show_pos=True) as bar:
+        export.export_db(dir, names, workers, chunk_size,
+                         on_progress=lambda name, n: bar.update(n),
+                         on_done=lambda name, count: typer.echo(f"\n✅ {green(name)}: {blue(count)} exported"))
+
+
+@db_cli.command('import')
+def import_db(dir: str,
+              collection: List[str] = typer.Option([], help="Only import these collections (default: all exported)"),
+              workers: int = typer.Option(4, help="Collections imported in parallel"),
+              drop: bool = typer.Option(False, help="Drop the collections first instead of keeping existing documents")):
+    """Import an export made with `db export`"""
+    counts = export.read_manifest(dir)['collections']
+    names = collection or sorted(counts)
+    with typer.progressbar(length=sum(counts.get(x, 0) for x in names), label='Importing', fill_char=typer.style("█", fg="green"), show_pos=True) as bar:
+        export.import_db(dir, names, workers, drop,
+                         on_progress=lambda name, n: bar.update(n),
+                         on_done=lambda name, count: typer.echo(f"\n✅ {green(name)}: {blue(count)} imported"))
+    # indexes are cheaper to build after the data is in
+    init_db(prune=False)
+
+
+@db_cli.command('explain')
+def explain_db():
+    """Explain the hot queries and flag collection scans"""
+    for name, stages in db.explain_queries().items():
+        if 'COLLSCAN' in stages:
+            typer.echo(f"❗ {red(name)}: {' > '.join(stages)}")
+        else:
+            typer.echo(f"✅ {green(name)}: {' > '.join(stages)}")
 
 if __name__ == "__main__":
     cli()
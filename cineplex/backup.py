@@ -0,0 +1,233 @@
+import atexit
+import glob
+import gzip
+import json
+import os
+import queue
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Tuple
+#
+from bson import json_util
+#
+from cineplex.db import bulk_upsert, get_db
+from cineplex.logger import Logger
+from cineplex.config import Settings
+
+settings = Settings()
+
+#
+# Backup log
+#
+# Documents saved with `to_disk` are appended to a log under `bkp_dir/log`
+# instead of one pretty-printed file each. A background thread takes them
+# off a bounded queue and writes them in batches, each batch one gzip member
+# of NDJSON records (`{"c": collection, "d": document}`, MongoDB extended
+# JSON so dates and ObjectIds survive). Segments rotate past
+# `backup_segment_mb` of records and are named by when they were opened and
+# by whom, so several processes can log side by side. Segment names don't
+# order the saves across processes, though: a long-lived process keeps
+# writing into a segment opened before another process's.
+#
+# Next to each segment, an `.idx` file lists `[collection, id, offset, ns]`
+# for every record, the offset being that of its gzip member and `ns` the
+# time it was saved (`time.time_ns()`). Loaded together, the index maps each
+# document to its latest save, whichever segment holds it, which is what
+# `lookup` reads and `restore` replays.
+#
+
+SEGMENT_EXT = '.ndjson.gz'
+INDEX_EXT = '.idx'
+
+# records per gzip member
+BATCH_SIZE = 500
+
+_STOP = object()
+
+
+def _segment_name(seq: int) -> str:
+    return f"{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}-{seq:04d}"
+
+
+class BackupLog:
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super(BackupLog, cls).__new__(cls)
+            cls._instance.dir = os.path.join(settings.bkp_dir, 'log')
+            cls._instance.max_bytes = settings.backup_segment_mb * 1024 * 1024
+            cls._instance._queue = queue.Queue(settings.backup_queue_size)
+            cls._instance._thread = None
+            cls._instance._lock = threading.Lock()
+        return cls._instance
+
+    def append(self, collection: str, doc: dict) -> None:
+        """Queue a document for backup (blocks only while the queue is full)"""
+        with self._lock:
+            if self._thread is None:
+                os.makedirs(self.dir, exist_ok=True)
+                self._thread = threading.Thread(
+                    target=self._run, name='backup-log', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+        self._queue.put((collection, doc, time.time_ns()))
+
+    def flush(self) -> None:
+        """Wait until everything queued so far is written"""
+        self._queue.join()
+
+    def close(self) -> None:
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join()
+
+    def _run(self) -> None:
+        seq = 0
+        segment = _segment_name(seq)
+        size = 0
+        stop = False
+        while not stop:
+            batch = [self._queue.get()]
+            while len(batch) < BATCH_SIZE and batch[-1] is not _STOP:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is _STOP:
+                stop = True
+                batch.pop()
+
+            try:
+                if batch:
+                    size += self._write(segment, batch)
+                    if size >= self.max_bytes:
+                        seq += 1
+                        segment = _segment_name(seq)
+                        size = 0
+            except Exception as e:
+                Logger().error(
+                    f"Unable to back up {len(batch)} document(s): {e}")
+            finally:
+                for _ in range(len(batch) + stop):
+                    self._queue.task_done()
+
+    def _write(self, segment: str, batch: List[Tuple[str, dict, int]]) -> int:
+        """Append a batch as one gzip member, returning its uncompressed size"""
+        lines = b''.join(json_util.dumps({'c': c, 'd': d}).encode() + b'\n'
+                         for c, d, _ in batch)
+        path = os.path.join(self.dir, segment)
+        with open(path + SEGMENT_EXT, 'ab') as f:
+            offset = f.tell()
+            f.write(gzip.compress(lines, compresslevel=6))
+        with open(path + INDEX_EXT, 'a') as f:
+            f.writelines(json.dumps([c, str(d['_id']), offset, ns]) + '\n'
+                         for c, d, ns in batch)
+        return len(lines)
+
+    def segments(self) -> List[str]:
+        """The segment names, oldest first"""
+        return sorted(os.path.basename(x)[:-len(SEGMENT_EXT)]
+                      for x in glob.glob(os.path.join(self.dir, f'*{SEGMENT_EXT}')))
+
+    def load_index(self) -> Dict[Tuple[str, str], Tuple[str, int]]:
+        """(collection, id) -> (segment, offset) of the latest backup"""
+        index = {}
+        saved = {}
+        for segment in self.segments():
+            try:
+                with open(os.path.join(self.dir, segment + INDEX_EXT)) as f:
+                    for line in f:
+                        # entries written before saves were timestamped
+                        # fall back to segment order
+                        collection, id, offset, *ns = json.loads(line)
+                        ns = ns[0] if ns else 0
+                        key = (collection, id)
+                        if ns >= saved.get(key, 0):
+                            saved[key] = ns
+                            index[key] = (segment, offset)
+            except (OSError, ValueError) as e:
+                Logger().warning(f"Unable to read index of {segment}: {e}")
+        return index
+
+    def _members(self, segment: str) -> Iterator[Tuple[int, List[dict]]]:
+        """The (offset, records) of each gzip member of a segment"""
+        with open(os.path.join(self.dir, segment + SEGMENT_EXT), 'rb') as f:
+            data = memoryview(f.read())
+        offset = 0
+        while offset < len(data):
+            d = zlib.decompressobj(wbits=31)
+            lines = d.decompress(data[offset:])
+            if not d.eof:
+                Logger().warning(
+                    f"Truncated backup member at {segment}:{offset}")
+                return
+            yield offset, [json_util.loads(x) for x in lines.splitlines() if x]
+            offset = len(data) - len(d.unused_data)
+
+    def _read_member(self, segment: str, offset: int) -> List[dict]:
+        """The records of the gzip member at `offset` of a segment"""
+        d = zlib.decompressobj(wbits=31)
+        lines = b''
+        with open(os.path.join(self.dir, segment + SEGMENT_EXT), 'rb') as f:
+            f.seek(offset)
+            while not d.eof:
+                chunk = f.read(64 * 1024)
+                if not chunk:
+                    raise ValueError(
+                        f"Truncated backup member at {segment}:{offset}")
+                lines += d.decompress(chunk)
+        return [json_util.loads(x) for x in lines.splitlines() if x]
+
+    def lookup(self, collection: str, id: str, index: dict = None) -> dict:
+        """The latest backup of a document, if any"""
+        index = index if index is not None else self.load_index()
+        location = index.get((collection, str(id)))
+        if location is None:
+            return None
+        for record in reversed(self._read_member(*location)):
+            if record['c'] == collection and str(record['d']['_id']) == str(id):
+                return record['d']
+
+    def _restore_segment(self, segment: str, index: dict, collections) -> Dict[str, int]:
+        """Upsert the records of a segment that are their document's latest backup"""
+        docs = {}
+        for offset, records in self._members(segment):
+            for record in records:
+                collection, doc = record['c'], record['d']
+                if collections and collection not in collections:
+                    continue
+                if index.get((collection, str(doc['_id']))) == (segment, offset):
+                    # a member may hold several saves of a document, last wins
+                    docs.setdefault(collection, {})[doc['_id']] = doc
+
+        counts = {}
+        for collection, collection_docs in docs.items():
+            res = bulk_upsert(get_db()[collection],
+                              list(collection_docs.values()))
+            for id, error in res.errors.items():
+                Logger().error(f"Unable to restore {collection} {id}: {error}")
+            counts[collection] = len(collection_docs) - len(res.errors)
+        return counts
+
+    def restore(self, collections: List[str] = None, workers: int = 4, on_segment=None) -> Dict[str, int]:
+        """
+        Replay the latest backup of every document (of `collections`) into
+        the database, `workers` segments at a time, returning the count of
+        documents restored per collection.
+        """
+        self.flush()
+        index = self.load_index()
+        totals = {}
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            for counts in executor.map(
+                    lambda x: self._restore_segment(x, index, collections), self.segments()):
+                for collection, count in counts.items():
+                    totals[collection] = totals.get(collection, 0) + count
+                if on_segment is not None:
+                    on_segment()
+        return totals
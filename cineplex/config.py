@@ -18,15 +18,52 @@ class Settings(BaseSettings):
     # Database
     mongo_url: str = "mongodb://localhost:27017"
     mongo_db: str = "cineplex"
+    mongo_bulk_chunk_size: int = 1000
+    mongo_max_pool_size: int = 10
+    mongo_min_pool_size: int = 0
+    mongo_connect_timeout_ms: int = 10000
+    mongo_server_selection_timeout_ms: int = 10000
+    mongo_socket_timeout_ms: int = 0
+    mongo_compressors: str = ''
+    mongo_single_writer: bool = False
+    db_cache: bool = True
+    db_cache_size: int = 10000
+    db_cache_ttl: int = 300
+    redis_url: str = ''
+    redis_cache_ttl: int = 3600
+    redis_known_ttl: int = 86400
 
     # Paths
     tmp_dir: str = './tmp'
     bkp_dir: str = './bkp'
+    backup_segment_mb: int = 64
+    backup_queue_size: int = 10000
     data_dir: str = './data'
 
+    # Jobs
+    jobs_lease_seconds: int = 300
+    jobs_max_attempts: int = 3
+
+    # Ray
+    ray_address: str = 'auto'
+
     # YouTube
     my_youtube_channel_id: str = "UC-lHJZR3Gqxm24_Vd_AJ5Yw"
     youtube_channels_dir: str = '/Volumes/Cineplex00/YouTube/channels'
+    youtube_daily_quota: int = 10000
+    youtube_max_concurrency: int = 8
+    youtube_download_workers: int = 4
+    youtube_full_sync_days: int = 7
+    youtube_cache: bool = True
+    youtube_cache_max_mb: int = 256
+    youtube_write_rate: float = 1
+    youtube_write_max_rate: float = 5
+    youtube_max_retries: int = 6
+    youtube_fake: str = ''
+    youtube_fake_latency: float = 0
+    youtube_fake_quota: int = 0
+    youtube_fake_write_rate: float = 0
+    youtube_record: str = ''
 
     class Config:
         env_file = '.env'
@@ -1,29 +1,448 @@
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List
+import bson
 from bson import ObjectId
-from pymongo import MongoClient
+from pydantic import BaseModel
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel, MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
 from cineplex.config import Settings
+from cineplex.doc_cache import DocumentCache, SharedCache
+from cineplex.logger import Logger
 
 settings = Settings()
 
+# `$in` lists are split well below MongoDB's 16MB command size limit
+max_in_bytes = 8 * 1024 * 1024
+
+
+def mongo_client_options() -> dict:
+    """MongoClient pool, timeout and compression options from the settings"""
+    options = {
+        'maxPoolSize': settings.mongo_max_pool_size,
+        'minPoolSize': settings.mongo_min_pool_size,
+        'connectTimeoutMS': settings.mongo_connect_timeout_ms,
+        'serverSelectionTimeoutMS': settings.mongo_server_selection_timeout_ms,
+        # 0 means no timeout
+        'socketTimeoutMS': settings.mongo_socket_timeout_ms or None,
+    }
+    if settings.mongo_compressors:
+        options['compressors'] = settings.mongo_compressors
+    return options
+
 
 class Database:
+    """
+    The process's MongoClient, created on first use.
+
+    A MongoClient must not be used across a fork, so a forked child (e.g. a
+    worker process) drops the parent's instance and lazily creates its own.
+    """
     _instance = None
+    _lock = threading.Lock()
 
     def __new__(cls, *args, **kwargs):
-        if cls._instance is None:
-            cls._instance = super(Database, cls).__new__(cls, *args, **kwargs)
-            cls._instance.client = MongoClient(settings.mongo_url)
-            cls._instance.db = cls._instance.client[settings.mongo_db]
+        with cls._lock:
+            if cls._instance is None:
+                instance = super(Database, cls).__new__(cls, *args, **kwargs)
+                instance.client = MongoClient(
+                    settings.mongo_url, **mongo_client_options())
+                instance.db = instance.client[settings.mongo_db]
+                cls._instance = instance
         return cls._instance
 
+    @classmethod
+    def close(cls) -> None:
+        with cls._lock:
+            if cls._instance is not None:
+                cls._instance.client.close()
+                cls._instance = None
+
+    @classmethod
+    def _after_fork(cls) -> None:
+        # the parent's client (and a lock another thread may have held) are
+        # unusable here; don't close the client, its sockets are the parent's
+        cls._instance = None
+        cls._lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=Database._after_fork)
+
 
 def get_db():
     return Database().db
 
 
-def create_indices():
+class BulkResult(BaseModel):
+    """Outcome of `bulk_upsert`, with the error of each ID that failed"""
+    inserted: int = 0
+    modified: int = 0
+    unchanged: int = 0
+    errors: Dict[str, str] = {}
+
+    def __str__(self):
+        return f"{self.inserted} inserted, {self.modified} modified, {self.unchanged} unchanged, {len(self.errors)} failed"
+
+
+def bulk_upsert(collection, docs: List[dict], chunk_size: int = None, unset: List[str] = None) -> BulkResult:
+    """
+    Upsert `docs` (`$set` by `_id`, removing any `unset` fields) with
+    unordered bulk writes of `chunk_size` documents. A document that fails
+    is recorded in the result's `errors` without stopping the rest.
+    """
+    chunk_size = chunk_size or settings.mongo_bulk_chunk_size
+    result = BulkResult()
+    update = {'$unset': {x: '' for x in unset}} if unset else {}
+    DocumentCache().invalidate(collection.name, [x['_id'] for x in docs])
+
+    for i in range(0, len(docs), chunk_size):
+        chunk = docs[i:i+chunk_size]
+        ops = [UpdateOne({'_id': x['_id']}, {'$set': x, **update}, upsert=True)
+               for x in chunk]
+        try:
+            details = collection.bulk_write(ops, ordered=False).bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+            for error in details['writeErrors']:
+                result.errors[str(chunk[error['index']]['_id'])] = error['errmsg']
+        except PyMongoError as e:
+            for x in chunk:
+                result.errors[str(x['_id'])] = str(e)
+            continue
+
+        result.inserted += details['nUpserted']
+        result.modified += details['nModified']
+        result.unchanged += details['nMatched'] - details['nModified']
+
+    SharedCache().add_known(collection.name, [
+        x['_id'] for x in docs if str(x['_id']) not in result.errors])
+    return result
+
+
+def _in_chunks(values: List, max_bytes: int):
+    chunk = []
+    size = 0
+    for value in values:
+        # an array element costs its BSON encoding (type, index key, value)
+        n = len(bson.encode({str(len(chunk)): value})) - 5
+        if chunk and size + n > max_bytes:
+            yield chunk
+            chunk = []
+            size = 0
+        chunk.append(value)
+        size += n
+    if chunk:
+        yield chunk
+
+
+def find_in(collection, values: Iterable, projection: dict = None, field: str = '_id', max_bytes: int = None) -> list:
+    """
+    Find the documents whose `field` is one of `values`, with one `$in`
+    query per chunk of values (split to stay under the BSON size limit).
+    """
+    docs = []
+    for chunk in _in_chunks(list(values), max_bytes or max_in_bytes):
+        docs.extend(collection.find({field: {'$in': chunk}}, projection))
+    return docs
+
+
+def find_in_cached(collection, values: Iterable, projection: dict = None) -> list:
+    """
+    `find_in` by `_id`, read through the document cache: only the documents
+    not cached (or expired) are fetched. Projected reads bypass the cache.
+    """
+    cache = DocumentCache()
+    if projection is not None or not cache.cacheable(collection.name):
+        return find_in(collection, values, projection)
+
+    values = list(dict.fromkeys(values))
+    found, missing = cache.get_many(collection.name, values)
+    if missing:
+        docs = find_in(collection, missing)
+        cache.put_many(collection.name, docs)
+        found.update((x['_id'], x) for x in docs)
+    return [found[x] for x in values if x in found]
+
+
+def find_one_cached(collection, id):
+    """The document with `_id` `id` (or None), read through the document cache"""
+    docs = find_in_cached(collection, [id])
+    return docs[0] if docs else None
+
+
+def invalidate(collection, ids: Iterable = None, deleted: bool = False) -> None:
+    """Drop documents written (or `deleted`) outside the helpers here from the document cache"""
+    ids = list(ids) if ids is not None else None
+    DocumentCache().invalidate(collection.name, ids)
+    if deleted:
+        SharedCache().remove_known(collection.name, ids)
+
+
+def existing_ids(collection, ids: Iterable) -> set:
+    """
+    Which of `ids` are in the collection. IDs in the shared known-ID set
+    are answered from Redis; only the others are looked up in MongoDB.
+    """
+    ids = list(dict.fromkeys(ids))
+    shared = SharedCache()
+    known = shared.known(collection.name, ids)
+    unknown = [x for x in ids if x not in known]
+    if unknown:
+        found = [x['_id'] for x in find_in(collection, unknown, {'_id': 1})]
+        shared.add_known(collection.name, found)
+        known.update(found)
+    return known
+
+
+def delete_in(collection, values: Iterable, field: str = '_id') -> int:
+    """Delete the documents whose `field` is one of `values` (chunked like `find_in`)"""
+    values = list(values)
+    invalidate(collection, values if field == '_id' else None, deleted=True)
+    return sum(collection.delete_many({field: {'$in': chunk}}).deleted_count
+               for chunk in _in_chunks(list(values), max_in_bytes))
+
+
+def find_ids(collection, filter: dict = None) -> list:
+    """The `_id`s of the matching documents (nothing else is fetched)"""
+    return [x['_id'] for x in collection.find(filter or {}, {'_id': 1})]
+
+
+#
+# Timestamps
+#
+# `as_of` and the other timestamps are stored as naive UTC datetimes (which
+# is also what pymongo reads back), so "synced before" is an indexed range
+# scan. Documents written before this carry `str(datetime.now())` local time
+# strings, which `migrate_timestamps()` converts.
+#
+
+TIMESTAMP_FIELDS = {
+    'yt_channels': ['as_of', 'offline_as_of'],
+    'yt_channel_playlists': ['as_of'],
+    'yt_playlists': ['as_of', 'offline_as_of'],
+    'yt_playlist_items': ['as_of', 'full_sync_as_of'],
+    'yt_videos': ['as_of'],
+    'yt_playlist_merges': ['as_of'],
+    'yt_playlist_inserts': ['as_of'],
+}
+
+
+def to_utc(value) -> datetime:
+    """A stored timestamp as a naive UTC datetime (naive strings are local time)"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        # astimezone() takes a naive datetime to be local time
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def migrate_timestamps(chunk_size: int = None) -> Dict[str, int]:
+    """Convert string timestamps to UTC datetimes, returning the count per collection"""
+    chunk_size = chunk_size or settings.mongo_bulk_chunk_size
     db = get_db()
+    counts = {}
+
+    for name, fields in TIMESTAMP_FIELDS.items():
+        collection = db[name]
+        count = 0
+        for field in fields:
+            ops = []
+            for doc in collection.find({field: {'$type': 'string'}}, {field: 1}):
+                try:
+                    value = to_utc(doc[field])
+                except ValueError as e:
+                    Logger().error(
+                        f"Unable to convert {name}.{field} of {doc['_id']}: {e}")
+                    continue
+                ops.append(UpdateOne({'_id': doc['_id']}, {'$set': {field: value}}))
+                if len(ops) == chunk_size:
+                    count += collection.bulk_write(ops, ordered=False).modified_count
+                    ops = []
+            if ops:
+                count += collection.bulk_write(ops, ordered=False).modified_count
+        if count:
+            DocumentCache().invalidate(name)
+        counts[name] = count
+
+    return counts
+
+
+def stale_filter(age: timedelta, field: str = 'as_of') -> dict:
+    """Documents whose `field` is older than `age` (or was never set)"""
+    cutoff = datetime.utcnow() - age
+    return {'$or': [{field: {'$lt': cutoff}}, {field: None}]}
+
+
+def find_stale(collection, age: timedelta) -> list:
+    """The `_id`s of the documents last synced more than `age` ago"""
+    return find_ids(collection, stale_filter(age))
+
+
+def touch(collection, ids: Iterable, field: str = 'as_of') -> None:
+    """Mark documents as current (e.g. verified unchanged) without rewriting them"""
+    now = datetime.utcnow()
+    ids = list(ids)
+    DocumentCache().invalidate(collection.name, ids)
+    for chunk in _in_chunks(ids, max_in_bytes):
+        collection.update_many({'_id': {'$in': chunk}}, {'$set': {field: now}})
+
+
+#
+# Indexes
+#
+# The indexes of every collection are declared here; `ensure_indexes()`
+# reconciles the database with them (creating missing indexes, rebuilding
+# changed ones and dropping undeclared ones), so it is safe to re-run.
+#
+
+INDEXES = {
+    'yt_videos': [
+        # only what people search by, with titles ranking highest
+        IndexModel([('video.title', TEXT), ('video.tags', TEXT),
+                    ('video.channel_title', TEXT), ('video.description', TEXT)],
+                   name='video_text',
+                   weights={'video.title': 10, 'video.tags': 5,
+                            'video.channel_title': 3, 'video.description': 1}),
+        IndexModel([('video.channel_id', ASCENDING)],
+                   name='video_channel_id'),
+        IndexModel([('as_of', ASCENDING)], name='as_of'),
+    ],
+    'yt_channels': [
+        IndexModel([('offline', ASCENDING), ('offline_as_of', DESCENDING)],
+                   name='offline_offline_as_of'),
+        IndexModel([('as_of', ASCENDING)], name='as_of'),
+    ],
+    'yt_playlists': [
+        IndexModel([('offline', ASCENDING), ('offline_as_of', DESCENDING)],
+                   name='offline_offline_as_of'),
+        IndexModel([('as_of', ASCENDING)], name='as_of'),
+    ],
+    'yt_playlist_items': [
+        IndexModel([('as_of', ASCENDING)], name='as_of'),
+    ],
+    'yt_playlist_entries': [
+        IndexModel([('playlist_id', ASCENDING), ('position', ASCENDING)],
+                   name='playlist_id_position'),
+    ],
+    'yt_playlist_merges': [
+        IndexModel([('target_playlist_id', ASCENDING)],
+                   name='target_playlist_id'),
+    ],
+    'yt_download_jobs': [
+        IndexModel([('kind', ASCENDING), ('state', ASCENDING), ('created_at', ASCENDING)],
+                   name='kind_state_created_at'),
+        IndexModel([('kind', ASCENDING), ('state', ASCENDING), ('lease_expires', ASCENDING)],
+                   name='kind_state_lease_expires'),
+    ],
+}
+
+# the hot queries the indexes are there for, checked by `explain_queries()`
+QUERIES = {
+    'channel videos': lambda db: db.yt_videos.find({'video.channel_id': ''}),
+    'offline channels': lambda db: db.yt_channels.find({'offline': True}).sort('offline_as_of', DESCENDING),
+    'offline playlists': lambda db: db.yt_playlists.find({'offline': True}).sort('offline_as_of', DESCENDING),
+    'playlist items': lambda db: db.yt_playlist_entries.find({'playlist_id': ''}).sort('position', ASCENDING),
+    'playlist merges': lambda db: db.yt_playlist_merges.find({'target_playlist_id': ''}),
+    'video search': lambda db: db.yt_videos.find({'$text': {'$search': 'cineplex'}}),
+    'stale channels': lambda db: db.yt_channels.find(stale_filter(timedelta(days=7)), {'_id': 1}),
+    'stale playlists': lambda db: db.yt_playlists.find(stale_filter(timedelta(days=7)), {'_id': 1}),
+    'stale playlist items': lambda db: db.yt_playlist_items.find(stale_filter(timedelta(days=7)), {'_id': 1}),
+    'stale videos': lambda db: db.yt_videos.find(stale_filter(timedelta(days=7)), {'_id': 1}),
+    'queued jobs': lambda db: db.yt_download_jobs.find({'kind': 'download', 'state': 'queued'}).sort('created_at', ASCENDING),
+}
+
 
-    db.yt_videos.create_index([('$**', "text")])
+def _index_signature(spec: dict):
+    """What makes two indexes the same (text indexes compare by weights)"""
+    key = list(spec['key'].items())
+    if any(x == TEXT for _, x in key):
+        weights = spec.get('weights', {})
+        return ('text', tuple(sorted((f, weights.get(f, 1)) for f, x in key if x == TEXT)))
+    return (tuple(key), bool(spec.get('unique', False)))
+
+
+def _existing_signature(info: dict):
+    if 'weights' in info:
+        return ('text', tuple(sorted(info['weights'].items())))
+    # the shell may have stored directions as doubles
+    key = tuple((f, int(x) if isinstance(x, float) else x) for f, x in info['key'])
+    return (key, bool(info.get('unique', False)))
+
+
+def _is_text(key) -> bool:
+    """Whether an index key, as (field, type) pairs, is a text index's"""
+    return any(x == TEXT for _, x in key)
+
+
+def ensure_indexes(prune: bool = True) -> Dict[str, List[str]]:
+    """Reconcile the database's indexes with `INDEXES`, returning the changes"""
+    db = get_db()
+    changes = {}
+
+    for name, models in INDEXES.items():
+        collection = db[name]
+        existing = collection.index_information()
+        declared = {x.document['name']: x for x in models}
+        actions = []
+
+        # a collection can have one text index only, so an undeclared one
+        # (e.g. the old wildcard `$**`) goes even without `prune`
+        declares_text = any(_is_text(x.document['key'].items()) for x in models)
+        for index_name, info in existing.items():
+            if index_name == '_id_' or index_name in declared:
+                continue
+            if prune or (declares_text and _is_text(info['key'])):
+                collection.drop_index(index_name)
+                actions.append(f'dropped {index_name}')
+
+        missing = []
+        for index_name, model in declared.items():
+            info = existing.get(index_name)
+            if info is not None and _existing_signature(info) == _index_signature(model.document):
+                continue
+            if info is not None:
+                collection.drop_index(index_name)
+                actions.append(f'rebuilt {index_name}')
+            else:
+                actions.append(f'created {index_name}')
+            missing.append(model)
+
+        if missing:
+            collection.create_indexes(missing)
+        changes[name] = actions
+
+    return changes
+
+
+def _plan_stages(plan) -> List[str]:
+    """All the stages of an explain() plan, however deeply nested"""
+    stages = []
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            stages.append(plan['stage'])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(_plan_stages(value))
+    return stages
+
+
+def explain_queries() -> Dict[str, List[str]]:
+    """The winning plan stages of each query in `QUERIES`"""
+    db = get_db()
+    plans = {}
+    for name, query in QUERIES.items():
+        try:
+            explained = query(db).explain()
+            plans[name] = _plan_stages(
+                explained['queryPlanner']['winningPlan'])
+        except PyMongoError as e:
+            plans[name] = [f'error: {e}']
+    return plans
 
 
 class PyObjectId(ObjectId):
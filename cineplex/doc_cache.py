@@ -0,0 +1,275 @@
+import atexit
+import copy
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Dict, Iterable, List, Set, Tuple
+#
+import bson
+try:
+    import redis
+except ImportError:
+    redis = None
+#
+from cineplex.logger import Logger
+from cineplex.config import Settings
+
+settings = Settings()
+
+#
+# Document cache
+#
+# Channel, playlist and video documents read by `_id` are kept in a bounded
+# in-process LRU cache (`db_cache_size` entries, each fresh for
+# `db_cache_ttl` seconds), so the commands that look the same documents up
+# over and over only go to MongoDB once. Writes through the `db` helpers and
+# the `save_*` functions invalidate the documents they touch; anything
+# written by another process is picked up when the entry expires.
+#
+# Documents are copied in and out, so callers may modify what they get.
+# Hits and misses per collection are logged when the process exits.
+#
+# With `redis_url` set, `SharedCache` adds a second tier shared by every
+# process (Ray workers, successive CLI runs): local misses are looked up in
+# Redis with pipelined MGETs before going to MongoDB, documents expire after
+# `redis_cache_ttl` seconds, and keys carry `KEY_VERSION` so a change of
+# document shape only needs a bump. Redis also keeps the set of known IDs of
+# each collection (see `db.existing_ids`), under its own `known:` prefix so
+# dropping a collection's documents keeps it. The set expires
+# `redis_known_ttl` seconds after it was started, so IDs of documents deleted
+# behind cineplex's back (the in-tree deletes remove theirs) don't linger; it
+# is then rebuilt from MongoDB as IDs are looked up. Without Redis (not
+# configured, not installed or unreachable) the shared tier simply misses.
+#
+
+# collections whose documents are cached
+CACHED_COLLECTIONS = {'yt_channels', 'yt_playlists', 'yt_videos'}
+
+# bump when the shape of cached documents changes
+KEY_VERSION = 1
+
+# keys per MGET/pipeline round trip
+REDIS_BATCH_SIZE = 500
+
+
+class SharedCache:
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super(SharedCache, cls).__new__(cls)
+            cls._instance.ttl = settings.redis_cache_ttl
+            cls._instance.known_ttl = settings.redis_known_ttl
+            cls._instance.client = None
+            if settings.redis_url and redis is None:
+                Logger().warning(
+                    "redis is not installed, the shared cache is disabled")
+            elif settings.redis_url:
+                cls._instance.client = redis.Redis.from_url(
+                    settings.redis_url, socket_timeout=1, socket_connect_timeout=1)
+        return cls._instance
+
+    @property
+    def enabled(self) -> bool:
+        return self.client is not None
+
+    def _key(self, collection: str, id) -> str:
+        return f'cineplex:v{KEY_VERSION}:{collection}:{id}'
+
+    def _known_key(self, collection: str) -> str:
+        return f'cineplex:v{KEY_VERSION}:known:{collection}'
+
+    def _add_known(self, client, collection: str, ids: List[str], pipe=None) -> None:
+        """SADD `ids` to the known set, starting its lifetime if it is new"""
+        key = self._known_key(collection)
+        pipe = pipe if pipe is not None else client.pipeline(transaction=False)
+        pipe.sadd(key, *ids)
+        pipe.ttl(key)
+        # -1: the set has no expiry yet
+        if pipe.execute()[-1] == -1:
+            client.expire(key, self.known_ttl)
+
+    def _run(self, fn):
+        """Run `fn(client)`, disabling the shared tier if Redis fails"""
+        if self.client is None:
+            return None
+        try:
+            return fn(self.client)
+        except redis.RedisError as e:
+            Logger().warning(
+                f"Redis unavailable, the shared cache is disabled: {e}")
+            self.client = None
+            return None
+
+    def get_many(self, collection: str, ids: List) -> Dict:
+        """The cached documents of `ids` (missing ones are left out)"""
+        def get(client):
+            pipe = client.pipeline(transaction=False)
+            for i in range(0, len(ids), REDIS_BATCH_SIZE):
+                pipe.mget([self._key(collection, x)
+                          for x in ids[i:i+REDIS_BATCH_SIZE]])
+            values = [x for chunk in pipe.execute() for x in chunk]
+            return {id: bson.decode(x) for id, x in zip(ids, values) if x is not None}
+        return self._run(get) or {}
+
+    def put_many(self, collection: str, docs: List[dict]) -> None:
+        def put(client):
+            if not docs:
+                return
+            pipe = client.pipeline(transaction=False)
+            for doc in docs:
+                pipe.set(self._key(collection, doc['_id']),
+                         bson.encode(doc), ex=self.ttl)
+            self._add_known(client, collection, [
+                            str(x['_id']) for x in docs], pipe)
+        self._run(put)
+
+    def invalidate(self, collection: str, ids: Iterable = None) -> None:
+        """Drop cached documents (all of the collection's if no `ids`)"""
+        def delete(client):
+            if ids is None:
+                keys = list(client.scan_iter(
+                    match=f'cineplex:v{KEY_VERSION}:{collection}:*', count=REDIS_BATCH_SIZE))
+                for i in range(0, len(keys), REDIS_BATCH_SIZE):
+                    client.delete(*keys[i:i+REDIS_BATCH_SIZE])
+                return
+            id_list = list(ids)
+            if id_list:
+                pipe = client.pipeline(transaction=False)
+                pipe.delete(*[self._key(collection, x) for x in id_list])
+                pipe.execute()
+        self._run(delete)
+
+    def known(self, collection: str, ids: List) -> Set:
+        """Which of `ids` are known to be in the collection"""
+        def known(client):
+            pipe = client.pipeline(transaction=False)
+            for id in ids:
+                pipe.sismember(self._known_key(collection), str(id))
+            return {id for id, x in zip(ids, pipe.execute()) if x}
+        return self._run(known) or set()
+
+    def add_known(self, collection: str, ids: Iterable) -> None:
+        if collection not in CACHED_COLLECTIONS:
+            return
+        id_list = [str(x) for x in ids]
+        if id_list:
+            self._run(lambda client: self._add_known(
+                client, collection, id_list))
+
+    def remove_known(self, collection: str, ids: Iterable = None) -> None:
+        """Forget known IDs (all of the collection's if no `ids`)"""
+        if ids is None:
+            self._run(lambda client: client.delete(
+                self._known_key(collection)))
+            return
+        id_list = [str(x) for x in ids]
+        if id_list:
+            self._run(lambda client: client.srem(
+                self._known_key(collection), *id_list))
+
+
+class DocumentCache:
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super(DocumentCache, cls).__new__(cls)
+            cls._instance.enabled = settings.db_cache
+            cls._instance.max_size = settings.db_cache_size
+            cls._instance.ttl = settings.db_cache_ttl
+            cls._instance.shared = SharedCache()
+            cls._instance._entries = OrderedDict()
+            cls._instance._lock = threading.Lock()
+            cls._instance.hits = Counter()
+            cls._instance.shared_hits = Counter()
+            cls._instance.misses = Counter()
+            atexit.register(cls._instance.log_stats)
+        return cls._instance
+
+    def cacheable(self, collection: str) -> bool:
+        return self.enabled and collection in CACHED_COLLECTIONS
+
+    def get_many(self, collection: str, ids: Iterable) -> Tuple[Dict, List]:
+        """The cached documents by ID, and the IDs that missed"""
+        found = {}
+        missing = []
+        now = time.monotonic()
+        with self._lock:
+            for id in ids:
+                key = (collection, id)
+                entry = self._entries.get(key)
+                if entry is None or entry[0] < now:
+                    if entry is not None:
+                        del self._entries[key]
+                    missing.append(id)
+                    continue
+                self._entries.move_to_end(key)
+                found[id] = entry[1]
+        found = {id: copy.deepcopy(doc) for id, doc in found.items()}
+
+        shared_found = self.shared.get_many(
+            collection, missing) if missing else {}
+        if shared_found:
+            self._put_local(collection, shared_found.values())
+            found.update(shared_found)
+            missing = [x for x in missing if x not in shared_found]
+
+        with self._lock:
+            self.hits[collection] += len(found) - len(shared_found)
+            self.shared_hits[collection] += len(shared_found)
+            self.misses[collection] += len(missing)
+        return found, missing
+
+    def _put_local(self, collection: str, docs: Iterable[dict]) -> None:
+        expires = time.monotonic() + self.ttl
+        entries = [((collection, x['_id']), (expires, copy.deepcopy(x)))
+                   for x in docs]
+        with self._lock:
+            for key, entry in entries:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def put_many(self, collection: str, docs: Iterable[dict]) -> None:
+        docs = list(docs)
+        self._put_local(collection, docs)
+        self.shared.put_many(collection, docs)
+
+    def invalidate(self, collection: str, ids: Iterable = None) -> None:
+        """Drop cached documents (all of the collection's if no `ids`)"""
+        ids = list(ids) if ids is not None else None
+        with self._lock:
+            if ids is None:
+                for key in [x for x in self._entries if x[0] == collection]:
+                    del self._entries[key]
+            else:
+                for id in ids:
+                    self._entries.pop((collection, id), None)
+        if collection in CACHED_COLLECTIONS:
+            self.shared.invalidate(collection, ids)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Local hits, shared (Redis) hits, misses and hit rate per collection"""
+        with self._lock:
+            stats = {}
+            for x in sorted(set(self.hits) | set(self.shared_hits) | set(self.misses)):
+                total = self.hits[x] + self.shared_hits[x] + self.misses[x]
+                if total:
+                    stats[x] = {
+                        'hits': self.hits[x],
+                        'shared_hits': self.shared_hits[x],
+                        'misses': self.misses[x],
+                        'hit_rate': round(100 * (total - self.misses[x]) / total),
+                    }
+            return stats
+
+    def log_stats(self) -> None:
+        for collection, stats in self.stats().items():
+            Logger().info(
+                f"Document cache {collection}: {stats['hits']} hits, {stats['shared_hits']} shared hits, {stats['misses']} misses ({stats['hit_rate']}%)")
@@ -0,0 +1,183 @@
+import glob
+import gzip
+import json
+import multiprocessing
+import os
+import queue
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+from typing import Callable, Dict, List
+#
+from bson import json_util
+from pymongo.errors import BulkWriteError
+#
+from cineplex.db import get_db, invalidate
+from cineplex.logger import Logger
+from cineplex.config import Settings
+
+settings = Settings()
+
+#
+# Export / import
+#
+# `export_db` streams each `yt_*` collection to `<dir>/<collection>.<part>.ndjson.gz`
+# files of `chunk_size` documents (MongoDB extended JSON, one per line), one
+# worker process per collection at a time, and writes `manifest.json` with
+# the document count of each collection. `import_db` reads them back with
+# unordered bulk inserts. Documents are streamed through both ways, so
+# memory stays flat whatever the size of a collection.
+#
+# Workers report progress (collection, documents) on a queue, which the
+# caller's `on_progress` is called with from the main process.
+#
+
+MANIFEST = 'manifest.json'
+
+# documents between progress reports
+PROGRESS_EVERY = 1000
+
+# documents per insert_many
+INSERT_BATCH_SIZE = 1000
+
+# "duplicate key", i.e. the document is already there
+DUPLICATE_KEY = 11000
+
+
+def _part_path(dir: str, name: str, part: int) -> str:
+    return os.path.join(dir, f'{name}.{part:04d}.ndjson.gz')
+
+
+def _export_collection(name: str, dir: str, chunk_size: int, progress) -> int:
+    count = 0
+    pending = 0
+    f = None
+    try:
+        for doc in get_db()[name].find(batch_size=INSERT_BATCH_SIZE):
+            if count % chunk_size == 0:
+                if f is not None:
+                    f.close()
+                f = gzip.open(_part_path(dir, name, count // chunk_size), 'wt')
+            f.write(json_util.dumps(doc) + '\n')
+            count += 1
+            pending += 1
+            if pending == PROGRESS_EVERY:
+                progress.put((name, pending))
+                pending = 0
+    finally:
+        if f is not None:
+            f.close()
+    progress.put((name, pending))
+    return count
+
+
+def _insert(collection, docs: List[dict]) -> int:
+    """Insert unordered, skipping documents already there"""
+    try:
+        return len(collection.insert_many(docs, ordered=False).inserted_ids)
+    except BulkWriteError as e:
+        errors = [x for x in e.details['writeErrors']
+                  if x['code'] != DUPLICATE_KEY]
+        for error in errors:
+            Logger().error(
+                f"Unable to import {collection.name} {docs[error['index']]['_id']}: {error['errmsg']}")
+        return e.details['nInserted']
+
+
+def _import_collection(name: str, dir: str, drop: bool, progress) -> int:
+    collection = get_db()[name]
+    if drop:
+        collection.drop()
+    count = 0
+    for path in sorted(glob.glob(os.path.join(dir, f'{name}.*.ndjson.gz'))):
+        with gzip.open(path, 'rt') as f:
+            docs = []
+            for line in f:
+                docs.append(json_util.loads(line))
+                if len(docs) == INSERT_BATCH_SIZE:
+                    count += _insert(collection, docs)
+                    progress.put((name, len(docs)))
+                    docs = []
+            if docs:
+                count += _insert(collection, docs)
+                progress.put((name, len(docs)))
+    return count
+
+
+def _run(fn, names: List[str], args: tuple, workers: int, on_progress: Callable, on_done: Callable) -> Dict[str, int]:
+    """Run `fn(name, *args, progress)` for each collection on a process pool"""
+    counts = {}
+    with multiprocessing.Manager() as manager:
+        progress = manager.Queue()
+        with ProcessPoolExecutor(max_workers=max(workers, 1)) as executor:
+            futures = {executor.submit(fn, name, *args, progress): name
+                       for name in names}
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=0.5,
+                                     return_when=FIRST_COMPLETED)
+                while True:
+                    try:
+                        name, n = progress.get_nowait()
+                    except queue.Empty:
+                        break
+                    if on_progress is not None:
+                        on_progress(name, n)
+                for future in done:
+                    name = futures[future]
+                    try:
+                        counts[name] = future.result()
+                    except Exception as e:
+                        Logger().error(f"Unable to process {name}: {e}")
+                        continue
+                    if on_done is not None:
+                        on_done(name, counts[name])
+    return counts
+
+
+def export_collection_names() -> List[str]:
+    return sorted(x for x in get_db().list_collection_names() if x.startswith('yt_'))
+
+
+def export_db(dir: str, collections: List[str] = None, workers: int = 4, chunk_size: int = 100000,
+              on_progress: Callable = None, on_done: Callable = None) -> Dict[str, int]:
+    """Export collections (all `yt_*` ones by default), returning the count of each"""
+    os.makedirs(dir, exist_ok=True)
+    names = collections or export_collection_names()
+    for path in glob.glob(os.path.join(dir, '*.ndjson.gz')):
+        if os.path.basename(path).split('.')[0] in names:
+            os.remove(path)
+
+    counts = _run(_export_collection, names, (dir, chunk_size),
+                  workers, on_progress, on_done)
+
+    # a partial export keeps the other collections of an earlier one
+    try:
+        manifest = read_manifest(dir)
+    except (OSError, ValueError):
+        manifest = {'collections': {}}
+    manifest['as_of'] = datetime.utcnow().isoformat()
+    manifest['collections'].update(counts)
+    with open(os.path.join(dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return counts
+
+
+def read_manifest(dir: str) -> dict:
+    with open(os.path.join(dir, MANIFEST)) as f:
+        return json.load(f)
+
+
+def import_db(dir: str, collections: List[str] = None, workers: int = 4, drop: bool = False,
+              on_progress: Callable = None, on_done: Callable = None) -> Dict[str, int]:
+    """
+    Import an export (all of its collections by default), returning the
+    count of documents inserted into each. Documents already in the
+    database are kept unless the collections are dropped first.
+    """
+    names = collections or sorted(read_manifest(dir)['collections'])
+    counts = _run(_import_collection, names, (dir, drop),
+                  workers, on_progress, on_done)
+    if drop:
+        for name in names:
+            invalidate(get_db()[name], deleted=True)
+    return counts
@@ -0,0 +1,167 @@
+import os
+import socket
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List
+#
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+#
+from cineplex.db import find_in, get_db
+from cineplex.logger import Logger
+from cineplex.config import Settings
+
+settings = Settings()
+
+#
+# Job queue
+#
+# Jobs of a kind live in the `yt_<kind>_jobs` collection (so `db export`
+# keeps them), one document per key, e.g. a video ID in `yt_download_jobs`,
+# so enqueueing is idempotent and a queue survives the process that filled
+# it. A job goes queued -> running -> done, or back to queued when an
+# attempt fails, until `jobs_max_attempts` attempts have failed and it is
+# failed for good.
+#
+# A worker claims a job atomically (`find_one_and_update`) and holds a lease
+# on it for `jobs_lease_seconds`, renewed by a heartbeat while it works. A
+# running job whose lease expired (its worker died) can be claimed again, so
+# any number of workers can come and go while a queue drains.
+#
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def worker_id() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}'
+
+
+class JobQueue:
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.lease = timedelta(seconds=settings.jobs_lease_seconds)
+        self.max_attempts = settings.jobs_max_attempts
+
+    @property
+    def collection(self):
+        return get_db()[f'yt_{self.kind}_jobs']
+
+    def _id(self, key: str) -> str:
+        return f'{self.kind}:{key}'
+
+    def enqueue(self, keys: Iterable[str], reset: bool = False) -> int:
+        """
+        Queue a job per key, returning how many were (re)queued. Jobs that
+        already exist are left alone, except failed ones (and, with `reset`,
+        done ones), which are queued again with their attempts reset.
+        """
+        now = datetime.utcnow()
+        requeue = [FAILED, DONE] if reset else [FAILED]
+        ops = []
+        for key in dict.fromkeys(keys):
+            ops.append(UpdateOne(
+                {'_id': self._id(key)},
+                {'$setOnInsert': {'kind': self.kind, 'key': key, 'state': QUEUED,
+                                  'attempts': 0, 'created_at': now, 'updated_at': now}},
+                upsert=True))
+            ops.append(UpdateOne(
+                {'_id': self._id(key), 'state': {'$in': requeue}},
+                {'$set': {'state': QUEUED, 'attempts': 0, 'updated_at': now},
+                 '$unset': {'error': ''}}))
+        if not ops:
+            return 0
+        res = self.collection.bulk_write(ops, ordered=False)
+        return res.upserted_count + res.modified_count
+
+    def claim(self, worker: str, keys: Iterable[str] = None) -> dict:
+        """Take the oldest claimable job (of `keys`), or None if there is none"""
+        now = datetime.utcnow()
+        filter = {'kind': self.kind,
+                  '$or': [{'state': QUEUED},
+                          {'state': RUNNING, 'lease_expires': {'$lt': now}}],
+                  'attempts': {'$lt': self.max_attempts}}
+        if keys is not None:
+            filter['_id'] = {'$in': [self._id(x) for x in keys]}
+        return self.collection.find_one_and_update(
+            filter,
+            {'$set': {'state': RUNNING, 'worker': worker,
+                      'lease_expires': now + self.lease, 'updated_at': now},
+             '$inc': {'attempts': 1}},
+            sort=[('created_at', ASCENDING)],
+            return_document=ReturnDocument.AFTER)
+
+    def renew(self, job: dict) -> bool:
+        """Extend a job's lease, False if the worker no longer holds it"""
+        now = datetime.utcnow()
+        res = self.collection.update_one(
+            {'_id': job['_id'], 'state': RUNNING, 'worker': job['worker']},
+            {'$set': {'lease_expires': now + self.lease, 'updated_at': now}})
+        return res.matched_count == 1
+
+    @contextmanager
+    def heartbeat(self, job: dict):
+        """Keep renewing a job's lease while the block runs"""
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(self.lease.total_seconds() / 3):
+                if not self.renew(job):
+                    Logger().warning(f"Lost the lease on job {job['_id']}")
+                    return
+
+        thread = threading.Thread(
+            target=beat, name=f"heartbeat-{job['_id']}", daemon=True)
+        thread.start()
+        try:
+            yield job
+        finally:
+            stop.set()
+            thread.join()
+
+    def complete(self, job: dict) -> None:
+        self.collection.update_one(
+            {'_id': job['_id'], 'worker': job['worker']},
+            {'$set': {'state': DONE, 'updated_at': datetime.utcnow()},
+             '$unset': {'lease_expires': '', 'error': ''}})
+
+    def fail(self, job: dict, error: str) -> None:
+        """Record a failed attempt: queued again, or failed after the last attempt"""
+        state = FAILED if job['attempts'] >= self.max_attempts else QUEUED
+        self.collection.update_one(
+            {'_id': job['_id'], 'worker': job['worker']},
+            {'$set': {'state': state, 'error': error, 'updated_at': datetime.utcnow()},
+             '$unset': {'lease_expires': ''}})
+
+    def reap(self) -> int:
+        """Fail the jobs whose last attempt's worker died, returning how many"""
+        now = datetime.utcnow()
+        res = self.collection.update_many(
+            {'kind': self.kind, 'state': RUNNING,
+             'lease_expires': {'$lt': now},
+             'attempts': {'$gte': self.max_attempts}},
+            {'$set': {'state': FAILED, 'error': 'lease expired', 'updated_at': now},
+             '$unset': {'lease_expires': ''}})
+        return res.modified_count
+
+    def counts(self) -> Dict[str, int]:
+        """The number of jobs in each state"""
+        return {x['_id']: x['count'] for x in self.collection.aggregate([
+            {'$match': {'kind': self.kind}},
+            {'$group': {'_id': '$state', 'count': {'$sum': 1}}},
+        ])}
+
+    def find(self, keys: Iterable[str] = None, state: str = None) -> List[dict]:
+        """Jobs (of `keys`, in `state`), oldest first"""
+        if keys is not None:
+            jobs = find_in(self.collection, [self._id(x) for x in keys])
+            jobs = [x for x in jobs if state is None or x['state'] == state]
+            return sorted(jobs, key=lambda x: x['created_at'])
+        filter = {'kind': self.kind}
+        if state is not None:
+            filter['state'] = state
+        return list(self.collection.find(filter).sort('created_at', ASCENDING))
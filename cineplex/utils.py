@@ -1,6 +1,8 @@
 from enum import Enum
+from datetime import timedelta
 import json
 import os
+import re
 import shutil
 import hashlib
 import typer
@@ -79,10 +81,24 @@ def missing_found(id_batch, meta_batch):
     if not meta_batch:
         return id_batch, []
     found_id_batch = [x['_id'] for x in meta_batch]
-    missing_id_batch = [x for x in id_batch if x not in found_id_batch]
+    found = set(found_id_batch)
+    missing_id_batch = [x for x in id_batch if x not in found]
     return missing_id_batch, found_id_batch
 
 
+DURATION_UNITS = {'s': 'seconds', 'm': 'minutes',
+                  'h': 'hours', 'd': 'days', 'w': 'weeks'}
+
+
+def parse_duration(text):
+    """ Parse a duration like `90m`, `12h` or `7d` into a timedelta """
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([smhdw])\s*', text)
+    if not match:
+        raise ValueError(
+            f"invalid duration {text!r} (expected e.g. 90m, 12h, 7d or 2w)")
+    return timedelta(**{DURATION_UNITS[match.group(2)]: float(match.group(1))})
+
+
 def ensure_batch_impl(id_batch, db_fn, sync_fn, force: bool = False):
     """ Get metadata for a batch of IDs from the database or from YouTube. """
     if force:
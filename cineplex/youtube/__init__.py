@@ -5,6 +5,8 @@ from datetime import datetime
 import typer
 #
 import cineplex.youtube.channel as channel
+import cineplex.youtube.playlist as playlist
+from cineplex.youtube.cache import ResponseCache
 
 
 #
@@ -48,6 +50,13 @@ import cineplex.youtube.channel as channel
 #
 cli = typer.Typer()
 cli.add_typer(channel.cli, name='channel')
+cli.add_typer(playlist.cli, name='playlist')
+
+
+@cli.callback()
+def main(no_cache: bool = typer.Option(False, '--no-cache', help="Bypass the YouTube API response cache")):
+    if no_cache:
+        ResponseCache().enabled = False
 
 if __name__ == "__main__":
     cli()
@@ -0,0 +1,184 @@
+import asyncio
+import json
+import urllib.parse
+from collections import namedtuple
+#
+import aiohttp
+import httplib2
+from googleapiclient.errors import HttpError
+#
+from cineplex.logger import Logger
+from cineplex.config import Settings
+from cineplex.youtube.api import fake_youtube, youtube_credentials
+from cineplex.youtube.cache import ResponseCache
+from cineplex.youtube.quota import QuotaDeferred, QuotaScheduler, cost_of, http_error_reason
+from cineplex.youtube.ratelimit import backoff_delay, is_server_error, is_throttled, write_limiter
+
+settings = Settings()
+
+#
+# asyncio client
+#
+# googleapiclient blocks, so the sync paths built on it keep one request in
+# flight per thread. `AsyncYouTube` speaks to the handful of endpoints
+# cineplex uses directly over a pooled keep-alive aiohttp session, with a
+# semaphore bounding the requests in flight. Requests go through the same
+# response cache, quota budget, retry policy and fake API as the blocking
+# client, and errors are raised as googleapiclient `HttpError`s so callers
+# handle both alike.
+#
+
+base_url = 'https://youtube.googleapis.com/youtube/v3/'
+
+# what the response cache needs to know about a request
+_CachedRequest = namedtuple('_CachedRequest', 'method uri')
+
+
+def _encode_params(params: dict) -> str:
+    query = {}
+    for k, v in params.items():
+        if v is None:
+            continue
+        if isinstance(v, (list, tuple, set)):
+            v = ','.join(v)
+        elif isinstance(v, bool):
+            v = 'true' if v else 'false'
+        query[k] = v
+    return urllib.parse.urlencode(sorted(query.items()))
+
+
+class AsyncYouTube:
+    """
+    asyncio YouTube Data API client, used as an async context manager:
+
+        async with AsyncYouTube() as youtube:
+            items = await youtube.list_all('playlistItems', part='snippet', playlistId=...)
+    """
+
+    def __init__(self, concurrency: int = None):
+        self.concurrency = concurrency or settings.youtube_max_concurrency
+        self.semaphore = None
+        self.session = None
+        self.fake = fake_youtube() if settings.youtube_fake else None
+
+    async def __aenter__(self):
+        # created here so it belongs to the running loop
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        if self.fake is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.concurrency, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=60))
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def _send(self, method, url, headers, body):
+        """One HTTP round trip, returning (status, content)"""
+        if self.fake is not None:
+            self.fake.round_trip()
+            if self.fake.latency:
+                await asyncio.sleep(self.fake.latency)
+            status, response = self.fake.handle(method, url, headers, body)
+            return status, json.dumps(response).encode() if response is not None else b''
+
+        # a near-expiry token is refreshed with a blocking HTTP call
+        credentials = await asyncio.to_thread(youtube_credentials)
+        headers = dict(headers, Authorization=f'Bearer {credentials.token}')
+        async with self.session.request(method, url, headers=headers, data=body) as resp:
+            return resp.status, await resp.read()
+
+    async def execute(self, method: str, resource: str, params: dict, body: dict = None, etag: str = None):
+        """
+        Make one API call, returning the response, or None if `etag` is
+        given and the resource hasn't changed (304 Not Modified). Throttled
+        calls are retried with backoff, as are 5xx responses to reads.
+        """
+        endpoint = f"{resource}.{'list' if method == 'GET' else 'insert'}"
+        url = f'{base_url}{resource}?{_encode_params(params)}'
+
+        cache = ResponseCache()
+        response = cache.get(endpoint, _CachedRequest(method, url))
+        if response is not None:
+            return None if etag and response.get('etag') == etag else response
+
+        headers = {'Accept': 'application/json'}
+        if etag:
+            headers['If-None-Match'] = etag
+        data = None
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+            data = json.dumps(body)
+
+        scheduler = QuotaScheduler()
+        limiter = write_limiter() if method != 'GET' else None
+        attempt = 0
+        while True:
+            await asyncio.to_thread(scheduler.reserve, endpoint)
+            if limiter is not None:
+                await asyncio.to_thread(limiter.acquire)
+
+            async with self.semaphore:
+                status, content = await self._send(method, url, headers, data)
+
+            if status < 300:
+                if limiter is not None:
+                    limiter.on_success()
+                response = json.loads(content) if content else {}
+                if method == 'GET':
+                    cache.put(endpoint, _CachedRequest(method, url), response)
+                else:
+                    cache.purge(resource)
+                return response
+
+            if status == 304:
+                return None
+
+            e = HttpError(httplib2.Response(
+                {'status': str(status)}), content, uri=url)
+            if http_error_reason(e) in ('quotaExceeded', 'dailyLimitExceeded'):
+                scheduler.exhaust()
+                raise QuotaDeferred(endpoint, cost_of(endpoint), 0) from e
+
+            throttled = is_throttled(e)
+            if throttled and limiter is not None:
+                limiter.on_throttle()
+            retry = throttled or (method == 'GET' and is_server_error(e))
+            if not retry or attempt >= settings.youtube_max_retries:
+                raise e
+
+            delay = backoff_delay(attempt)
+            Logger().warning(
+                f"Retrying {endpoint} in {delay:.1f}s (attempt {attempt + 1}/{settings.youtube_max_retries}): {e}")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def list(self, resource: str, etag: str = None, **params):
+        """One page of `resource.list`"""
+        return await self.execute('GET', resource, params, etag=etag)
+
+    async def list_pages(self, resource: str, **params):
+        """Iterate over the pages of `resource.list`, in order"""
+        page_token = params.pop('pageToken', None)
+        while True:
+            response = await self.list(resource, pageToken=page_token, **params)
+            yield response
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+
+    async def list_all(self, resource: str, **params) -> list:
+        """The items of every page of `resource.list`"""
+        items = []
+        async for response in self.list_pages(resource, **params):
+            items.extend(response.get('items', []))
+        return items
+
+    async def insert(self, resource: str, body: dict, **params):
+        return await self.execute('POST', resource, params, body=body)
@@ -1,23 +1,153 @@
+import atexit
 import os
 import pickle
+import hashlib
+import json
+import threading
+from datetime import datetime, timedelta
+from functools import lru_cache
 #
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build_from_document
+#
+from cineplex.logger import Logger
+from cineplex.config import Settings
+from cineplex.youtube.quota import QuotaDeferred, QuotaScheduler, endpoint_of, http_error_reason
+from cineplex.youtube.cache import ResponseCache
 
+settings = Settings()
+
+api_service_name = "youtube"
+api_version = "v3"
+scopes = ["https://www.googleapis.com/auth/youtube"]
+client_secrets_file = "youtube.keys.json"
+token_file = "token.pickle"
+
+# refresh the access token this long before it actually expires
+refresh_margin = timedelta(minutes=5)
+
+# the YouTube Data API accepts at most 50 calls per batch request
+batch_limit = 50
+
+# pinned discovery document, trimmed to the resources cineplex uses
+discovery_file = os.path.join(
+    os.path.dirname(__file__), 'discovery', f'{api_service_name}.{api_version}.json')
+
+#
+# Field masks
+#
+# Only the fields cineplex reads are requested (partial responses), and the
+# same masks are used to slim documents before they are persisted, see
+# https://developers.google.com/youtube/v3/getting-started#fields
+#
+
+channel_fields = (
+    "etag,nextPageToken,"
+    "items(id,etag,"
+    "snippet(title,description,publishedAt,thumbnails/high/url),"
+    "statistics(subscriberCount,viewCount,videoCount),"
+    "contentDetails/relatedPlaylists(likes,uploads),"
+    "brandingSettings/channel/keywords)"
+)
+
+playlist_fields = (
+    "etag,nextPageToken,"
+    "items(id,etag,"
+    "snippet(title,description,publishedAt,channelId,channelTitle),"
+    "contentDetails/itemCount)"
+)
+
+playlist_item_fields = (
+    "etag,nextPageToken,"
+    "items(id,etag,"
+    "snippet(title,channelTitle,videoOwnerChannelId,videoOwnerChannelTitle,publishedAt,position,resourceId/videoId),"
+    "contentDetails(videoId,videoPublishedAt))"
+)
+
+
+@lru_cache(maxsize=None)
+def parse_fields(fields: str) -> dict:
+    """Parse a `fields` mask into a nested dict (True marks a leaf)"""
+
+    def parse(i):
+        spec = {}
+        path = []
+        name = ''
+        while i < len(fields):
+            c = fields[i]
+            if c in ',)':
+                if name:
+                    path.append(name)
+                    _add_path(spec, path, True)
+                path, name = [], ''
+                if c == ')':
+                    return spec, i + 1
+                i += 1
+            elif c == '/':
+                path.append(name)
+                name = ''
+                i += 1
+            elif c == '(':
+                path.append(name)
+                sub, i = parse(i + 1)
+                _add_path(spec, path, sub)
+                path, name = [], ''
+                if i < len(fields) and fields[i] == ',':
+                    i += 1
+            else:
+                name += c
+                i += 1
+        if name:
+            path.append(name)
+            _add_path(spec, path, True)
+        return spec, i
+
+    return parse(0)[0]
+
+
+def _add_path(spec, path, leaf):
+    for name in path[:-1]:
+        spec = spec.setdefault(name, {})
+    spec[path[-1]] = leaf
+
+
+def slim(data, spec):
+    """Project `data` (dicts and lists of dicts) through a parsed mask"""
+    if spec is True:
+        return data
+    if isinstance(data, list):
+        return [slim(x, spec) for x in data]
+    if not isinstance(data, dict):
+        return data
+    return {k: slim(data[k], v) for k, v in spec.items() if k in data}
 
-def youtube_api():
-    """
-    Disable OAuthlib's HTTPS verification when running locally.
-    NOTE: *DO NOT* leave this option enabled in production.
-    """
-    os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
 
-    api_service_name = "youtube"
-    api_version = "v3"
-    scopes = ["https://www.googleapis.com/auth/youtube"]
-    client_secrets_file = "youtube.keys.json"
-    token_file = "token.pickle"
+def slim_items(items, fields: str):
+    """Slim a list of API items with the `items(...)` part of a mask"""
+    return slim(items, parse_fields(fields)['items'])
+
+
+#
+# Process-wide client cache
+#
+# googleapiclient services (and the httplib2 transport underneath them) are
+# not thread-safe, so each thread gets its own service, while the credentials
+# are loaded once and shared by all of them.
+#
+
+_lock = threading.Lock()
+_local = threading.local()
+_credentials = None
+_stats = {'hits': 0, 'misses': 0, 'refreshes': 0}
+_discovery = None
+_fake = None
+
+
+def _load_credentials():
+    """Load credentials from the token file, or run the OAuth flow"""
     credentials = None
 
     if os.path.exists(token_file):
@@ -33,7 +163,251 @@ def youtube_api():
             credentials = flow.run_local_server(
                 port=8080, prompty="consent", authorization_prompt_message="")
 
-        with open(token_file, "wb") as token:
-            pickle.dump(credentials, token)
+        _save_credentials(credentials)
+
+    return credentials
+
+
+def _save_credentials(credentials):
+    with open(token_file, "wb") as token:
+        pickle.dump(credentials, token)
+
+
+def _near_expiry(credentials):
+    # google-auth keeps `expiry` as a naive UTC datetime
+    if not credentials.expiry:
+        return False
+    return credentials.expiry - refresh_margin <= datetime.utcnow()
+
+
+def _ensure_credentials():
+    """Return the shared credentials, refreshing them if near expiry"""
+    global _credentials
+
+    with _lock:
+        if _credentials is None:
+            _credentials = _load_credentials()
+        elif _near_expiry(_credentials) and _credentials.refresh_token:
+            _credentials.refresh(Request())
+            _save_credentials(_credentials)
+            _stats['refreshes'] += 1
+        return _credentials
+
+
+def youtube_credentials():
+    """The shared credentials, refreshed if near expiry"""
+    return _ensure_credentials()
+
+
+def _load_discovery():
+    """
+    Load the bundled discovery document.
+
+    The parsed document is pickled under `tmp_dir`, keyed by a digest of the
+    bundled file, so only the first run after an upgrade pays for parsing.
+    """
+    with open(discovery_file, 'rb') as f:
+        raw = f.read()
+
+    digest = hashlib.sha1(raw).hexdigest()[:12]
+    cache_file = os.path.join(
+        settings.tmp_dir, f'{api_service_name}.{api_version}.{digest}.pickle')
+
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'rb') as f:
+                return pickle.load(f)
+        except Exception:
+            pass
+
+    discovery = json.loads(raw)
+
+    os.makedirs(settings.tmp_dir, exist_ok=True)
+    tmp_file = f'{cache_file}.{os.getpid()}'
+    with open(tmp_file, 'wb') as f:
+        pickle.dump(discovery, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, cache_file)
+
+    return discovery
+
+
+def discovery_document():
+    """The parsed discovery document (loaded once per process)"""
+    global _discovery
+
+    with _lock:
+        if _discovery is None:
+            _discovery = _load_discovery()
+        return _discovery
+
+
+def build_youtube_api(credentials=None, http=None):
+    """Build a service from the bundled discovery document (no network)"""
+    return build_from_document(
+        discovery_document(), credentials=credentials, http=http)
+
+
+def fake_youtube():
+    """
+    The process-wide fake API, serving `youtube_fake` or recording into
+    `youtube_record` (saved on exit), see `cineplex.youtube.fake`.
+    """
+    # imported here as the fake reuses this module's field mask helpers
+    from cineplex.youtube.fake import FakeYouTube
+    global _fake
+
+    with _lock:
+        if _fake is None:
+            if settings.youtube_fake:
+                _fake = FakeYouTube.load(
+                    settings.youtube_fake,
+                    latency=settings.youtube_fake_latency,
+                    quota=settings.youtube_fake_quota,
+                    write_rate=settings.youtube_fake_write_rate)
+                atexit.register(
+                    lambda: Logger().info(f"Fake YouTube API: {_fake.summary()}"))
+            else:
+                _fake = FakeYouTube()
+                atexit.register(_fake.save, settings.youtube_record)
+        return _fake
+
+
+def _youtube_http(credentials):
+    """The transport to build services on (None for googleapiclient's own)"""
+    from cineplex.youtube.fake import FakeHttp, RecordingHttp
+
+    if settings.youtube_fake:
+        return FakeHttp(fake_youtube())
+    if settings.youtube_record:
+        return RecordingHttp(AuthorizedHttp(credentials, http=httplib2.Http()), fake_youtube())
+    return None
+
+
+def youtube_api():
+    """
+    Return this thread's YouTube service, building it on first use.
+
+    Disable OAuthlib's HTTPS verification when running locally.
+    NOTE: *DO NOT* leave this option enabled in production.
+    """
+    os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
+
+    # the fake API needs no credentials
+    credentials = None if settings.youtube_fake else _ensure_credentials()
+
+    service = getattr(_local, 'service', None)
+    if service is not None and _local.credentials is credentials:
+        with _lock:
+            _stats['hits'] += 1
+        return service
+
+    http = _youtube_http(credentials)
+    service = build_youtube_api(
+        credentials=credentials if http is None else None, http=http)
+    _local.service = service
+    _local.credentials = credentials
+    with _lock:
+        _stats['misses'] += 1
+    return service
+
+
+def youtube_api_stats():
+    """Client cache hit/miss and credential refresh counters"""
+    with _lock:
+        return dict(_stats)
+
+
+def reset_youtube_api():
+    """Forget the shared credentials and the calling thread's service"""
+    global _credentials
+
+    with _lock:
+        _credentials = None
+        for key in _stats:
+            _stats[key] = 0
+    _local.__dict__.clear()
+
+
+#
+# Batch requests
+#
+
+
+def execute_paged_batch(youtube, resource: str, requests: dict) -> dict:
+    """
+    Page through a set of list requests using batch HTTP requests.
+
+    `requests` maps a key to the request for its first page on
+    `youtube.<resource>()`. Up to `batch_limit` calls go out per round trip;
+    continuation pages are scheduled into later batches, so each key's pages
+    are still fetched in order. Returns a dict of key -> items for every key
+    that was paged through completely, in the order of `requests`.
+    """
+    scheduler = QuotaScheduler()
+    cache = ResponseCache()
+    collection = getattr(youtube, resource)()
+
+    items = {key: [] for key in requests}
+    failed = set()
+    pending = list(requests.items())
+
+    while pending:
+        chunk, pending = pending[:batch_limit], pending[batch_limit:]
+        responses = {}
+        deferred = False
+        quota_exceeded = False
+
+        def callback(request_id, response, exception):
+            nonlocal quota_exceeded
+            if exception is None:
+                responses[request_id] = response
+            elif http_error_reason(exception) in ('quotaExceeded', 'dailyLimitExceeded'):
+                quota_exceeded = True
+            else:
+                Logger().error(f"{resource}.list failed for {request_id}: {exception}")
+
+        # pages still fresh in the response cache don't go out at all
+        uncached = []
+        for key, request in chunk:
+            response = cache.get(endpoint_of(request), request)
+            if response is not None:
+                responses[key] = response
+            else:
+                uncached.append((key, request))
+
+        if uncached:
+            batch = youtube.new_batch_http_request(callback=callback)
+            for key, request in uncached:
+                batch.add(request, request_id=key)
+
+            try:
+                scheduler.execute_batch(batch, [x for _, x in uncached])
+            except QuotaDeferred as e:
+                Logger().warning(e)
+                deferred = True
+
+            for key, request in uncached:
+                if key in responses:
+                    cache.put(endpoint_of(request), request, responses[key])
+
+        for key, request in chunk:
+            response = responses.get(key)
+            if response is None:
+                failed.add(key)
+                continue
+            if 'items' not in response:
+                continue
+            items[key].extend(response['items'])
+            next_request = collection.list_next(request, response)
+            if next_request:
+                pending.append((key, next_request))
+
+        if quota_exceeded:
+            scheduler.exhaust()
+        if deferred or quota_exceeded:
+            failed.update(key for key, _ in pending)
+            Logger().warning(
+                f"Quota exhausted, deferred {len(failed)} {resource} listing(s)")
+            break
 
-    return build(api_service_name, api_version, credentials=credentials)
+    return {key: x for key, x in items.items() if key not in failed}
@@ -0,0 +1,144 @@
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+#
+from cineplex.logger import Logger
+from cineplex.config import Settings
+
+settings = Settings()
+
+#
+# Response cache
+#
+# YouTube API GET responses are cached on disk under `tmp_dir`, keyed by the
+# request URI (which carries all the query parameters), so re-running a
+# command within an endpoint's TTL costs no quota. Files are touched on every
+# hit, and the least recently used ones are evicted beyond the size cap.
+#
+
+# seconds a cached response stays fresh, per endpoint
+CACHE_TTLS = {
+    'channels.list': 24 * 3600,
+    'playlists.list': 6 * 3600,
+    'playlistItems.list': 3600,
+    'videos.list': 6 * 3600,
+}
+
+
+class ResponseCache:
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super(ResponseCache, cls).__new__(cls)
+            cls._instance.enabled = settings.youtube_cache
+            # never mix responses of the fake API with real ones
+            cls._instance.dir = os.path.join(
+                settings.tmp_dir, 'yt_cache_fake' if settings.youtube_fake else 'yt_cache')
+            cls._instance.max_bytes = settings.youtube_cache_max_mb * 1024 * 1024
+            cls._instance._lock = threading.Lock()
+            cls._instance._size = None
+        return cls._instance
+
+    def _path(self, endpoint, request):
+        digest = hashlib.sha256(
+            f'{request.method} {request.uri}'.encode()).hexdigest()
+        return os.path.join(self.dir, f'{endpoint}.{digest}.json')
+
+    def _cacheable(self, endpoint, request):
+        return self.enabled and request.method == 'GET' and endpoint in CACHE_TTLS
+
+    def get(self, endpoint, request):
+        """Return the cached response for `request`, if still fresh"""
+        if not self._cacheable(endpoint, request):
+            return None
+
+        path = self._path(endpoint, request)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if time.time() - entry['as_of'] > CACHE_TTLS[endpoint]:
+            self._remove(path)
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            # evicted or purged since it was read
+            return None
+        return entry['response']
+
+    def put(self, endpoint, request, response) -> None:
+        if not self._cacheable(endpoint, request):
+            return
+
+        os.makedirs(self.dir, exist_ok=True)
+        path = self._path(endpoint, request)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'as_of': time.time(), 'response': response}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            Logger().warning(f"Unable to cache {endpoint} response: {e}")
+            return
+
+        with self._lock:
+            if self._size is not None:
+                self._size += os.path.getsize(path)
+        self.evict()
+
+    def purge(self, resource: str = None) -> int:
+        """Drop cached responses (of one resource, e.g. `playlistItems`)"""
+        pattern = f'{resource}.*.json' if resource else '*.json'
+        paths = glob.glob(os.path.join(self.dir, pattern))
+        for path in paths:
+            self._remove(path)
+        return len(paths)
+
+    def _remove(self, path) -> None:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        with self._lock:
+            if self._size is not None:
+                self._size -= size
+
+    def evict(self) -> None:
+        """Remove least recently used entries until under the size cap"""
+        with self._lock:
+            if self._size is None:
+                self._size = sum(os.path.getsize(x) for x in glob.glob(
+                    os.path.join(self.dir, '*.json')))
+            if self._size <= self.max_bytes:
+                return
+
+            entries = []
+            for path in glob.glob(os.path.join(self.dir, '*.json')):
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            entries.sort()
+
+            # evict down to 90% of the cap so we don't evict on every put
+            size = sum(x[1] for x in entries)
+            target = self.max_bytes * 0.9
+            for _, entry_size, path in entries:
+                if size <= target:
+                    break
+                try:
+                    os.remove(path)
+                    size -= entry_size
+                except OSError:
+                    pass
+            self._size = size
@@ -1,4 +1,5 @@
 from operator import sub
+import asyncio
 import os
 import glob
 import pickle
@@ -7,6 +8,7 @@ from textwrap import indent
 from bson import ObjectId
 import os
 import re
+import shlex
 from datetime import datetime
 import time
 #
@@ -21,7 +23,7 @@ import ray
 from ray import serve
 from fastapi import FastAPI
 #
-from cineplex.db import PyObjectId, get_db
+from cineplex.db import BulkResult, PyObjectId, bulk_upsert, find_in_cached, find_one_cached, get_db, invalidate, touch
 from cineplex.logger import Logger
 from cineplex.config import Settings
 from cineplex.utils import (
@@ -35,7 +37,10 @@ from cineplex.utils import (
     red,
     magenta
 )
-from cineplex.youtube.api import youtube_api
+from cineplex.youtube.api import youtube_api, channel_fields
+from cineplex.youtube.aio import AsyncYouTube
+from cineplex.youtube.quota import QuotaDeferred, execute
+from cineplex.youtube.etags import SyncStats, get_page_etag, page_key
 
 settings = Settings()
 
@@ -75,9 +80,18 @@ class ChannelId(str):
         return f'ChannelId({super().__repr__()})'
 
 
+def _split_keywords(keywords: str) -> List[str]:
+    # channel keywords are space separated, with multi-word ones quoted
+    try:
+        return shlex.split(keywords)
+    except ValueError:
+        return keywords.split()
+
+
 class Channel(BaseModel):
     id: str = Field(alias="_id")
-    as_of: datetime = str(datetime.now())
+    etag: str = None
+    as_of: datetime = Field(default_factory=datetime.utcnow)
     offline: bool = False
     offline_as_of: datetime = None
 
@@ -100,18 +114,21 @@ class Channel(BaseModel):
     @classmethod
     def from_youtube(cls, data):
         channel = data['channel'] if 'channel' in data else data
-        snippet = channel['snippet']
-        statistics = channel['statistics']
-        content_details = channel['contentDetails']
-        branding = channel['brandingSettings']
+        # partial responses leave out parts that have no fields set
+        snippet = channel.get('snippet', {})
+        statistics = channel.get('statistics', {})
+        content_details = channel.get('contentDetails', {})
+        branding = channel.get('brandingSettings', {})
         return cls(
             _id=data.get('_id') if '_id' in data else data.get('id'),
+            etag=channel.get('etag'),
             as_of=data.get('as_of', datetime.utcnow()),
             offline=data.get('offline', False),
             offline_as_of=data.get('offline_as_of'),
             title=snippet.get('title'),
             description=snippet.get('description', None),
-            key_words=branding.get('keywords', []),
+            key_words=_split_keywords(
+                branding.get('channel', {}).get('keywords', '')),
             published_at=snippet.get('publishedAt', None),
             thumbnail_url=snippet.get('thumbnails', {}).get(
                 'high', {}).get('url', None),
@@ -119,9 +136,9 @@ class Channel(BaseModel):
             view_count=statistics.get('viewCount', 0),
             video_count=statistics.get('videoCount', 0),
             likes_playlist=content_details.get(
-                'relatedPlaylists').get('likes', None),
+                'relatedPlaylists', {}).get('likes', None),
             uploads_playlist=content_details.get(
-                'relatedPlaylists').get('uploads', None)
+                'relatedPlaylists', {}).get('uploads', None)
         )
 
 
@@ -154,14 +171,14 @@ def show_batch(channels: List[Channel]) -> None:
 
 def read_from_db(id: ChannelId) -> Channel:
     try:
-        return get_db().yt_channels.find_one({'_id': id})
+        return find_one_cached(get_db().yt_channels, id)
     except Exception as e:
         Logger().exception(e)
 
 
-def read_from_db_batch(ids: List[ChannelId]) -> List[Channel]:
+def read_from_db_batch(ids: List[ChannelId], projection: dict = None) -> List[Channel]:
     try:
-        return list(get_db().yt_channels.find({'_id': {'$in': list(ids)}}))
+        return find_in_cached(get_db().yt_channels, ids, projection)
     except Exception as e:
         Logger().exception(e)
 
@@ -174,14 +191,22 @@ def write_to_db(channel: Channel) -> int:
             {'$set': channel.dict(exclude_unset=True)},
             upsert=True
         )
+        invalidate(get_db().yt_channels, [channel.id])
         return res.modified_count
     except Exception as e:
         Logger().exception(e)
         return 0
 
 
-def write_to_db_batch(channels: List[Channel]) -> int:
-    return sum([write_to_db(channel) for channel in channels])
+def write_to_db_batch(channels: List[Channel]) -> BulkResult:
+    as_of = datetime.utcnow()
+    for channel in channels:
+        channel.as_of = as_of
+    res = bulk_upsert(get_db().yt_channels,
+                      [{'_id': x.id, **x.dict(exclude_unset=True)} for x in channels])
+    for id, error in res.errors.items():
+        Logger().error(f"Unable to write channel {id}: {error}")
+    return res
 
 
 def ensure_batch(ids: List[ChannelId], force: bool = False) -> List[Channel]:
@@ -192,6 +217,7 @@ def delete_from_db(id: ChannelId) -> None:
     """Delete an entity from the database"""
     try:
         x = get_db().yt_channels.delete_one({'_id': id})
+        invalidate(get_db().yt_channels, [id], deleted=True)
         return x.deleted_count
     except Exception as e:
         Logger().error(e)
@@ -202,6 +228,7 @@ def delete_from_db_batch(ids: List[ChannelId]) -> None:
     """Delete a set of entities from the database"""
     try:
         x = get_db().yt_channels.delete_many({'_id': {'$in': list(ids)}})
+        invalidate(get_db().yt_channels, ids, deleted=True)
         return x.deleted_count
     except Exception as e:
         Logger().error(e)
@@ -214,36 +241,128 @@ def read_from_youtube(id: ChannelId, save: bool = False) -> Channel:
     return res[0] if res else None
 
 
-def read_from_youtube_batch(ids: List[ChannelId], save: bool = False) -> List[Channel]:
-    """Fetch a set of entities from YouTube"""
+def read_from_youtube_batch(ids: List[ChannelId], save: bool = False, stats: SyncStats = None) -> List[Channel]:
+    """
+    Fetch a set of entities from YouTube.
+
+    Requests are conditional on the etags from the previous sync: a 304 page
+    is served from the database, and unchanged channels are not rewritten.
+    """
+    stats = stats if stats is not None else SyncStats('channels')
+    channel_batch = []
+
     try:
         youtube = youtube_api()
 
-        channel_batch = []
-
         N = 50
         for i in range(0, len(ids), N):
+            chunk = list(ids[i:i+N])
+            stored = {x['_id']: x for x in read_from_db_batch(chunk) or []}
+
+            # only a page whose channels are all stored can be skipped
+            etag_key = page_key('channels', chunk)
+            etag = get_page_etag(etag_key) if len(stored) == len(chunk) else None
+
             request = youtube.channels().list(
                 part="snippet,contentDetails,statistics,brandingSettings",
-                id=ids[i:i+N],
+                id=chunk,
                 maxResults=50,
+                fields=channel_fields,
             )
             while request:
-                response = request.execute()
+                response = execute(request, etag)
+                if response is None:
+                    for id, doc in stored.items():
+                        stats.add_unchanged(id)
+                        channel_batch.append(Channel(**doc))
+                    break
+                if 'pageToken=' not in request.uri:
+                    stats.add_page_etag(etag_key, response.get('etag'))
                 if 'items' not in response:
                     break
                 for item in response['items']:
                     channel = Channel.from_youtube(item)
+                    stats.add(channel.id, stored.get(
+                        channel.id, {}).get('etag'), channel.etag)
                     channel_batch.append(channel)
                 request = youtube.channels().list_next(request, response)
+                etag = None
 
-        if save:
-            write_to_db_batch(channel_batch)
-
-        return channel_batch
+    except QuotaDeferred as e:
+        Logger().warning(e)
 
     except Exception as e:
         Logger().exception(e)
+        return
+
+    if save:
+        write_to_db_batch(
+            [x for x in channel_batch if not stats.is_unchanged(x.id)])
+        touch(get_db().yt_channels, stats.unchanged)
+        stats.save_page_etags()
+
+    return channel_batch
+
+
+async def _read_chunk_from_youtube_async(youtube: AsyncYouTube, chunk: List[ChannelId], stats: SyncStats) -> List[Channel]:
+    stored = {x['_id']: x for x in await asyncio.to_thread(read_from_db_batch, chunk) or []}
+
+    # only a page whose channels are all stored can be skipped
+    etag_key = page_key('channels', chunk)
+    etag = await asyncio.to_thread(get_page_etag, etag_key) if len(stored) == len(chunk) else None
+
+    response = await youtube.list(
+        'channels',
+        etag=etag,
+        part="snippet,contentDetails,statistics,brandingSettings",
+        id=chunk,
+        maxResults=50,
+        fields=channel_fields,
+    )
+    if response is None:
+        for id in stored:
+            stats.add_unchanged(id)
+        return [Channel(**doc) for doc in stored.values()]
+
+    stats.add_page_etag(etag_key, response.get('etag'))
+    channel_batch = []
+    for item in response.get('items', []):
+        channel = Channel.from_youtube(item)
+        stats.add(channel.id, stored.get(
+            channel.id, {}).get('etag'), channel.etag)
+        channel_batch.append(channel)
+    return channel_batch
+
+
+async def read_from_youtube_batch_async(ids: List[ChannelId], save: bool = False, stats: SyncStats = None, youtube: AsyncYouTube = None) -> List[Channel]:
+    """Fetch a set of entities from YouTube (see `read_from_youtube_batch`), all pages at once"""
+    stats = stats if stats is not None else SyncStats('channels')
+    if youtube is None:
+        async with AsyncYouTube() as youtube:
+            return await read_from_youtube_batch_async(ids, save, stats, youtube)
+
+    N = 50
+    results = await asyncio.gather(
+        *[_read_chunk_from_youtube_async(youtube, list(ids[i:i+N]), stats)
+          for i in range(0, len(ids), N)],
+        return_exceptions=True)
+
+    channel_batch = []
+    for result in results:
+        if isinstance(result, QuotaDeferred):
+            Logger().warning(result)
+        elif isinstance(result, Exception):
+            Logger().exception(result)
+        else:
+            channel_batch.extend(result)
+
+    if save:
+        await asyncio.to_thread(
+            write_to_db_batch, [x for x in channel_batch if not stats.is_unchanged(x.id)])
+        await asyncio.to_thread(touch, get_db().yt_channels, stats.unchanged)
+        await asyncio.to_thread(stats.save_page_etags)
+
+    return channel_batch
 
 
 def ensure(Id: Channel, force: bool = False) -> Channel:
@@ -564,9 +683,11 @@ def cli_show_my():
 def cli_update(id: str) -> None:
     """Update a channel from the database."""
     channel_id = ChannelId.validate(id)
-    channel = read_from_youtube(channel_id, save=True)
-    if channel:
+    stats = SyncStats('channels')
+    channels = read_from_youtube_batch([channel_id], save=True, stats=stats)
+    if channels:
         typer.echo(f"Channel {channel_id} updated.")
+        stats.echo()
 
 
 @cli.command("update-my")
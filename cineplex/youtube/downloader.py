@@ -0,0 +1,73 @@
+import threading
+from typing import List
+#
+import ray
+import yt_dlp
+#
+from cineplex.logger import Logger
+from cineplex.config import Settings
+
+settings = Settings()
+
+#
+# Ray runtime
+#
+# `connect()` joins a running cluster (`ray_address`, `auto` finding one
+# started with `ray start`) and only starts a local runtime when there is
+# none, once per process: later calls reuse whatever is connected.
+#
+# Downloads go through `DownloaderPool`, a fixed set of
+# `youtube_download_workers` actors. Each keeps a `YoutubeDL` instance
+# (and `yt_dlp` imported) across downloads and drains the download job
+# queue, so concurrency is the size of the pool however many videos are
+# queued. The pool lives as long as the process, and the actors go away
+# with it.
+#
+
+_lock = threading.Lock()
+
+
+def connect() -> None:
+    """Connect to Ray, if not connected already"""
+    with _lock:
+        if ray.is_initialized():
+            return
+        if settings.ray_address:
+            try:
+                ray.init(address=settings.ray_address)
+                return
+            except ConnectionError:
+                Logger().info(
+                    f"No Ray cluster at {settings.ray_address}, starting a local one")
+        ray.init()
+
+
+@ray.remote
+class Downloader:
+
+    def __init__(self):
+        # imported here, `playlist` imports this module
+        from cineplex.youtube.playlist import youtube_dl_options
+        self.ydl = yt_dlp.YoutubeDL(youtube_dl_options(False))
+
+    def drain(self, keys: List[str] = None, writer=None, skip_known: bool = False) -> int:
+        """Download queued videos (of `keys`) until none are left, returning how many"""
+        from cineplex.youtube.playlist import _drain_download_jobs
+        return _drain_download_jobs(keys, False, writer, skip_known, self.ydl)
+
+
+class DownloaderPool:
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            connect()
+            cls._instance = super(DownloaderPool, cls).__new__(cls)
+            cls._instance.actors = [Downloader.remote()
+                                    for _ in range(max(settings.youtube_download_workers, 1))]
+        return cls._instance
+
+    def drain(self, keys: List[str] = None, writer=None, skip_known: bool = False) -> int:
+        """Drain the download jobs (of `keys`) on the pool, returning how many were downloaded"""
+        actors = self.actors if keys is None else self.actors[:len(keys)]
+        return sum(ray.get([x.drain.remote(keys, writer, skip_known) for x in actors]))
@@ -0,0 +1,92 @@
+import hashlib
+import threading
+from datetime import datetime
+from typing import List
+#
+import typer
+#
+from cineplex.db import get_db
+from cineplex.utils import green, blue, yellow
+
+#
+# Page etags
+#
+# List responses for a fixed set of IDs (e.g. `channels.list(id=...)`) carry
+# a page-level etag. We keep the last one per ID set in `yt_etags` so the next
+# sync can send `If-None-Match` and skip the whole page on a 304.
+#
+
+
+def page_key(resource: str, ids: List[str]) -> str:
+    digest = hashlib.sha1(','.join(sorted(ids)).encode()).hexdigest()
+    return f'{resource}:{digest}'
+
+
+def get_page_etag(key: str) -> str:
+    doc = get_db().yt_etags.find_one({'_id': key})
+    return doc['etag'] if doc else None
+
+
+def save_page_etag(key: str, etag: str) -> None:
+    get_db().yt_etags.update_one(
+        {'_id': key},
+        {'$set': {'etag': etag, 'as_of': datetime.utcnow()}},
+        upsert=True)
+
+
+class SyncStats:
+    """
+    Per-run counts of new, changed and unchanged entities.
+
+    Page etags seen during a sync are held here and only persisted with
+    `save_page_etags()` once the caller has written the pages' data, so a
+    fetch that is never saved can't cause a later 304 over stale documents.
+    """
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.new = set()
+        self.changed = set()
+        self.unchanged = set()
+        self.page_etags = {}
+        self._lock = threading.Lock()
+
+    def add(self, id: str, stored_etag: str, etag: str) -> None:
+        """Classify `id` by comparing its stored and fetched etags"""
+        with self._lock:
+            if stored_etag is None:
+                self.new.add(id)
+            elif stored_etag == etag:
+                self.unchanged.add(id)
+            else:
+                self.changed.add(id)
+
+    def add_new(self, id: str) -> None:
+        with self._lock:
+            self.new.add(id)
+
+    def add_changed(self, id: str) -> None:
+        with self._lock:
+            self.changed.add(id)
+
+    def add_unchanged(self, id: str) -> None:
+        with self._lock:
+            self.unchanged.add(id)
+
+    def is_unchanged(self, id: str) -> bool:
+        return id in self.unchanged
+
+    def add_page_etag(self, key: str, etag: str) -> None:
+        if etag:
+            with self._lock:
+                self.page_etags[key] = etag
+
+    def save_page_etags(self) -> None:
+        with self._lock:
+            page_etags, self.page_etags = self.page_etags, {}
+        for key, etag in page_etags.items():
+            save_page_etag(key, etag)
+
+    def echo(self) -> None:
+        typer.echo(
+            f"📊 {self.kind}: {green(len(self.new))} new, {yellow(len(self.changed))} changed, {blue(len(self.unchanged))} unchanged")
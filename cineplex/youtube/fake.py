@@ -0,0 +1,460 @@
+import hashlib
+import json
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+from collections import Counter
+from collections.abc import Sequence
+from email.parser import FeedParser
+from http.client import responses
+#
+import httplib2
+#
+from cineplex.logger import Logger
+from cineplex.youtube.api import parse_fields, slim
+from cineplex.youtube.quota import cost_of
+
+#
+# Fake YouTube Data API
+#
+# `FakeYouTube` serves channels, playlists, playlist items and videos from
+# memory with the same paging, etags, quota and rate limit errors as the real
+# API, and `FakeHttp` plugs it into googleapiclient in place of httplib2, so
+# the sync pipelines run unchanged (batch requests included) without a
+# Google account. Point `youtube_api()` at it with `youtube_fake=<fixture>`;
+# a fixture is either recorded from the real API (`youtube_record=<fixture>`
+# wraps the real transport and keeps every listing it sees), or a synthetic
+# spec such as:
+#
+#   {"synthetic": {"channels": 100, "playlists": 100, "items": 100}}
+#
+# for 10k playlists of 100 items, generated lazily. Use a separate `mongo_db`
+# (and a large `youtube_daily_quota`) for fake runs.
+#
+
+RESOURCE_KINDS = {
+    'channels': 'youtube#channel',
+    'playlists': 'youtube#playlist',
+    'playlistItems': 'youtube#playlistItem',
+    'videos': 'youtube#video',
+}
+
+default_page_size = 5
+max_page_size = 50
+
+
+def _digest(*parts) -> str:
+    return hashlib.sha1('|'.join(str(x) for x in parts).encode()).hexdigest()[:16]
+
+
+def _item_etag(item) -> str:
+    return item.get('etag') or _digest(json.dumps(item, sort_keys=True, default=str))
+
+
+def _error(status, reason, message=None):
+    return status, {'error': {
+        'code': status,
+        'message': message or reason,
+        'errors': [{'reason': reason, 'message': message or reason}],
+    }}
+
+
+class _SyntheticItems(Sequence):
+    """The items of a synthetic playlist, generated on access"""
+
+    def __init__(self, playlist_id, channel_id, count):
+        self.playlist_id = playlist_id
+        self.channel_id = channel_id
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[x] for x in range(*i.indices(self.count))]
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        video_id = _digest(self.playlist_id, i)[:11]
+        return {
+            'id': f'{self.playlist_id}.{i}',
+            'etag': _digest('etag', self.playlist_id, i),
+            'snippet': {
+                'playlistId': self.playlist_id,
+                'title': f'Video {video_id}',
+                'channelTitle': self.channel_id,
+                'videoOwnerChannelId': self.channel_id,
+                'videoOwnerChannelTitle': self.channel_id,
+                'publishedAt': '2020-01-01T00:00:00Z',
+                'position': i,
+                'resourceId': {'kind': 'youtube#video', 'videoId': video_id},
+            },
+            'contentDetails': {
+                'videoId': video_id,
+                'videoPublishedAt': '2020-01-01T00:00:00Z',
+            },
+        }
+
+
+class FakeYouTube:
+    """An in-memory YouTube Data API (see the module comment)"""
+
+    def __init__(self, latency: float = 0, quota: int = 0, write_rate: float = 0):
+        self.latency = latency
+        self.quota = quota
+        self.write_rate = write_rate
+        self.channels = {}
+        self.playlists = {}
+        self.channel_playlists = {}
+        self.playlist_items = {}
+        self.videos = {}
+        self.used = 0
+        self.stats = Counter()
+        self.round_trips = 0
+        self._last_write = 0
+        self._lock = threading.Lock()
+
+    #
+    # Fixtures
+    #
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> 'FakeYouTube':
+        with open(path, 'r') as f:
+            data = json.load(f)
+        api = cls(**kwargs)
+        if 'synthetic' in data:
+            api.add_synthetic(**data['synthetic'])
+        for item in data.get('channels', []):
+            api.channels[item['id']] = item
+        for item in data.get('playlists', []):
+            api.add_playlist(item)
+        for playlist_id, items in data.get('playlistItems', {}).items():
+            api.playlist_items[playlist_id] = items
+        for item in data.get('videos', []):
+            api.videos[item['id']] = item
+        return api
+
+    def save(self, path: str) -> None:
+        with self._lock:
+            data = {
+                'channels': list(self.channels.values()),
+                'playlists': list(self.playlists.values()),
+                'playlistItems': {k: sorted(v, key=lambda x: x.get('snippet', {}).get('position', 0))
+                                  for k, v in self.playlist_items.items()},
+                'videos': list(self.videos.values()),
+            }
+        with open(path, 'w') as f:
+            json.dump(data, f)
+
+    def add_playlist(self, item) -> None:
+        self.playlists[item['id']] = item
+        channel_id = item.get('snippet', {}).get('channelId')
+        if channel_id:
+            playlist_ids = self.channel_playlists.setdefault(channel_id, [])
+            if item['id'] not in playlist_ids:
+                playlist_ids.append(item['id'])
+
+    def add_synthetic(self, channels: int, playlists: int, items: int) -> None:
+        """Add `channels` channels of `playlists` playlists of `items` items"""
+        for c in range(channels):
+            channel_id = f'UC{c:022d}'
+            uploads_id = f'UU{c:022d}'
+            self.channels[channel_id] = {
+                'id': channel_id,
+                'etag': _digest('etag', channel_id),
+                'snippet': {
+                    'title': f'Channel {c}',
+                    'description': '',
+                    'publishedAt': '2020-01-01T00:00:00Z',
+                    'thumbnails': {'high': {'url': ''}},
+                },
+                'statistics': {
+                    'subscriberCount': '0',
+                    'viewCount': '0',
+                    'videoCount': str(items),
+                },
+                'contentDetails': {'relatedPlaylists': {'likes': '', 'uploads': uploads_id}},
+            }
+            self.playlist_items[uploads_id] = _SyntheticItems(
+                uploads_id, channel_id, items)
+            for p in range(playlists):
+                playlist_id = f'PL{c:016d}{p:016d}'
+                self.add_playlist({
+                    'id': playlist_id,
+                    'etag': _digest('etag', playlist_id),
+                    'snippet': {
+                        'title': f'Playlist {c}.{p}',
+                        'description': '',
+                        'publishedAt': '2020-01-01T00:00:00Z',
+                        'channelId': channel_id,
+                        'channelTitle': f'Channel {c}',
+                    },
+                    'contentDetails': {'itemCount': items},
+                })
+                self.playlist_items[playlist_id] = _SyntheticItems(
+                    playlist_id, channel_id, items)
+
+    #
+    # Recording
+    #
+
+    def record(self, method: str, uri: str, status: int, response: dict) -> None:
+        """Keep the items of a real API listing"""
+        if method != 'GET' or status != 200 or not isinstance(response, dict):
+            return
+        resource, params = self._parse_uri(uri)
+        with self._lock:
+            for item in response.get('items', []):
+                if resource == 'channels':
+                    self.channels[item['id']] = item
+                elif resource == 'playlists':
+                    self.add_playlist(item)
+                elif resource == 'videos':
+                    self.videos[item['id']] = item
+                elif resource == 'playlistItems' and 'playlistId' in params:
+                    items = self.playlist_items.setdefault(
+                        params['playlistId'], [])
+                    items[:] = [x for x in items if x['id'] != item['id']]
+                    items.append(item)
+
+    #
+    # Serving
+    #
+
+    @staticmethod
+    def _parse_uri(uri):
+        parsed = urllib.parse.urlparse(uri)
+        resource = parsed.path.rstrip('/').rsplit('/', 1)[-1]
+        params = {k: v[0] for k, v in urllib.parse.parse_qs(parsed.query).items()}
+        return resource, params
+
+    def handle(self, method: str, uri: str, headers: dict = None, body: str = None):
+        """Serve one API call, returning (status, response)"""
+        resource, params = self._parse_uri(uri)
+        headers = {k.lower(): v for k, v in (headers or {}).items()}
+        if resource not in RESOURCE_KINDS:
+            return _error(404, 'notFound', f'Unknown resource {resource}')
+        endpoint = f"{resource}.{'list' if method == 'GET' else 'insert'}"
+
+        with self._lock:
+            self.stats[endpoint] += 1
+            cost = cost_of(endpoint)
+            if self.quota and self.used + cost > self.quota:
+                return _error(403, 'quotaExceeded')
+            self.used += cost
+
+            if method == 'GET':
+                status, response = self._list(
+                    resource, params, headers.get('if-none-match'))
+            elif resource == 'playlistItems':
+                now = time.monotonic()
+                if self.write_rate and now - self._last_write < 1 / self.write_rate:
+                    return _error(403, 'rateLimitExceeded')
+                self._last_write = now
+                status, response = self._insert(json.loads(body or '{}'))
+            else:
+                return _error(405, 'methodNotAllowed')
+
+        if status == 200 and 'fields' in params:
+            response = slim(response, parse_fields(params['fields']))
+        return status, response
+
+    def _select(self, resource, params):
+        if 'id' in params:
+            source = {'channels': self.channels,
+                      'playlists': self.playlists,
+                      'videos': self.videos}.get(resource, {})
+            return [source[x] for x in params['id'].split(',') if x in source]
+        if resource == 'playlists' and 'channelId' in params:
+            return [self.playlists[x] for x in self.channel_playlists.get(params['channelId'], [])]
+        if resource == 'playlistItems' and 'playlistId' in params:
+            return self.playlist_items.get(params['playlistId'])
+        return []
+
+    def _list(self, resource, params, if_none_match):
+        items = self._select(resource, params)
+        if items is None:
+            return _error(404, 'playlistNotFound')
+
+        page_size = min(int(params.get('maxResults', default_page_size)), max_page_size)
+        offset = int(params.get('pageToken') or 0)
+        page = items[offset:offset + page_size]
+
+        etag = _digest(resource, offset, len(items),
+                       *(_item_etag(x) for x in page))
+        if if_none_match == etag:
+            return 304, None
+
+        response = {
+            'kind': f'{RESOURCE_KINDS[resource]}ListResponse',
+            'etag': etag,
+            'pageInfo': {'totalResults': len(items), 'resultsPerPage': page_size},
+            'items': page,
+        }
+        if offset + page_size < len(items):
+            response['nextPageToken'] = str(offset + page_size)
+        return 200, response
+
+    def _insert(self, body):
+        snippet = body.get('snippet', {})
+        playlist_id = snippet.get('playlistId')
+        video_id = snippet.get('resourceId', {}).get('videoId')
+        if playlist_id not in self.playlist_items:
+            return _error(404, 'playlistNotFound')
+        if not video_id:
+            return _error(400, 'videoNotFound')
+
+        items = self.playlist_items[playlist_id]
+        if not isinstance(items, list):
+            items = self.playlist_items[playlist_id] = list(items)
+
+        position = snippet.get('position', len(items))
+        item = {
+            'id': f'{playlist_id}.{_digest(playlist_id, video_id, len(items))}',
+            'snippet': {
+                'playlistId': playlist_id,
+                'title': self.videos.get(video_id, {}).get('snippet', {}).get('title', ''),
+                'position': position,
+                'resourceId': {'kind': 'youtube#video', 'videoId': video_id},
+            },
+            'contentDetails': {'videoId': video_id},
+        }
+        item['etag'] = _item_etag(item)
+        items.insert(position, item)
+        for i, x in enumerate(items[position + 1:], position + 1):
+            x.setdefault('snippet', {})['position'] = i
+
+        playlist = self.playlists.get(playlist_id)
+        if playlist is not None:
+            details = playlist.setdefault('contentDetails', {})
+            details['itemCount'] = len(items)
+        return 200, item
+
+    def round_trip(self) -> None:
+        """Account for one HTTP round trip (the caller waits out `latency`)"""
+        with self._lock:
+            self.round_trips += 1
+
+    def summary(self) -> str:
+        with self._lock:
+            calls = ', '.join(f'{k}={v}' for k, v in sorted(self.stats.items()))
+            return f"{self.round_trips} round trip(s), {self.used} unit(s): {calls}"
+
+
+#
+# googleapiclient transports
+#
+
+
+def _parse_batch(content_type: str, body: str):
+    """Split a multipart/mixed batch body into (Content-ID, payload) pairs"""
+    parser = FeedParser()
+    parser.feed(f'content-type: {content_type}\r\n\r\n{body}')
+    # long Content-IDs come folded over several lines
+    return [(re.sub(r'\r?\n', '', part['Content-ID']), part.get_payload())
+            for part in parser.close().get_payload()]
+
+
+def _parse_http(payload: str):
+    """Parse an application/http payload into (first line, headers, body)"""
+    first_line, rest = payload.split('\n', 1)
+    parser = FeedParser()
+    parser.feed(rest)
+    msg = parser.close()
+    return first_line.strip(), dict(msg.items()), msg.get_payload()
+
+
+def _batch_response(parts):
+    """Build a multipart/mixed batch response from (Content-ID, status, response)"""
+    boundary = f'batch_{uuid.uuid4().hex}'
+    body = []
+    for content_id, status, response in parts:
+        content = json.dumps(response) if response is not None else ''
+        body.append(
+            f'--{boundary}\r\n'
+            f'Content-Type: application/http\r\n'
+            f'Content-ID: <response-{content_id[1:]}\r\n\r\n'
+            f'HTTP/1.1 {status} {responses.get(status, "Unknown")}\r\n'
+            f'Content-Type: application/json; charset=UTF-8\r\n\r\n'
+            f'{content}\r\n')
+    body.append(f'--{boundary}--\r\n')
+    headers = {
+        'status': '200',
+        'content-type': f'multipart/mixed; boundary={boundary}',
+    }
+    return httplib2.Response(headers), ''.join(body).encode('utf-8')
+
+
+def _json_response(status, response):
+    headers = {'status': str(status), 'content-type': 'application/json; charset=UTF-8'}
+    content = json.dumps(response).encode('utf-8') if response is not None else b''
+    return httplib2.Response(headers), content
+
+
+class FakeHttp:
+    """httplib2.Http stand-in serving requests from a FakeYouTube"""
+
+    def __init__(self, api: FakeYouTube):
+        self.api = api
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=None, connection_type=None):
+        headers = headers or {}
+        self.api.round_trip()
+        if self.api.latency:
+            time.sleep(self.api.latency)
+
+        if urllib.parse.urlparse(uri).path.rstrip('/').endswith('/batch'):
+            if isinstance(body, bytes):
+                body = body.decode('utf-8')
+            parts = []
+            for content_id, payload in _parse_batch(headers['content-type'], body):
+                request_line, part_headers, part_body = _parse_http(payload)
+                part_method, path, _ = request_line.split(' ', 2)
+                status, response = self.api.handle(
+                    part_method, urllib.parse.urljoin(uri, path), part_headers, part_body)
+                parts.append((content_id, status, response))
+            return _batch_response(parts)
+
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
+        return _json_response(*self.api.handle(method, uri, headers, body))
+
+
+class RecordingHttp:
+    """Wraps a real (authorized) http, recording listings into a FakeYouTube"""
+
+    def __init__(self, http, api: FakeYouTube):
+        self.http = http
+        self.api = api
+
+    def __getattr__(self, name):
+        return getattr(self.http, name)
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        resp, content = self.http.request(
+            uri, method=method, body=body, headers=headers, **kwargs)
+        try:
+            if urllib.parse.urlparse(uri).path.rstrip('/').endswith('/batch'):
+                text = body.decode('utf-8') if isinstance(body, bytes) else body
+                requests = {content_id[1:-1]: _parse_http(payload)[0]
+                            for content_id, payload in _parse_batch(headers['content-type'], text)}
+                for content_id, payload in _parse_batch(resp['content-type'], content.decode('utf-8')):
+                    request_line = requests.get(
+                        content_id[1:-1].replace('response-', '', 1))
+                    if request_line is None:
+                        continue
+                    part_method, path, _ = request_line.split(' ', 2)
+                    status_line, _, part_body = _parse_http(payload)
+                    self.api.record(part_method, urllib.parse.urljoin(uri, path),
+                                    int(status_line.split(' ')[1]),
+                                    json.loads(part_body) if part_body else None)
+            elif content:
+                self.api.record(method, uri, resp.status, json.loads(content))
+        except Exception as e:
+            Logger().warning(f"Unable to record {method} {uri}: {e}")
+        return resp, content
@@ -1,4 +1,8 @@
 from operator import sub
+import asyncio
+import bisect
+import hashlib
+import math
 import os
 import glob
 import pickle
@@ -6,7 +10,7 @@ import json
 from bson import ObjectId
 import os
 import re
-from datetime import datetime
+from datetime import datetime, timedelta
 import time
 #
 import pymongo
@@ -25,35 +29,67 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
 #
-from cineplex.db import PyObjectId, get_db
+from cineplex.db import (
+    BulkResult,
+    PyObjectId,
+    bulk_upsert,
+    delete_in,
+    existing_ids,
+    find_ids,
+    find_in,
+    find_in_cached,
+    find_one_cached,
+    find_stale,
+    get_db,
+    invalidate,
+    touch
+)
 
+from cineplex.backup import BackupLog
+from cineplex.jobs import DONE, FAILED, QUEUED, RUNNING, JobQueue, worker_id
 from cineplex.logger import Logger
 from cineplex.config import Settings
 from cineplex.utils import (
     IMAGE_EXTS,
     VIDEO_EXTS,
     move_file,
-    ensure_batch,
+    ensure_batch_impl,
+    missing_found,
     green,
     blue,
     yellow,
     red,
     magenta
 )
+from cineplex.youtube.api import (
+    youtube_api,
+    execute_paged_batch,
+    channel_fields,
+    playlist_fields,
+    playlist_item_fields,
+    parse_fields,
+    slim,
+    slim_items
+)
+from cineplex.youtube.quota import (
+    PRIORITY_HIGH,
+    PRIORITY_NORMAL,
+    QuotaDeferred,
+    QuotaScheduler,
+    execute,
+)
+from cineplex.youtube.etags import SyncStats, get_page_etag, page_key
+from cineplex.youtube.ratelimit import call_with_retry, write_limiter
+from cineplex.youtube.aio import AsyncYouTube
+from cineplex.youtube.writer import DbWriter
+from cineplex.youtube.downloader import DownloaderPool
+import cineplex.youtube.channel as channel
 
 cli = typer.Typer()
 
 
 settings = Settings()
 
-#
-# Paths
-#
-
-yt_playlists_bkp_dir = os.path.join(settings.bkp_dir, 'yt_playlists')
-os.makedirs(yt_playlists_bkp_dir, exist_ok=True)
-
-
 #
 # Playlist model
 #
@@ -83,7 +119,7 @@ class PlaylistId(str):
 
 
 def ensure_youtube_playlist_batch(id_batch):
-    return ensure_batch(id_batch, yt.get_playlist_from_db_batch, sync_youtube_playlist)
+    return ensure_batch_impl(id_batch, get_playlist_from_db_batch, sync_youtube_playlist)
 
 
 @cli.command()
@@ -92,16 +128,22 @@ def sync_youtube_playlist(playlist_id_batch: List[str], with_items: bool = False
     playlist_id_batch = list(playlist_id_batch)
     print(f"🔄 Syncing {len(playlist_id_batch)} playlists from YouTube...")
 
-    playlist_with_meta_batch = yt.get_playlist_from_youtube_batch(
-        playlist_id_batch)
+    stats = SyncStats('playlists')
+    playlist_with_meta_batch = get_playlist_from_youtube_batch(
+        playlist_id_batch, stats)
     if not playlist_with_meta_batch:
         plural = 's' if len(playlist_id_batch) > 1 else ''
         msg = 'Playlist' + plural + ' not found'
         typer.echo(f"❗ {red(msg)}: {green(playlist_id_batch)}")
         return
 
-    yt.save_playlist_to_db_batch(playlist_with_meta_batch)
+    # unchanged playlists (etag match or 304) are not rewritten, only marked current
+    save_playlist_to_db_batch(
+        [x for x in playlist_with_meta_batch if not stats.is_unchanged(x['_id'])])
+    touch(get_db().yt_playlists, stats.unchanged)
+    stats.save_page_etags()
     typer.echo(f"✅ {green(len(playlist_with_meta_batch))} plalists synced")
+    stats.echo()
 
     if with_items:
         return sync_youtube_playlist_items(playlist_id_batch)
@@ -130,7 +172,7 @@ def offline_youtube_playlist(playlist_id_batch: List[str] = [], sync: bool = Fal
             return
 
         playlist_id_batch = [x['_id']
-                             for x in yt.get_offline_playlists_from_db()]
+                             for x in get_offline_playlists_from_db({'_id': 1})]
 
     typer.echo(f"💡 Offlining {blue(len(playlist_id_batch))} playlist(s)")
 
@@ -153,7 +195,7 @@ def offline_youtube_playlist(playlist_id_batch: List[str] = [], sync: bool = Fal
     res = offline_youtube_video(video_id_batch, audit=audit)
 
     for id in [x['_id'] for x in playlist_items_with_meta_batch]:
-        yt.save_offline_playlist_to_db(id, is_auto=auto)
+        save_offline_playlist_to_db(id, is_auto=auto)
 
     return res
 
@@ -175,13 +217,13 @@ def offline_my_youtube_playlists(sync: bool = False):
 def offline_youtube_playlists_from_file(playlist_file: str):
     """Get playlists to offline from file"""
     offline_from_file(playlist_file, ensure_youtube_playlist_batch,
-                      yt.save_offline_playlist_to_db)
+                      save_offline_playlist_to_db)
 
 
 @cli.command()
 def show_auto_offline_youtube_playlists():
     """List auto offline playlists"""
-    print_auto_offline_batch(yt.get_offline_playlists_from_db(), 'playlist')
+    print_auto_offline_batch(get_offline_playlists_from_db(), 'playlist')
 
 
 @cli.command()
@@ -214,31 +256,155 @@ def ensure_youtube_playlist_items_batch(id_batch):
     playlist_with_meta_batch = ensure_youtube_playlist_batch(id_batch)
     if playlist_with_meta_batch:
         valid_playlist_id_batch = [x['_id'] for x in playlist_with_meta_batch]
-        return ensure_batch(valid_playlist_id_batch, yt.get_playlist_items_from_db_batch, sync_youtube_playlist_items)
+        return ensure_batch_impl(valid_playlist_id_batch, get_playlist_items_from_db_batch, sync_youtube_playlist_items)
+
+
+def _playlist_items_job(playlist_with_meta, incremental: bool):
+    """
+    The (priority, cost) of syncing a playlist's items: a page of 50 per
+    request, or just the head page when `incremental`. Offline and auto
+    playlists go first.
+    """
+    if not playlist_with_meta:
+        return PRIORITY_NORMAL, 1
+
+    offline = playlist_with_meta.get('offline') or playlist_with_meta.get('offline_as_of')
+    priority = PRIORITY_HIGH if offline else PRIORITY_NORMAL
+    if incremental:
+        return priority, 1
+
+    item_count = playlist_with_meta.get('playlist', {}).get(
+        'contentDetails', {}).get('itemCount') or 0
+    return priority, max(math.ceil(item_count / 50), 1)
 
 
 @cli.command()
-def sync_youtube_playlist_items(playlist_id: List[str]):
+def sync_youtube_playlist_items(playlist_id: List[str], concurrency: int = settings.youtube_max_concurrency, incremental: bool = False, aio: bool = False):
     """Get playlist items for a playlist"""
     playlist_id_batch = list(playlist_id)
+    if aio and incremental:
+        # the head-only sync is only implemented on the blocking client
+        raise typer.BadParameter(
+            "can't be combined with --incremental", param_hint='--aio')
+    if aio:
+        return asyncio.run(_sync_youtube_playlist_items_async(playlist_id_batch, concurrency))
+
     playlist_items_with_meta_batch = []
 
-    with typer.progressbar(playlist_id_batch, label='Syncing playlist items', fill_char=typer.style("█", fg="green"), show_pos=True) as bar:
-        for playlist_id in bar:
-            playlist_items_with_meta = yt.get_playlist_items_from_youtube(
-                playlist_id)
+    # playlists are fetched `concurrency` at a time (each one paged in order
+    # on its own thread) and written as soon as they finish; whatever doesn't
+    # fit in today's quota is deferred rather than failed
+    stats = SyncStats('playlist items')
+    scheduler = QuotaScheduler()
+    playlist_with_meta_batch = {
+        x['_id']: x for x in get_playlist_from_db_batch(playlist_id_batch) or []}
+    for playlist_id in playlist_id_batch:
+        priority, cost = _playlist_items_job(
+            playlist_with_meta_batch.get(playlist_id), incremental)
+        scheduler.submit(
+            lambda playlist_id=playlist_id: get_playlist_items_from_youtube(
+                playlist_id, stats, incremental),
+            'playlistItems.list',
+            priority=priority,
+            cost=cost,
+            label=playlist_id)
+
+    with typer.progressbar(length=len(playlist_id_batch), label='Syncing playlist items', fill_char=typer.style("█", fg="green"), show_pos=True) as bar:
+
+        def on_playlist_items(job, playlist_items_with_meta):
+            bar.update(1)
             if not playlist_items_with_meta:
                 msg = "Playlist not found"
-                typer.echo(f"❗ {red(msg)}: {green(playlist_id)}")
+                typer.echo(f"❗ {red(msg)}: {green(job.label)}")
                 return
 
-            yt.save_playlist_items_to_db(playlist_items_with_meta)
-
+            if not stats.is_unchanged(job.label):
+                save_playlist_items_to_db(playlist_items_with_meta)
             playlist_items_with_meta_batch.append(playlist_items_with_meta)
+            Logger().info(
+                f"Synced {len(playlist_items_with_meta['items'])} items for playlist {job.label}")
+
+        scheduler.run(max_workers=max(concurrency, 1),
+                      on_result=on_playlist_items)
+
+    touch(get_db().yt_playlist_items, stats.unchanged)
+
+    deferred = scheduler.take_deferred()
+    if deferred:
+        typer.echo(
+            f"⏸  {yellow('Quota exhausted, deferred')} {blue(len(deferred))} playlist(s): {green([x.label for x in deferred])}")
+    stats.echo()
+
+    return playlist_items_with_meta_batch
+
+
+async def _sync_youtube_playlist_items_async(playlist_id_batch: List[str], concurrency: int):
+    """`sync_youtube_playlist_items` on one event loop, `concurrency` requests in flight"""
+    playlist_items_with_meta_batch = []
+    deferred = []
+    stats = SyncStats('playlist items')
+
+    async with AsyncYouTube(concurrency) as youtube:
+
+        async def sync(playlist_id):
+            try:
+                return playlist_id, await get_playlist_items_from_youtube_async(youtube, playlist_id, stats)
+            except QuotaDeferred:
+                deferred.append(playlist_id)
+                return playlist_id, None
+
+        with typer.progressbar(length=len(playlist_id_batch), label='Syncing playlist items', fill_char=typer.style("█", fg="green"), show_pos=True) as bar:
+            for future in asyncio.as_completed([sync(x) for x in playlist_id_batch]):
+                playlist_id, playlist_items_with_meta = await future
+                bar.update(1)
+                if playlist_id in deferred:
+                    continue
+                if not playlist_items_with_meta:
+                    msg = "Playlist not found"
+                    typer.echo(f"❗ {red(msg)}: {green(playlist_id)}")
+                    continue
+
+                if not stats.is_unchanged(playlist_id):
+                    await asyncio.to_thread(save_playlist_items_to_db, playlist_items_with_meta)
+                playlist_items_with_meta_batch.append(playlist_items_with_meta)
+                Logger().info(
+                    f"Synced {len(playlist_items_with_meta['items'])} items for playlist {playlist_id}")
+
+    await asyncio.to_thread(touch, get_db().yt_playlist_items, stats.unchanged)
+
+    if deferred:
+        typer.echo(
+            f"⏸  {yellow('Quota exhausted, deferred')} {blue(len(deferred))} playlist(s): {green(deferred)}")
+    stats.echo()
 
     return playlist_items_with_meta_batch
 
 
+def is_uploads_playlist(playlist_id: str) -> bool:
+    """Whether a playlist is a channel's uploads (its `relatedPlaylists.uploads`), newest first"""
+    return playlist_id.startswith('UU')
+
+
+@cli.command()
+def sync_youtube_channel_uploads(channel_id_batch: List[str], full: bool = False):
+    """Sync the uploads of a set of channels (only new uploads unless --full)"""
+    channel_id_batch = list(channel_id_batch)
+
+    channel_batch = channel.read_from_db_batch(channel_id_batch) or []
+    missing, _ = missing_found(channel_id_batch, channel_batch)
+    if missing:
+        channel_batch.extend(x.dict(by_alias=True)
+                             for x in channel.read_from_youtube_batch(missing, save=True) or [])
+
+    playlist_id_batch = [x['uploads_playlist']
+                         for x in channel_batch if x.get('uploads_playlist')]
+    if not playlist_id_batch:
+        typer.echo(f"❗ {red('No uploads playlists found')}: {green(channel_id_batch)}")
+        return
+
+    return sync_youtube_playlist_items(playlist_id_batch, incremental=not full)
+
+
 @cli.command()
 def show_youtube_playlist_items(playlist_id_batch: List[str]):
     """List playlist items for a playlist"""
@@ -249,6 +415,70 @@ def show_youtube_playlist_items(playlist_id_batch: List[str]):
         print_yt_playlist_items_batch(playlist_items_with_meta_batch)
 
 
+@cli.command()
+def slim_youtube_db():
+    """Strip stored playlist documents down to the fields cineplex reads"""
+    for collection, save_fn in [
+        (get_db().yt_playlists, save_playlist_to_db),
+        (get_db().yt_channel_playlists, save_channel_playlists_to_db),
+    ]:
+        count = 0
+        for doc in collection.find():
+            save_fn(doc, to_disk=False)
+            count += 1
+        typer.echo(f"✅ Slimmed {blue(count)} {green(collection.name)}")
+
+
+def refresh_stale(age: timedelta):
+    """Re-sync the channels, playlists, playlist items and videos last synced more than `age` ago"""
+    db = get_db()
+
+    channel_id_batch = find_stale(db.yt_channels, age)
+    typer.echo(f"🔄 {blue(len(channel_id_batch))} stale {green('channels')}")
+    if channel_id_batch:
+        stats = SyncStats('channels')
+        channel.read_from_youtube_batch(channel_id_batch, save=True, stats=stats)
+        stats.echo()
+
+    playlist_id_batch = find_stale(db.yt_playlists, age)
+    typer.echo(f"🔄 {blue(len(playlist_id_batch))} stale {green('playlists')}")
+    if playlist_id_batch:
+        sync_youtube_playlist(playlist_id_batch)
+
+    playlist_items_id_batch = find_stale(db.yt_playlist_items, age)
+    typer.echo(
+        f"🔄 {blue(len(playlist_items_id_batch))} stale {green('playlist items')}")
+    # only uploads playlists are newest first, so only they can be synced
+    # from their head page: others get new items appended at the end
+    uploads_id_batch = [
+        x for x in playlist_items_id_batch if is_uploads_playlist(x)]
+    if uploads_id_batch:
+        sync_youtube_playlist_items(uploads_id_batch, incremental=True)
+    other_id_batch = [
+        x for x in playlist_items_id_batch if not is_uploads_playlist(x)]
+    if other_id_batch:
+        sync_youtube_playlist_items(other_id_batch)
+
+    video_id_batch = find_stale(db.yt_videos, age)
+    typer.echo(f"🔄 {blue(len(video_id_batch))} stale {green('videos')}")
+    if video_id_batch:
+        refresh_youtube_video(video_id_batch)
+
+
+@cli.command()
+def migrate_youtube_playlist_items():
+    """Move playlist items embedded in yt_playlist_items to per-item documents"""
+    count = 0
+    items_count = 0
+    # a few at a time: these are the documents with (possibly huge) item arrays
+    for doc in get_db().yt_playlist_items.find({'items': {'$exists': True}}).batch_size(10):
+        save_playlist_items_to_db(doc, to_disk=False)
+        count += 1
+        items_count += len(doc['items'])
+    typer.echo(
+        f"✅ Migrated {blue(items_count)} items of {blue(count)} playlist(s) to {green('yt_playlist_entries')}")
+
+
 #
 # Videos
 #
@@ -258,7 +488,7 @@ def show_youtube_playlist_items(playlist_id_batch: List[str]):
 def show_youtube_video(video_id_batch: List[str]):
     """Show a video from the database."""
     video_id_batch = list(video_id_batch)
-    video_with_meta_batch = yt.get_video_from_db_batch(video_id_batch)
+    video_with_meta_batch = get_video_from_db_batch(video_id_batch)
     missing, found = missing_found(video_id_batch, video_with_meta_batch)
     if found:
         print_yt_video_batch(
@@ -271,23 +501,46 @@ def show_youtube_video(video_id_batch: List[str]):
 
 def _refresh_video_info(info_file):
 
-    video_with_meta = yt.extract_video_info_from_file(info_file)
+    video_with_meta = extract_video_info_from_file(info_file)
     if video_with_meta is None:
         return info_file
 
-    yt.save_video_to_db(video_with_meta, False)
+    save_video_to_db(video_with_meta, False)
     return None
 
 
+@cli.command()
+def refresh_youtube_video(video_id_batch: List[str]):
+    """Refresh the info of downloaded videos from YouTube (their files are kept)."""
+    video_with_meta_batch = get_video_from_db_batch(
+        list(video_id_batch), {'video.files': 1})
+    if not video_with_meta_batch:
+        typer.echo(f'{red("❗ No video(s) to refresh")}')
+        return
+
+    refreshed = []
+    with typer.progressbar(video_with_meta_batch, label='Refreshing', fill_char=typer.style(
+            "█", fg="green"), show_pos=True) as video_with_meta_bar:
+        for video_with_meta in video_with_meta_bar:
+            info = get_video_info_from_youtube(video_with_meta['_id'])
+            if info is not None:
+                refreshed.append(extract_video_info(
+                    info, video_with_meta['video'].get('files')))
+
+    save_video_to_db_batch([x for x in refreshed if x], to_disk=False)
+    typer.echo(
+        f"✅ {blue(len(refreshed))} of {blue(len(video_with_meta_batch))} video(s) refreshed")
+
+
 def _delete_youtube_video(video_with_meta):
-    yt.delete_video_files(video_with_meta)
-    yt.delete_video_from_db(video_with_meta['_id'])
+    delete_video_files(video_with_meta)
+    delete_video_from_db(video_with_meta['_id'])
 
 
 @cli.command()
 def delete_youtube_video(video_id_batch: List[str]):
     """Delete a video from the database and its files."""
-    video_with_meta_batch = yt.get_video_from_db_batch(video_id_batch)
+    video_with_meta_batch = get_video_from_db_batch(video_id_batch)
     if not video_with_meta_batch:
         typer.echo(f'{red("❗ No video(s) to delete")}')
         return
@@ -304,17 +557,65 @@ def delete_youtube_video(video_id_batch: List[str]):
             _delete_youtube_video(video_with_meta)
 
 
-def _download_youtube_video(video_id, show_progress=True):
+def _download_youtube_video(video_id, show_progress=True, writer=None, skip_known=False, ydl=None):
+    # another worker or run may have downloaded it since it was found missing
+    if skip_known and video_id in existing_ids(get_db().yt_videos, [video_id]):
+        return get_video_from_db(video_id)
+
     video_url = f'https://www.youtube.com/watch?v={video_id}'
-    video_with_meta = yt.get_video_from_youtube(video_url, show_progress)
+    video_with_meta = get_video_from_youtube(video_url, show_progress, ydl)
     if video_with_meta:
-        yt.save_video_to_db(video_with_meta)
+        if writer is not None:
+            writer.save.remote('yt_videos', [video_with_meta])
+        else:
+            save_video_to_db(video_with_meta)
     return video_with_meta
 
 
-@ray.remote
-def _download_youtube_video_ray(video_id):
-    return _download_youtube_video(video_id, False)
+#
+# Download jobs
+#
+# Videos to download are queued as `download` jobs (see `cineplex.jobs`), so
+# a run that dies leaves them queued (or leased, until the lease expires)
+# for the next run or any `download-worker` to pick up. Workers complete a
+# job once the video is downloaded; with a single writer the document may
+# still be in flight, and a later run that finds the video missing simply
+# queues it again.
+#
+# Job bookkeeping (claims, heartbeats, completions) is small and goes
+# straight to MongoDB from every worker, `mongo_single_writer` included:
+# only the video documents are routed through the `DbWriter`.
+#
+
+DOWNLOAD_JOBS = 'download'
+
+# seconds between looks at jobs held by other workers
+DOWNLOAD_JOBS_POLL = 10
+
+
+def _drain_download_jobs(keys=None, show_progress=False, writer=None, skip_known=False, ydl=None):
+    """Download queued videos (of `keys`) until none are left, returning how many"""
+    jobs = JobQueue(DOWNLOAD_JOBS)
+    worker = worker_id()
+    count = 0
+    jobs.reap()
+    while True:
+        job = jobs.claim(worker, keys)
+        if job is None:
+            return count
+        try:
+            with jobs.heartbeat(job):
+                video_with_meta = _download_youtube_video(
+                    job['key'], show_progress, writer, skip_known, ydl)
+        except Exception as e:
+            Logger().exception(f"Unable to download {job['key']}")
+            jobs.fail(job, str(e))
+            continue
+        if video_with_meta:
+            jobs.complete(job)
+            count += 1
+        else:
+            jobs.fail(job, 'unable to download')
 
 
 @cli.command()
@@ -324,13 +625,14 @@ def offline_youtube_video(video_id_batch: List[str], force: bool = False, audit:
 
     if not force:
         typer.echo(f"💡 Processing {blue(len(video_id_batch))} video(s)")
-        video_with_meta_batch = yt.get_video_from_db_batch(video_id_batch)
+        video_with_meta_batch = get_video_from_db_batch(video_id_batch)
         missing, found = missing_found(video_id_batch, video_with_meta_batch)
         if audit:
             missing.extend(audit_youtube_video(found, repair=True, clean=True))
 
+        missing_ids = set(missing)
         verified_with_meta_batch = [
-            x for x in video_with_meta_batch if x['_id'] not in missing]
+            x for x in video_with_meta_batch if x['_id'] not in missing_ids]
 
         typer.echo(
             f"✅ {blue(len(verified_with_meta_batch))} verified {red(len(missing))} missing")
@@ -341,27 +643,45 @@ def offline_youtube_video(video_id_batch: List[str], force: bool = False, audit:
         missing = video_id_batch
         verified_with_meta_batch = []
 
+    # playlists share videos, download each one once
+    missing = list(dict.fromkeys(missing))
     count = len(missing)
     plural = 's' if count > 1 else ''
     typer.echo(
         f"💡 {yellow('Downloading')} {blue(count)} video" + plural)
 
+    # missing videos are (re)queued even if an earlier job says done
+    jobs = JobQueue(DOWNLOAD_JOBS)
+    jobs.enqueue(missing, reset=True)
+
     if len(missing) > 1:
-        ray.init()
-        futures = [_download_youtube_video_ray.remote(x) for x in missing]
-        dl_video_with_meta_batch = [x for x in ray.get(futures) if x]
+        pool = DownloaderPool()
+        # with a single writer, the downloaders only touch their jobs
+        writer = DbWriter.remote() if settings.mongo_single_writer else None
+        pool.drain(missing, writer, not force)
+        if writer is not None:
+            res = ray.get(writer.flush.remote())
+            typer.echo(f"💾 Saved videos: {res}")
     else:
-        res = _download_youtube_video(missing[0])
-        dl_video_with_meta_batch = [res] if res else []
+        _drain_download_jobs(missing, True, None, not force)
 
-    not_dl_id_batch, _ = missing_found(missing, dl_video_with_meta_batch)
+    # jobs other workers hold finish, or their leases expire and we take over
+    while jobs.find(missing, RUNNING):
+        time.sleep(DOWNLOAD_JOBS_POLL)
+        _drain_download_jobs(missing, False, None, not force)
 
-    if not_dl_id_batch:
+    dl_id_batch = [x['key'] for x in jobs.find(missing, DONE)]
+    dl_video_with_meta_batch = get_video_from_db_batch(dl_id_batch)
+
+    failed_jobs = jobs.find(missing, FAILED)
+    if failed_jobs:
         typer.echo(
-            f"❗ {red('Unable to download')} {blue(len(not_dl_id_batch))}: {green(not_dl_id_batch)}")
+            f"❗ {red('Unable to download')} {blue(len(failed_jobs))}:")
+        for job in failed_jobs:
+            typer.echo(f"   {green(job['key'])} {job.get('error')}")
 
     if dl_video_with_meta_batch:
-        count = len(missing)
+        count = len(dl_video_with_meta_batch)
         plural = 's' if count > 1 else ''
         typer.echo(f"✅  Downloaded {blue(count)} video" + plural)
         for dl_video_with_meta in dl_video_with_meta_batch:
@@ -376,25 +696,55 @@ def offline_youtube_video(video_id_batch: List[str], force: bool = False, audit:
     return verified_with_meta_batch
 
 
+@cli.command()
+def download_worker(forever: bool = False, pool: bool = False):
+    """Download queued videos until the queue is empty (or forever), on the downloader pool with --pool."""
+    while True:
+        if pool:
+            count = DownloaderPool().drain(skip_known=True)
+        else:
+            count = _drain_download_jobs(skip_known=True)
+        if count:
+            typer.echo(f"⬇️  Downloaded {blue(count)} video(s)")
+        if not forever:
+            return
+        time.sleep(DOWNLOAD_JOBS_POLL)
+
+
+@cli.command()
+def show_download_jobs(failed: bool = False):
+    """Show how many download jobs are in each state (and the failed ones)."""
+    jobs = JobQueue(DOWNLOAD_JOBS)
+    counts = jobs.counts()
+    for state in [QUEUED, RUNNING, DONE, FAILED]:
+        typer.echo(f"{state}: {blue(counts.get(state, 0))}")
+    if failed:
+        for job in jobs.find(state=FAILED):
+            typer.echo(
+                f"❗ {green(job['key'])} ({job['attempts']} attempts) {job.get('error')}")
+
+
 #
 # Search
 #
 
 @cli.command()
-def search(query):
+def search(query, limit: int = 20, page: int = 1):
     """Search videos in the database"""
-    video_with_meta_batch = yt.search_db(query)
+    video_with_meta_batch = search_db(
+        query, limit=limit, skip=(max(page, 1) - 1) * limit)
     if not video_with_meta_batch:
         typer.echo(f'{red("❗ No video(s) to found")}')
         return
 
     typer.echo(
-        f'found {blue(len(video_with_meta_batch))} video(s) with metadata')
+        f'found {blue(len(video_with_meta_batch))} video(s) with metadata (page {page})')
 
     for video_with_meta in video_with_meta_batch:
         video_id = video_with_meta['_id']
         title = video_with_meta['video']['title']
-        typer.echo(f'✅ {blue(video_id)} {green(title)}')
+        score = video_with_meta['score']
+        typer.echo(f'✅ {blue(video_id)} {green(title)} ({score:.2f})')
 
 
 #
@@ -418,7 +768,7 @@ def _audit_youtube_video(video_with_meta_batch: List[str], repair: bool = False,
         for video_with_meta in bar:
             video_id = video_with_meta['_id']
             title = video_with_meta['video']['title']
-            if yt.audit_video_files(video_with_meta):
+            if audit_video_files(video_with_meta):
                 continue
             if repair:
                 new_video_with_meta = _download_youtube_video(video_id)
@@ -452,7 +802,7 @@ def _audit_youtube_video(video_with_meta_batch: List[str], repair: bool = False,
 @cli.command()
 def audit_youtube_video(video_id_batch: List[str], repair: bool = False, clean: bool = False, label=None):
     """Audit videos in the database"""
-    return _audit_youtube_video(yt.get_video_from_db_batch(video_id_batch), repair, clean, label)
+    return _audit_youtube_video(get_video_from_db_batch(video_id_batch), repair, clean, label)
 
 
 @cli.command()
@@ -494,13 +844,13 @@ def audit_all_youtube_videos():
 def audit_youtube_channel_videos(channel_id_batch: List[str]):
     """List videos for a channel from the database."""
     for channel_id in channel_id_batch:
-        channel_with_meta = yt.get_channel_from_db(channel_id)
+        channel_with_meta = get_channel_from_db(channel_id)
         if not channel_with_meta:
             msg = "Channel not found"
             typer.echo(f"❗ {red(msg)}: {green(channel_id)}")
             continue
         channel_title = channel_with_meta['channel']['snippet']['title']
-        video_with_meta_batch = yt.get_channel_videos_from_db(channel_id)
+        video_with_meta_batch = get_channel_videos_from_db(channel_id)
         count = 0
         with typer.progressbar(video_with_meta_batch, label=f'{yellow(channel_title)}', fill_char=typer.style("█", fg="green"), show_pos=True) as bar:
             for video_with_meta in bar:
@@ -512,7 +862,7 @@ def audit_youtube_channel_videos(channel_id_batch: List[str]):
                     typer.echo(
                         f"❗ Repairing channel title: {blue(id)} {green(title)} {red(video_channel_title)} != {green(channel_title)}")
                     video['channel_title'] = channel_title
-                    yt.save_video_to_db(video_with_meta)
+                    save_video_to_db(video_with_meta)
                     count += 1
         if count:
             typer.echo(
@@ -527,7 +877,7 @@ def audit_youtube_channel_videos(channel_id_batch: List[str]):
 @cli.command()
 def audit_all_youtube_channel_videos():
     """Audit all videos for a channel from the database."""
-    return(audit_youtube_channel_videos(yt.get_all_channel_ids_from_db()))
+    return(audit_youtube_channel_videos(get_all_channel_ids_from_db()))
 
 
 @cli.command()
@@ -543,8 +893,8 @@ def repair_all():
 @cli.command()
 def audit_youtube_db(repair: bool = False, clean: bool = False):
     """Audit videos in the database"""
-    for video in yt.get_videos_for_audit():
-        if not yt.audit_video_files(video):
+    for video in get_videos_for_audit():
+        if not audit_video_files(video):
             audit_youtube_video(video['_id'], repair, clean)
 
 
@@ -692,44 +1042,19 @@ def audit_youtube_db(repair: bool = False, clean: bool = False):
 # Channels
 #
 
-@show.register
-def show(entity: Channel) -> None:
-    typer.echo(
-        f"📺 YouTube channel {green(entity.id)} as of {green(entity.as_of)}:")
-    typer.echo(f'- Title       : {green(entity.title)}')
-    typer.echo(f'- Description : {green(entity.description)}')
-    typer.echo(f'- Published at: {green(entity.publishedAt)}')
-    typer.echo(f'- Subscribers : {green(entity.subscriberCount)}')
-    typer.echo(f'- Views       : {green(entity.viewCount)}')
-    typer.echo(f'- Videos      : {green(entity.videoCount)}')
-
-    # brandingSettings = channel['brandingSettings']
-    # branding_channel = brandingSettings['channel']
-    # if 'title' in branding_channel:
-    #     typer.echo(
-    #         f"- Title (B)   : {green(branding_channel['title'])}")
-    # if 'description' in branding_channel:
-    #     typer.echo(
-    #         f"- Desc. (B)   : {green(branding_channel['description'])}")
-    # if 'keywords' in branding_channel:
-    #     typer.echo(
-    #         f"- Keywords (B): {green(branding_channel['keywords'])}")
-
-
-@get_from_db.register(ChannelId)
-def _(id: ChannelId) -> Channel:
+def get_channel_from_db(channel_id):
 
     try:
-        return get_db().yt_channels.find_one({'_id': id})
+        return find_one_cached(get_db().yt_channels, channel_id)
 
     except Exception as e:
         Logger().exception(e)
 
-# @ensure.register(ChannelId)
-
 
 def ensure_channel(id, force: bool = False):
-    return ensure_batch(id_batch, yt.get_channel_from_db_batch, sync_youtube_channel_batch, force)
+    res = ensure_batch_impl(
+        [id], get_channel_from_db_batch, sync_channel_batch, force)
+    return res[0] if res else None
 
 
 def sync_channel_batch(channel_id_batch: List[str]):
@@ -737,7 +1062,7 @@ def sync_channel_batch(channel_id_batch: List[str]):
     channel_id_batch = list(channel_id_batch)
     print(f"🔄 Syncing {len(channel_id_batch)} channels from YouTube...")
 
-    channel_with_meta_batch = yt.get_channel_from_youtube_batch(
+    channel_with_meta_batch = get_channel_from_youtube_batch(
         channel_id_batch)
     if not channel_with_meta_batch:
         plural = 's' if len(channel_id_batch) > 1 else ''
@@ -745,7 +1070,7 @@ def sync_channel_batch(channel_id_batch: List[str]):
         typer.echo(f"❗ {red(msg)}: {green(channel_id_batch)}")
         return
 
-    yt.save_channel_to_db_batch(channel_with_meta_batch)
+    save_channel_to_db_batch(channel_with_meta_batch)
     typer.echo(f"✅ {green(len(channel_with_meta_batch))} channels synced")
 
     return channel_with_meta_batch
@@ -782,22 +1107,27 @@ def get_channel_from_youtube_batch(channel_id_batch):
                 part="snippet,contentDetails,statistics,brandingSettings",
                 id=channel_id_batch[i:i+N],
                 maxResults=50,
+                fields=channel_fields,
             )
 
             while request:
-                response = request.execute()
+                response = execute(request)
                 if 'items' not in response:
                     break
                 for channel in response['items']:
                     channel_with_meta = {}
                     channel_with_meta['_id'] = channel['id']
-                    channel_with_meta['as_of'] = str(datetime.now())
+                    channel_with_meta['as_of'] = datetime.utcnow()
                     channel_with_meta['channel'] = channel
                     channel_with_meta_batch.append(channel_with_meta)
                 request = youtube.channels().list_next(request, response)
 
         return channel_with_meta_batch
 
+    except QuotaDeferred as e:
+        Logger().warning(e)
+        return channel_with_meta_batch
+
     except Exception as e:
         Logger().exception(e)
 
@@ -805,50 +1135,67 @@ def get_channel_from_youtube_batch(channel_id_batch):
 def get_all_channel_ids_from_db():
 
     try:
-        return [channel['_id'] for channel in get_db().yt_channels.find()]
+        return find_ids(get_db().yt_channels)
 
     except Exception as e:
         Logger().exception(e)
 
 
-def get_channel_from_db_batch(channel_id_batch):
+def get_channel_from_db_batch(channel_id_batch, projection=None):
 
     try:
-        channels_cursor = get_db().yt_channels.find(
-            {'_id': {'$in': channel_id_batch}})
-
-        return list(channels_cursor)
+        return find_in_cached(get_db().yt_channels, channel_id_batch, projection)
 
     except Exception as e:
         Logger().exception(e)
 
 
-def save_channel_to_db(channel_with_meta, to_disk=True):
+def _save_batch(kind, collection, prepare, batch, to_disk) -> BulkResult:
+    """Bulk upsert a batch, reporting (not raising) per-document failures"""
+    docs = []
+    errors = {}
+    for x in batch:
+        try:
+            docs.append(prepare(x, to_disk))
+        except Exception as e:
+            errors[str(x.get('_id'))] = str(e)
+
+    res = bulk_upsert(collection, docs)
+    res.errors.update(errors)
+    for id, error in res.errors.items():
+        Logger().error(f"Unable to save {kind} {id}: {error}")
+    return res
 
-    try:
-        channel_id = channel_with_meta['_id']
 
-        if to_disk:
-            with open(os.path.join(yt_channels_bkp_dir, f"yt_channel_{channel_id}.json"), "w") as result:
-                json.dump(channel_with_meta, result, indent=2)
+def _prepare_channel(channel_with_meta, to_disk):
+    if 'channel' in channel_with_meta:
+        channel_with_meta = {**channel_with_meta, 'channel': slim(
+            channel_with_meta['channel'], parse_fields(channel_fields)['items'])}
 
-        get_db().yt_channels.update_one(
-            {'_id': channel_id}, {'$set': channel_with_meta}, upsert=True)
+    if to_disk:
+        BackupLog().append('yt_channels', channel_with_meta)
 
-    except Exception as e:
-        Logger().exception(e)
+    return channel_with_meta
 
 
-def save_channel_to_db_batch(channel_with_meta_batch, to_disk=True):
+def save_channel_to_db(channel_with_meta, to_disk=True):
 
     try:
-        for channel_with_meta in channel_with_meta_batch:
-            save_channel_to_db(channel_with_meta, to_disk)
+        channel_with_meta = _prepare_channel(channel_with_meta, to_disk)
+        get_db().yt_channels.update_one(
+            {'_id': channel_with_meta['_id']}, {'$set': channel_with_meta}, upsert=True)
+        invalidate(get_db().yt_channels, [channel_with_meta['_id']])
 
     except Exception as e:
         Logger().exception(e)
 
 
+def save_channel_to_db_batch(channel_with_meta_batch, to_disk=True) -> BulkResult:
+
+    return _save_batch('channel', get_db().yt_channels,
+                       _prepare_channel, channel_with_meta_batch, to_disk)
+
+
 def get_channel_playlists_from_youtube(channel_id):
 
     try:
@@ -857,12 +1204,13 @@ def get_channel_playlists_from_youtube(channel_id):
             channelId=channel_id,
             part="id,snippet,contentDetails",
             maxResults=50,
+            fields=playlist_fields,
         )
 
         playlists = []
 
         while request:
-            response = request.execute()
+            response = execute(request)
             if 'items' not in response:
                 break
             playlists.extend(response['items'])
@@ -870,24 +1218,71 @@ def get_channel_playlists_from_youtube(channel_id):
 
         channel_playlists_with_meta = {}
         channel_playlists_with_meta['_id'] = channel_id
-        channel_playlists_with_meta['as_of'] = str(datetime.now())
+        channel_playlists_with_meta['as_of'] = datetime.utcnow()
         channel_playlists_with_meta['playlists'] = playlists
 
         return channel_playlists_with_meta
 
+    except QuotaDeferred:
+        raise
+
+    except Exception as e:
+        Logger().exception(e)
+
+
+async def get_channel_playlists_from_youtube_async(youtube: AsyncYouTube, channel_id):
+
+    try:
+        playlists = await youtube.list_all(
+            'playlists',
+            channelId=channel_id,
+            part="id,snippet,contentDetails",
+            maxResults=50,
+            fields=playlist_fields,
+        )
+
+        channel_playlists_with_meta = {}
+        channel_playlists_with_meta['_id'] = channel_id
+        channel_playlists_with_meta['as_of'] = datetime.utcnow()
+        channel_playlists_with_meta['playlists'] = playlists
+
+        return channel_playlists_with_meta
+
+    except QuotaDeferred:
+        raise
+
     except Exception as e:
         Logger().exception(e)
 
 
 def get_channel_playlists_from_youtube_batch(channel_id_batch):
-    channel_playlists_with_meta_batch = []
-    for channel_id in channel_id_batch:
-        channel_playlists_with_meta = get_channel_playlists_from_youtube(
-            channel_id)
-        if channel_playlists_with_meta:
+
+    try:
+        youtube = youtube_api()
+        requests = {
+            channel_id: youtube.playlists().list(
+                channelId=channel_id,
+                part="id,snippet,contentDetails",
+                maxResults=50,
+                fields=playlist_fields,
+            ) for channel_id in channel_id_batch
+        }
+
+        playlists_batch = execute_paged_batch(youtube, 'playlists', requests)
+
+        channel_playlists_with_meta_batch = []
+        for channel_id, playlists in playlists_batch.items():
+            channel_playlists_with_meta = {}
+            channel_playlists_with_meta['_id'] = channel_id
+            channel_playlists_with_meta['as_of'] = datetime.utcnow()
+            channel_playlists_with_meta['playlists'] = playlists
             channel_playlists_with_meta_batch.append(
                 channel_playlists_with_meta)
-    return channel_playlists_with_meta_batch
+
+        return channel_playlists_with_meta_batch
+
+    except Exception as e:
+        Logger().exception(e)
 
 
 def get_channel_playlists_from_db(channel_id):
@@ -899,43 +1294,42 @@ def get_channel_playlists_from_db(channel_id):
         Logger().exception(e)
 
 
-def get_channel_playlists_from_db_batch(channel_id_batch):
+def get_channel_playlists_from_db_batch(channel_id_batch, projection=None):
 
     try:
-        channels_cursor = get_db().yt_channel_playlists.find(
-            {'_id': {'$in': channel_id_batch}})
-
-        return list(channels_cursor)
+        return find_in(get_db().yt_channel_playlists, channel_id_batch, projection)
 
     except Exception as e:
         Logger().exception(e)
 
 
-def save_channel_playlists_to_db(channel_playlists_with_meta, to_disk=True):
+def _prepare_channel_playlists(channel_playlists_with_meta, to_disk):
+    channel_playlists_with_meta = {**channel_playlists_with_meta, 'playlists': slim_items(
+        channel_playlists_with_meta.get('playlists', []), playlist_fields)}
 
-    try:
-        channel_id = channel_playlists_with_meta['_id']
+    if to_disk:
+        BackupLog().append('yt_channel_playlists', channel_playlists_with_meta)
+
+    return channel_playlists_with_meta
 
-        if to_disk:
-            with open(os.path.join(yt_channel_playlists_bkp_dir, f"yt_channel_playlists_{channel_id}.json"), "w") as result:
-                json.dump(channel_playlists_with_meta, result, indent=2)
 
+def save_channel_playlists_to_db(channel_playlists_with_meta, to_disk=True):
+
+    try:
+        channel_playlists_with_meta = _prepare_channel_playlists(
+            channel_playlists_with_meta, to_disk)
         get_db().yt_channel_playlists.update_one(
-            {'_id': channel_id},
+            {'_id': channel_playlists_with_meta['_id']},
             {'$set': channel_playlists_with_meta}, upsert=True)
 
     except Exception as e:
         Logger().exception(e)
 
 
-def save_channel_playlists_to_db_batch(channel_playlists_with_meta_batch, to_disk=True):
+def save_channel_playlists_to_db_batch(channel_playlists_with_meta_batch, to_disk=True) -> BulkResult:
 
-    try:
-        for channel_playlists_with_meta in channel_playlists_with_meta_batch:
-            save_channel_playlists_to_db(channel_playlists_with_meta, to_disk)
-
-    except Exception as e:
-        Logger().exception(e)
+    return _save_batch('channel playlists', get_db().yt_channel_playlists,
+                       _prepare_channel_playlists, channel_playlists_with_meta_batch, to_disk)
 
 
 def get_channel_videos_from_db(channel_id):
@@ -953,18 +1347,19 @@ def save_offline_channel_to_db(channel_id, as_of: datetime = None, is_auto: bool
         res = get_db().yt_channels.update_one(
             {'_id': channel_id},
             {'$set': {'offline': is_auto,
-                      'offline_as_of': as_of if as_of else str(datetime.now())}},
+                      'offline_as_of': as_of if as_of else datetime.utcnow()}},
         )
+        invalidate(get_db().yt_channels, [channel_id])
         return res.modified_count
 
     except Exception as e:
         Logger().exception(e)
 
 
-def get_offline_channels_from_db():
+def get_offline_channels_from_db(projection=None):
 
     try:
-        return list(get_db().yt_channels.find({'offline': True}).sort('offline_as_of', pymongo.DESCENDING))
+        return list(get_db().yt_channels.find({'offline': True}, projection).sort('offline_as_of', pymongo.DESCENDING))
 
     except Exception as e:
         Logger().exception(e)
@@ -985,36 +1380,58 @@ def get_playlist_from_youtube(playlist_id):
         Logger().exception(e)
 
 
-def get_playlist_from_youtube_batch(playlist_id_batch):
+def get_playlist_from_youtube_batch(playlist_id_batch, stats: SyncStats = None):
+
+    stats = stats if stats is not None else SyncStats('playlists')
+    playlist_with_meta_batch = []
 
     try:
         youtube = youtube_api()
 
-        playlist_with_meta_batch = []
-
         N = 50
         for i in range(0, len(playlist_id_batch), N):
+            chunk = list(playlist_id_batch[i:i+N])
+            stored = {x['_id']: x for x in get_playlist_from_db_batch(chunk) or []}
+
+            # only a page whose playlists are all stored can be skipped
+            etag_key = page_key('playlists', chunk)
+            etag = get_page_etag(etag_key) if len(stored) == len(chunk) else None
 
             request = youtube.playlists().list(
-                id=playlist_id_batch[i:i+N],
+                id=chunk,
                 part="id,snippet,contentDetails",
                 maxResults=50,
+                fields=playlist_fields,
             )
 
             while request:
-                response = request.execute()
+                response = execute(request, etag)
+                if response is None:
+                    for playlist_id, playlist_with_meta in stored.items():
+                        stats.add_unchanged(playlist_id)
+                        playlist_with_meta_batch.append(playlist_with_meta)
+                    break
+                if 'pageToken=' not in request.uri:
+                    stats.add_page_etag(etag_key, response.get('etag'))
                 if 'items' not in response:
                     break
                 for playlist in response['items']:
                     playlist_with_meta = {}
                     playlist_with_meta['_id'] = playlist['id']
-                    playlist_with_meta['as_of'] = str(datetime.now())
+                    playlist_with_meta['as_of'] = datetime.utcnow()
                     playlist_with_meta['playlist'] = playlist
+                    stats.add(playlist['id'], stored.get(playlist['id'], {}).get(
+                        'playlist', {}).get('etag'), playlist.get('etag'))
                     playlist_with_meta_batch.append(playlist_with_meta)
                 request = youtube.playlists().list_next(request, response)
+                etag = None
 
         return playlist_with_meta_batch
 
+    except QuotaDeferred as e:
+        Logger().warning(e)
+        return playlist_with_meta_batch
+
     except Exception as e:
         Logger().exception(e)
 
@@ -1022,7 +1439,7 @@ def get_playlist_from_youtube_batch(playlist_id_batch):
 def get_playlist_from_db(playlist_id):
 
     try:
-        playlist = get_db().yt_playlists.find_one({'_id': playlist_id})
+        playlist = find_one_cached(get_db().yt_playlists, playlist_id)
 
         return playlist
 
@@ -1030,72 +1447,295 @@ def get_playlist_from_db(playlist_id):
         Logger().exception(e)
 
 
-def get_playlist_from_db_batch(playlist_id_batch):
+def get_playlist_from_db_batch(playlist_id_batch, projection=None):
 
     try:
-        playlist_cursor = get_db().yt_playlists.find(
-            {'_id': {'$in': playlist_id_batch}})
-
-        return list(playlist_cursor)
+        return find_in_cached(get_db().yt_playlists, playlist_id_batch, projection)
 
     except Exception as e:
         Logger().exception(e)
 
 
-def save_playlist_to_db(playlist_with_meta, to_disk=True):
+def _prepare_playlist(playlist_with_meta, to_disk):
+    if 'playlist' in playlist_with_meta:
+        playlist_with_meta = {**playlist_with_meta, 'playlist': slim(
+            playlist_with_meta['playlist'], parse_fields(playlist_fields)['items'])}
 
-    try:
-        playlist_id = playlist_with_meta['_id']
+    if to_disk:
+        BackupLog().append('yt_playlists', playlist_with_meta)
 
-        if to_disk:
-            with open(os.path.join(yt_playlists_bkp_dir, f"yt_playlist_{playlist_id}.json"), "w") as result:
-                json.dump(playlist_with_meta, result, indent=2)
+    return playlist_with_meta
 
+
+def save_playlist_to_db(playlist_with_meta, to_disk=True):
+
+    try:
+        playlist_with_meta = _prepare_playlist(playlist_with_meta, to_disk)
         get_db().yt_playlists.update_one(
-            {'_id': playlist_id},
+            {'_id': playlist_with_meta['_id']},
             {'$set': playlist_with_meta}, upsert=True)
+        invalidate(get_db().yt_playlists, [playlist_with_meta['_id']])
 
     except Exception as e:
         Logger().exception(e)
 
 
-def save_playlist_to_db_batch(playlist_with_meta_batch, to_disk=True):
+def save_playlist_to_db_batch(playlist_with_meta_batch, to_disk=True) -> BulkResult:
 
-    try:
-        for playlist_with_meta in playlist_with_meta_batch:
-            save_playlist_to_db(playlist_with_meta, to_disk)
+    return _save_batch('playlist', get_db().yt_playlists,
+                       _prepare_playlist, playlist_with_meta_batch, to_disk)
 
-    except Exception as e:
-        Logger().exception(e)
 
+def _item_video_id(item):
+    return item['snippet']['resourceId']['videoId']
 
-def get_playlist_items_from_youtube(playlist_id):
 
-    try:
-        youtube = youtube_api()
+def _due_for_full_sync(playlist_items_with_meta):
+    full_sync_as_of = playlist_items_with_meta.get('full_sync_as_of')
+    if not isinstance(full_sync_as_of, datetime):
+        return True
+    return datetime.utcnow() - full_sync_as_of > timedelta(days=settings.youtube_full_sync_days)
+
+
+def _get_playlist_items_head_from_youtube(youtube, stored, stats: SyncStats):
+    """
+    Fetch only the items added since the stored copy of a newest-first
+    playlist (e.g. a channel's uploads): paging stops at the first item that
+    is already stored, and the new head is merged in front of it.
+    """
+    playlist_id = stored['_id']
+    stored_items = stored['items']
+    stored_pages = stored.get('pages', [])
+    known = {_item_video_id(x) for x in stored_items}
+
+    head = []
+    first_page = None
+    reached = False
+    page_token = None
+
+    while True:
         request = youtube.playlistItems().list(
             playlistId=playlist_id,
             part="id,snippet,contentDetails",
             maxResults=50,
+            fields=playlist_item_fields,
+            pageToken=page_token,
         )
 
-        playlist_items_with_meta = {
+        etag = stored_pages[0]['etag'] if page_token is None and stored_pages else None
+        response = execute(request, etag)
+        if response is None:
+            stats.add_unchanged(playlist_id)
+            return stored
+
+        page_items = response.get('items', [])
+        if first_page is None:
+            first_page = {
+                'page_token': None,
+                'etag': response.get('etag'),
+                'next_page_token': response.get('nextPageToken'),
+                'count': len(page_items),
+            }
+
+        for item in page_items:
+            if _item_video_id(item) in known:
+                reached = True
+                break
+            head.append(item)
+
+        page_token = response.get('nextPageToken')
+        if reached or not page_token:
+            break
+
+    if not head:
+        stats.add_unchanged(playlist_id)
+        return stored
+
+    stats.add_changed(playlist_id)
+
+    # without reaching a stored item this was a full listing
+    items = list(head)
+    if reached:
+        # stored items move down by the size of the new head
+        for item in stored_items:
+            item['snippet']['position'] = item['snippet'].get(
+                'position', 0) + len(head)
+            items.append(item)
+
+    return {
+        '_id': playlist_id,
+        'as_of': datetime.utcnow(),
+        'full_sync_as_of': stored.get('full_sync_as_of'),
+        # only the first page still lines up with the merged items
+        'pages': [first_page],
+        'items': items,
+    }
+
+
+def get_playlist_items_from_youtube(playlist_id, stats: SyncStats = None, incremental: bool = False):
+    """
+    Page through a playlist's items.
+
+    Each page is requested with `If-None-Match` on the etag stored for the
+    same page token; a 304 reuses the stored items for that page. If every
+    page comes back unchanged, the stored document is returned as is and the
+    playlist is counted as unchanged (so callers can skip writing it).
+
+    With `incremental` (for newest-first playlists such as uploads), only
+    the new head of the playlist is fetched, except every
+    `youtube_full_sync_days` when a full listing reconciles deletions.
+    """
+    stats = stats if stats is not None else SyncStats('playlist items')
+
+    try:
+        youtube = youtube_api()
+
+        stored = get_playlist_items_from_db(playlist_id) or {}
+
+        if incremental and stored.get('items') and not _due_for_full_sync(stored):
+            return _get_playlist_items_head_from_youtube(youtube, stored, stats)
+        stored_pages = stored.get('pages', [])
+        stored_items = stored.get('items', [])
+
+        items = []
+        pages = []
+        modified = False
+        offset = 0
+        page_token = None
+
+        while True:
+            request = youtube.playlistItems().list(
+                playlistId=playlist_id,
+                part="id,snippet,contentDetails",
+                maxResults=50,
+                fields=playlist_item_fields,
+                pageToken=page_token,
+            )
+
+            stored_page = stored_pages[len(pages)] if len(
+                pages) < len(stored_pages) else None
+            if stored_page and stored_page['page_token'] != page_token:
+                stored_page = None
+
+            response = execute(
+                request, stored_page['etag'] if stored_page else None)
+            if response is None:
+                page = stored_page
+                items.extend(stored_items[offset:offset + page['count']])
+            else:
+                modified = True
+                page_items = response.get('items', [])
+                page = {
+                    'page_token': page_token,
+                    'etag': response.get('etag'),
+                    'next_page_token': response.get('nextPageToken'),
+                    'count': len(page_items),
+                }
+                items.extend(page_items)
+
+            if stored_page:
+                offset += stored_page['count']
+            pages.append(page)
+
+            page_token = page['next_page_token']
+            if not page_token:
+                break
+
+        if stored and not modified and len(pages) == len(stored_pages):
+            stats.add_unchanged(playlist_id)
+            return stored
+
+        if stored:
+            stats.add_changed(playlist_id)
+        else:
+            stats.add_new(playlist_id)
+
+        return {
             '_id': playlist_id,
-            'as_of': str(datetime.now())
+            'as_of': datetime.utcnow(),
+            'full_sync_as_of': datetime.utcnow(),
+            'pages': pages,
+            'items': items,
         }
 
+    except QuotaDeferred:
+        raise
+
+    except Exception as e:
+        Logger().exception(e)
+
+
+async def get_playlist_items_from_youtube_async(youtube: AsyncYouTube, playlist_id, stats: SyncStats = None):
+    """Page through a playlist's items (see `get_playlist_items_from_youtube`)"""
+    stats = stats if stats is not None else SyncStats('playlist items')
+
+    try:
+        stored = await asyncio.to_thread(get_playlist_items_from_db, playlist_id) or {}
+        stored_pages = stored.get('pages', [])
+        stored_items = stored.get('items', [])
+
         items = []
+        pages = []
+        modified = False
+        offset = 0
+        page_token = None
+
+        while True:
+            stored_page = stored_pages[len(pages)] if len(
+                pages) < len(stored_pages) else None
+            if stored_page and stored_page['page_token'] != page_token:
+                stored_page = None
+
+            response = await youtube.list(
+                'playlistItems',
+                etag=stored_page['etag'] if stored_page else None,
+                playlistId=playlist_id,
+                part="id,snippet,contentDetails",
+                maxResults=50,
+                fields=playlist_item_fields,
+                pageToken=page_token,
+            )
+            if response is None:
+                page = stored_page
+                items.extend(stored_items[offset:offset + page['count']])
+            else:
+                modified = True
+                page_items = response.get('items', [])
+                page = {
+                    'page_token': page_token,
+                    'etag': response.get('etag'),
+                    'next_page_token': response.get('nextPageToken'),
+                    'count': len(page_items),
+                }
+                items.extend(page_items)
 
-        while request:
-            response = request.execute()
-            if 'items' not in response:
+            if stored_page:
+                offset += stored_page['count']
+            pages.append(page)
+
+            page_token = page['next_page_token']
+            if not page_token:
                 break
-            items.extend(response['items'])
-            request = youtube.playlistItems().list_next(request, response)
 
-        playlist_items_with_meta['items'] = items
+        if stored and not modified and len(pages) == len(stored_pages):
+            stats.add_unchanged(playlist_id)
+            return stored
 
-        return playlist_items_with_meta
+        if stored:
+            stats.add_changed(playlist_id)
+        else:
+            stats.add_new(playlist_id)
+
+        return {
+            '_id': playlist_id,
+            'as_of': datetime.utcnow(),
+            'full_sync_as_of': datetime.utcnow(),
+            'pages': pages,
+            'items': items,
+        }
+
+    except QuotaDeferred:
+        raise
 
     except Exception as e:
         Logger().exception(e)
@@ -1104,14 +1744,25 @@ def get_playlist_items_from_youtube(playlist_id):
 def get_playlist_items_from_youtube_batch(playlist_id_batch):
 
     try:
+        youtube = youtube_api()
+        requests = {
+            playlist_id: youtube.playlistItems().list(
+                playlistId=playlist_id,
+                part="id,snippet,contentDetails",
+                maxResults=50,
+                fields=playlist_item_fields,
+            ) for playlist_id in playlist_id_batch
+        }
 
-        playlist_items_with_meta_batch = []
+        items_batch = execute_paged_batch(youtube, 'playlistItems', requests)
 
-        for playlist_id in playlist_id_batch:
-            playlist_items_with_meta = get_playlist_items_from_youtube(
-                playlist_id)
-            if playlist_items_with_meta:
-                playlist_items_with_meta_batch.append(playlist_items_with_meta)
+        playlist_items_with_meta_batch = []
+        for playlist_id, items in items_batch.items():
+            playlist_items_with_meta_batch.append({
+                '_id': playlist_id,
+                'as_of': datetime.utcnow(),
+                'items': items
+            })
 
         return playlist_items_with_meta_batch
 
@@ -1119,50 +1770,241 @@ def get_playlist_items_from_youtube_batch(playlist_id_batch):
         Logger().exception(e)
 
 
+#
+# Playlist items are stored as a header document per playlist in
+# `yt_playlist_items` (sync state: as_of, pages, count) and one document per
+# item in `yt_playlist_entries`, keyed by `<playlist_id>:<item_id>` and
+# indexed on (playlist_id, position), so a sync only writes the items that
+# changed and no playlist grows towards the document size limit.
+#
+# An entry's `position` is a sort key rather than the item's index: entries
+# that are still in order keep theirs and new or moved ones get keys between
+# their neighbours', so an item added at the head of a long playlist writes
+# one entry, not one per item after it. Items are stored without their
+# `snippet.position` (and compared on a digest of the rest), which is put
+# back from the order they are read in.
+#
+
+# below this gap between neighbouring keys, a playlist's keys are renumbered
+MIN_POSITION_STEP = 1e-6
+
+
+def _entry_item(item):
+    """An item without its position, which changes whenever an item is added before it"""
+    snippet = item.get('snippet')
+    if not snippet or 'position' not in snippet:
+        return item
+    return {**item, 'snippet': {k: v for k, v in snippet.items() if k != 'position'}}
+
+
+def _playlist_entry(playlist_id, item):
+    item = _entry_item(item)
+    return {
+        '_id': f"{playlist_id}:{item['id']}",
+        'playlist_id': playlist_id,
+        'item_id': item['id'],
+        'digest': hashlib.sha1(json.dumps({k: v for k, v in item.items() if k != 'etag'},
+                                          sort_keys=True, default=str).encode()).hexdigest(),
+        'item': item,
+    }
+
+
+def _entry_positions(stored_positions):
+    """
+    The sort keys of a playlist's entries, in playlist order, given the key
+    each one had (None for new entries). The longest run of stored keys that
+    is still increasing is kept, the other entries are keyed in between.
+    """
+    n = len(stored_positions)
+
+    # longest increasing subsequence, by index
+    tails, tail_index, previous = [], [], [None] * n
+    for i, position in enumerate(stored_positions):
+        if position is None:
+            continue
+        j = bisect.bisect_left(tails, position)
+        previous[i] = tail_index[j - 1] if j else None
+        if j == len(tails):
+            tails.append(position)
+            tail_index.append(i)
+        else:
+            tails[j] = position
+            tail_index[j] = i
+    kept = set()
+    i = tail_index[-1] if tail_index else None
+    while i is not None:
+        kept.add(i)
+        i = previous[i]
+
+    positions = [stored_positions[i] if i in kept else None for i in range(n)]
+    i = 0
+    while i < n:
+        if positions[i] is not None:
+            i += 1
+            continue
+        j = i
+        while j < n and positions[j] is None:
+            j += 1
+        lo = positions[i - 1] if i else None
+        hi = positions[j] if j < n else None
+        k = j - i
+        if lo is None and hi is None:
+            positions[i:j] = range(k)
+        elif lo is None:
+            positions[i:j] = [hi - k + x for x in range(k)]
+        elif hi is None:
+            positions[i:j] = [lo + 1 + x for x in range(k)]
+        else:
+            step = (hi - lo) / (k + 1)
+            if step < MIN_POSITION_STEP:
+                return list(range(n))
+            positions[i:j] = [lo + step * (x + 1) for x in range(k)]
+        i = j
+    return positions
+
+
+def iter_playlist_items_from_db(playlist_id, projection=None):
+    """Stream a playlist's stored items in position order"""
+    entries_cursor = get_db().yt_playlist_entries.find(
+        {'playlist_id': playlist_id}, projection).sort('position', pymongo.ASCENDING)
+    for position, entry in enumerate(entries_cursor):
+        item = entry.get('item', {})
+        if 'snippet' in item:
+            item['snippet']['position'] = position
+        yield item
+
+
 def get_playlist_items_from_db(playlist_id):
 
     try:
-        return get_db().yt_playlist_items.find_one({'_id': playlist_id})
+        playlist_items_with_meta = get_db().yt_playlist_items.find_one({'_id': playlist_id})
+        # documents not yet migrated still embed their items
+        if playlist_items_with_meta and 'items' not in playlist_items_with_meta:
+            playlist_items_with_meta['items'] = list(
+                iter_playlist_items_from_db(playlist_id))
+        return playlist_items_with_meta
 
     except Exception as e:
         Logger().exception(e)
 
 
-def get_playlist_items_from_db_batch(playlist_id_batch):
+def get_playlist_items_from_db_batch(playlist_id_batch, projection=None):
 
     try:
-        playlist_items_with_meta_batch = []
-
-        for playlist_id in playlist_id_batch:
-            playlist_items_with_meta = get_playlist_items_from_db(playlist_id)
-            if playlist_items_with_meta:
-                playlist_items_with_meta_batch.append(playlist_items_with_meta)
+        playlist_items_with_meta_batch = find_in(
+            get_db().yt_playlist_items, playlist_id_batch, projection)
+        if projection is not None:
+            return playlist_items_with_meta_batch
+
+        # one playlist's entries at a time
+        for playlist_items_with_meta in playlist_items_with_meta_batch:
+            if 'items' not in playlist_items_with_meta:
+                playlist_items_with_meta['items'] = list(
+                    iter_playlist_items_from_db(playlist_items_with_meta['_id']))
         return playlist_items_with_meta_batch
 
     except Exception as e:
         Logger().exception(e)
 
 
+def _prepare_playlist_items(playlist_items_with_meta, to_disk):
+    if 'items' in playlist_items_with_meta:
+        playlist_items_with_meta = {**playlist_items_with_meta, 'items': slim_items(
+            playlist_items_with_meta['items'], playlist_item_fields)}
+
+    if to_disk:
+        BackupLog().append('yt_playlist_items', playlist_items_with_meta)
+
+    return playlist_items_with_meta
+
+
+def _stored_playlist_entries(playlist_id_batch):
+    """playlist ID -> entry ID -> stored digest and position"""
+    stored = {x: {} for x in playlist_id_batch}
+    for entry in find_in(get_db().yt_playlist_entries, playlist_id_batch,
+                         {'playlist_id': 1, 'digest': 1, 'position': 1}, field='playlist_id'):
+        stored[entry['playlist_id']][entry['_id']] = entry
+    return stored
+
+
+def _playlist_items_changes(playlist_items_with_meta, stored):
+    """
+    Split a playlist items document into its header, the entries that are
+    new, changed or moved and the IDs of the entries removed.
+    """
+    playlist_id = playlist_items_with_meta['_id']
+    header = {k: v for k, v in playlist_items_with_meta.items() if k != 'items'}
+    if 'items' not in playlist_items_with_meta:
+        return header, [], []
+
+    items = playlist_items_with_meta['items']
+    header['count'] = len(items)
+    stored = dict(stored)
+    entries = [_playlist_entry(playlist_id, x) for x in items]
+    olds = [stored.pop(x['_id'], None) for x in entries]
+    positions = _entry_positions(
+        [x.get('position') if x else None for x in olds])
+    upserts = []
+    for entry, old, position in zip(entries, olds, positions):
+        entry['position'] = position
+        if old is None or old.get('digest') != entry['digest'] or old.get('position') != position:
+            upserts.append(entry)
+
+    # whatever is left is no longer in the playlist
+    return header, upserts, list(stored)
+
+
 def save_playlist_items_to_db(playlist_items_with_meta, to_disk=True):
 
     try:
+        playlist_items_with_meta = _prepare_playlist_items(
+            playlist_items_with_meta, to_disk)
         playlist_id = playlist_items_with_meta['_id']
+        header, upserts, removed = _playlist_items_changes(
+            playlist_items_with_meta, _stored_playlist_entries([playlist_id])[playlist_id])
 
-        if to_disk:
-            with open(os.path.join(yt_playlist_items_bkp_dir, f"yt_playlist_items_{playlist_id}.json"), "w") as result:
-                json.dump(playlist_items_with_meta, result, indent=2)
+        res = bulk_upsert(get_db().yt_playlist_entries, upserts)
+        delete_in(get_db().yt_playlist_entries, removed)
+        for id, error in res.errors.items():
+            Logger().error(f"Unable to save playlist item {id}: {error}")
 
+        # the header goes last: its pages vouch for the stored items
         get_db().yt_playlist_items.update_one(
-            {'_id': playlist_id}, {'$set': playlist_items_with_meta}, upsert=True)
+            {'_id': playlist_id}, {'$set': header, '$unset': {'items': ''}}, upsert=True)
 
     except Exception as e:
         Logger().exception(e)
 
 
-def save_playlist_items_to_db_batch(playlist_items_with_meta_batch, to_disk=True):
+def save_playlist_items_to_db_batch(playlist_items_with_meta_batch, to_disk=True) -> BulkResult:
 
+    headers = []
+    upserts = []
+    removed = []
+    errors = {}
+    stored = _stored_playlist_entries(
+        [x['_id'] for x in playlist_items_with_meta_batch])
     for playlist_items_with_meta in playlist_items_with_meta_batch:
-        save_playlist_items_to_db(playlist_items_with_meta, to_disk)
+        playlist_id = playlist_items_with_meta['_id']
+        try:
+            header, playlist_upserts, playlist_removed = _playlist_items_changes(
+                _prepare_playlist_items(playlist_items_with_meta, to_disk), stored[playlist_id])
+        except Exception as e:
+            errors[str(playlist_id)] = str(e)
+            continue
+        headers.append(header)
+        upserts.extend(playlist_upserts)
+        removed.extend(playlist_removed)
+
+    res = bulk_upsert(get_db().yt_playlist_entries, upserts)
+    delete_in(get_db().yt_playlist_entries, removed)
+    header_res = bulk_upsert(get_db().yt_playlist_items,
+                             headers, unset=['items'])
+    res.errors.update(header_res.errors)
+    res.errors.update(errors)
+    for id, error in res.errors.items():
+        Logger().error(f"Unable to save playlist items {id}: {error}")
+    return res
 
 
 def save_offline_playlist_to_db(playlist_id, as_of: datetime = None, is_auto: bool = False):
@@ -1171,18 +2013,19 @@ def save_offline_playlist_to_db(playlist_id, as_of: datetime = None, is_auto: bo
         res = get_db().yt_playlists.update_one(
             {'_id': playlist_id},
             {'$set': {'offline': is_auto,
-                      'offline_as_of': as_of if as_of else str(datetime.now())}},
+                      'offline_as_of': as_of if as_of else datetime.utcnow()}},
         )
+        invalidate(get_db().yt_playlists, [playlist_id])
         return res.modified_count
 
     except Exception as e:
         Logger().exception(e)
 
 
-def get_offline_playlists_from_db():
+def get_offline_playlists_from_db(projection=None):
 
     try:
-        return list(get_db().yt_playlists.find({'offline': True}).sort('offline_as_of', pymongo.DESCENDING))
+        return list(get_db().yt_playlists.find({'offline': True}, projection).sort('offline_as_of', pymongo.DESCENDING))
 
     except Exception as e:
         Logger().exception(e)
@@ -1190,10 +2033,11 @@ def get_offline_playlists_from_db():
 
 def add_item_to_youtube_playlist(playlist_id, item_id):
 
-    try:
+    def insert():
         youtube = youtube_api()
         request = youtube.playlistItems().insert(
             part="snippet",
+            fields="id,snippet(position,resourceId/videoId)",
             body={
                 "snippet": {
                     "playlistId": playlist_id,
@@ -1204,30 +2048,80 @@ def add_item_to_youtube_playlist(playlist_id, item_id):
                 }
             }
         )
-        res = request.execute()
+        return execute(request)
+
+    try:
+        # an insert isn't idempotent: only throttled (rejected) calls are retried
+        res = call_with_retry(insert, write_limiter(), idempotent=False)
+        save_playlist_insert_to_db(playlist_id, item_id, res)
 
         Logger().info(
             f"Added item {item_id} to playlist {playlist_id}: {res}")
 
         return res
 
+    except QuotaDeferred:
+        raise
+
     except Exception as e:
         Logger().exception(e)
 
 
-def add_item_to_youtube_playlist_batch(playlist_id, item_id_batch):
+def add_item_to_youtube_playlist_batch(playlist_id, item_id_batch) -> List[str]:
+    """Insert items into a playlist, returning the IDs of those that failed"""
 
+    # skip what a previous (interrupted) run already inserted
+    done = get_playlist_inserts_from_db(playlist_id, item_id_batch)
+    todo = [x for x in item_id_batch if x not in done]
+    if done:
+        Logger().info(
+            f"Resuming playlist {playlist_id}: {len(done)} item(s) already inserted")
+
+    added = 0
+    failed = []
+    i = 0
     try:
-        for item_id in item_id_batch:
-            res = add_item_to_youtube_playlist(playlist_id, item_id)
-            print(
-                f"Batch: Added item {item_id} to playlist {playlist_id}: {res}")
-            # avoid rate limit
-            time.sleep(1)
+        for i, item_id in enumerate(todo):
+            # failures are logged by add_item_to_youtube_playlist
+            if add_item_to_youtube_playlist(playlist_id, item_id):
+                added += 1
+            else:
+                failed.append(item_id)
+
+    except QuotaDeferred as e:
+        Logger().warning(
+            f"Deferred {len(todo) - i} item(s) for playlist {playlist_id}: {e}")
 
     except Exception as e:
         Logger().exception(e)
 
+    Logger().info(
+        f"Added {added} item(s) to playlist {playlist_id}, {len(failed)} failed")
+    if failed:
+        Logger().warning(
+            f"Unable to add {len(failed)} item(s) to playlist {playlist_id}: {failed}")
+    return failed
+
+
+def save_playlist_insert_to_db(playlist_id, item_id, res) -> None:
+    """Record a completed insert so an interrupted merge can resume"""
+    get_db().yt_playlist_inserts.update_one(
+        {'_id': f'{playlist_id}:{item_id}'},
+        {'$set': {
+            'playlist_id': playlist_id,
+            'item_id': item_id,
+            'playlist_item_id': res.get('id') if res else None,
+            'as_of': datetime.utcnow(),
+        }},
+        upsert=True)
+
+
+def get_playlist_inserts_from_db(playlist_id, item_id_batch) -> Set[str]:
+    """The items of `item_id_batch` already inserted into `playlist_id`"""
+    docs = find_in(get_db().yt_playlist_inserts,
+                   [f'{playlist_id}:{x}' for x in item_id_batch], {'item_id': 1})
+    return {x['item_id'] for x in docs}
+
 
 def get_playlist_merges_from_db(target_playlist_id=None):
 
@@ -1244,7 +2138,7 @@ def add_playlist_merge_to_db(target_playlist_id, source_playlist_id, as_of: date
         res = get_db().yt_playlist_merges.insert_one(
             {'target_playlist_id': target_playlist_id,
                 'source_playlist_id': source_playlist_id},
-            {'$set': {'as_of': as_of if as_of else str(datetime.now())}},
+            {'$set': {'as_of': as_of if as_of else datetime.utcnow()}},
         )
         return res.inserted_id
 
@@ -1258,7 +2152,7 @@ def update_playlist_merge_to_db(target_playlist_id, source_playlist_id, as_of: d
         res = get_db().yt_playlist_merges.update_one(
             {'target_playlist_id': target_playlist_id,
                 'source_playlist_id': source_playlist_id},
-            {'$set': {'as_of': as_of if as_of else str(datetime.now())}},
+            {'$set': {'as_of': as_of if as_of else datetime.utcnow()}},
         )
         return res.modified_count
 
@@ -1473,7 +2367,7 @@ def extract_video_info(data, files=None):
 
         info_with_meta = {
             '_id': data['id'],
-            'as_of': str(datetime.now()),
+            'as_of': datetime.utcnow(),
             'video': {
                 'title': data['title'] if 'title' in data else id,
                 'description': data['description'] if 'description' in data else '',
@@ -1551,54 +2445,78 @@ class MyLogger:
             self._progress_bar.update(update)
 
 
-def get_video_from_youtube(video_url, show_progress=True):
+def youtube_dl_options(show_progress=True):
+    yt_logger = MyLogger(show_progress)
+    return {
+        'logger': yt_logger,
+        'writethumbnail': True,
+        'paths': {
+            'home': settings.tmp_dir,
+        },
+        'outtmpl': '%(title)s-%(id)s.%(ext)s',
+        'progress_hooks': [yt_logger.progress_hook] if show_progress else [],
+    }
+
+
+def get_video_from_youtube(video_url, show_progress=True, ydl=None):
+    """Download a video, with `ydl` if given (a `YoutubeDL` kept warm by the caller)"""
 
     try:
 
-        yt_logger = MyLogger(show_progress)
-        ydl_opts = {
-            'logger': yt_logger,
-            'writethumbnail': True,
-            'paths': {
-                'home': settings.tmp_dir,
-            },
-            'outtmpl': '%(title)s-%(id)s.%(ext)s',
-            'progress_hooks': [yt_logger.progress_hook] if show_progress else [],
-        }
+        if ydl is None:
+            with yt_dlp.YoutubeDL(youtube_dl_options(show_progress)) as ydl:
+                return _download_with(ydl, video_url)
+        return _download_with(ydl, video_url)
 
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(video_url)
-            info = ydl.sanitize_info(info)
+    except Exception as e:
+        Logger().error(e)
 
-            # find the thumbnail file
-            for thumbnail in info['thumbnails']:
-                if "filepath" in thumbnail:
-                    thumbnail_filename = thumbnail["filepath"].split('/')[-1]
-                    break
 
-            # derive the other filenames
-            basename, _ = os.path.splitext(thumbnail_filename)
-            video_filename = f"{basename}.{info['ext']}"
-            info_filename = f"{basename}.info.json"
+def _download_with(ydl, video_url):
 
-            # write info to file
-            with open(os.path.join(settings.tmp_dir, info_filename), 'w') as f:
-                json.dump(info, f, indent=2)
+    info = ydl.extract_info(video_url)
+    info = ydl.sanitize_info(info)
 
-            dst_dir = os.path.join(
-                settings.youtube_channels_dir, info['channel'])
-            os.makedirs(dst_dir, exist_ok=True)
+    # find the thumbnail file
+    for thumbnail in info['thumbnails']:
+        if "filepath" in thumbnail:
+            thumbnail_filename = thumbnail["filepath"].split('/')[-1]
+            break
 
-            # move files to destination
-            move_file(settings.tmp_dir, dst_dir, thumbnail_filename)
-            move_file(settings.tmp_dir, dst_dir, video_filename)
-            move_file(settings.tmp_dir, dst_dir, info_filename)
+    # derive the other filenames
+    basename, _ = os.path.splitext(thumbnail_filename)
+    video_filename = f"{basename}.{info['ext']}"
+    info_filename = f"{basename}.info.json"
 
-            return extract_video_info(info, {
-                'video_filename': video_filename,
-                'info_filename': info_filename,
-                'thumbnail_filename': thumbnail_filename,
-            })
+    # write info to file
+    with open(os.path.join(settings.tmp_dir, info_filename), 'w') as f:
+        json.dump(info, f, indent=2)
+
+    dst_dir = os.path.join(
+        settings.youtube_channels_dir, info['channel'])
+    os.makedirs(dst_dir, exist_ok=True)
+
+    # move files to destination
+    move_file(settings.tmp_dir, dst_dir, thumbnail_filename)
+    move_file(settings.tmp_dir, dst_dir, video_filename)
+    move_file(settings.tmp_dir, dst_dir, info_filename)
+
+    return extract_video_info(info, {
+        'video_filename': video_filename,
+        'info_filename': info_filename,
+        'thumbnail_filename': thumbnail_filename,
+    })
+
+
+def get_video_info_from_youtube(video_id):
+    """A video's info, without downloading it"""
+
+    try:
+
+        with yt_dlp.YoutubeDL({'logger': MyLogger(False)}) as ydl:
+            info = ydl.extract_info(
+                f'https://www.youtube.com/watch?v={video_id}', download=False)
+            return ydl.sanitize_info(info)
 
     except Exception as e:
         Logger().error(e)
@@ -1608,19 +2526,17 @@ def get_video_from_db(video_id):
 
     try:
 
-        return get_db().yt_videos.find_one({'_id': video_id})
+        return find_one_cached(get_db().yt_videos, video_id)
 
     except Exception as e:
         Logger().error(e)
 
 
-def get_video_from_db_batch(video_id_batch):
+def get_video_from_db_batch(video_id_batch, projection=None):
 
     try:
 
-        videos_cursor = get_db().yt_videos.find(
-            {'_id': {'$in': video_id_batch}})
-        return list(videos_cursor)
+        return find_in_cached(get_db().yt_videos, video_id_batch, projection)
 
     except Exception as e:
         Logger().error(e)
@@ -1631,6 +2547,7 @@ def delete_video_from_db(video_id):
     try:
 
         x = get_db().yt_videos.delete_one({'_id': video_id})
+        invalidate(get_db().yt_videos, [video_id], deleted=True)
         return x.deleted_count
 
     except Exception as e:
@@ -1643,6 +2560,7 @@ def delete_video_from_db_batch(video_id_batch):
     try:
 
         x = get_db().yt_videos.delete_many({'_id': {'$in': video_id_batch}})
+        invalidate(get_db().yt_videos, video_id_batch, deleted=True)
         return x.deleted_count
 
     except Exception as e:
@@ -1673,40 +2591,42 @@ def get_videos_for_audit():
         Logger().error(e)
 
 
-def save_video_to_db(video_with_meta, to_disk=False):
+def _prepare_video(video_with_meta, to_disk):
+    if to_disk:
+        BackupLog().append('yt_videos', video_with_meta)
 
-    try:
+    return video_with_meta
 
-        id = video_with_meta['_id']
 
-        if to_disk:
-            with open(os.path.join(videos_bkp_dir, f'video_{id}.json'), 'w') as f:
-                json.dump(video_with_meta, f, indent=2)
+def save_video_to_db(video_with_meta, to_disk=False):
 
+    try:
+
+        video_with_meta = _prepare_video(video_with_meta, to_disk)
         get_db().yt_videos.update_one(
-            {'_id': id}, {'$set': video_with_meta}, upsert=True)
+            {'_id': video_with_meta['_id']}, {'$set': video_with_meta}, upsert=True)
+        invalidate(get_db().yt_videos, [video_with_meta['_id']])
 
     except Exception as e:
         Logger().error(e)
 
 
-def save_video_to_db_batch(video_with_meta_batch, to_disk=True):
+def save_video_to_db_batch(video_with_meta_batch, to_disk=True) -> BulkResult:
 
-    try:
-
-        for video_with_meta in video_with_meta_batch:
-            save_video_to_db(video_with_meta, to_disk)
-
-    except Exception as e:
-        Logger().error(e)
+    return _save_batch('video', get_db().yt_videos,
+                       _prepare_video, video_with_meta_batch, to_disk)
 
 
-def search_db(query):
+def search_db(query, limit: int = 20, skip: int = 0):
+    """Videos matching `query`, best first, with only their title and score"""
 
     try:
 
+        score = {'$meta': 'textScore'}
         videos_cursor = get_db().yt_videos.find(
-            {'$text': {'$search': query}})  # .sort({'score': {'$meta': "textScore"}})
+            {'$text': {'$search': query}},
+            {'video.title': 1, 'score': score},
+        ).sort([('score', score)]).skip(skip).limit(limit)
         return list(videos_cursor)
 
     except Exception as e:
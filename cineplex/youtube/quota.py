@@ -0,0 +1,264 @@
+import heapq
+import itertools
+import json
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from zoneinfo import ZoneInfo
+#
+from pymongo import ReturnDocument
+from googleapiclient.errors import HttpError
+#
+from cineplex.db import get_db
+from cineplex.logger import Logger
+from cineplex.config import Settings
+from cineplex.youtube.cache import ResponseCache
+
+settings = Settings()
+
+#
+# Quota costs
+#
+# Unit cost of each endpoint against the daily YouTube Data API quota, see
+# https://developers.google.com/youtube/v3/determine_quota_cost
+#
+
+QUOTA_COSTS = {
+    'channels.list': 1,
+    'playlists.list': 1,
+    'playlistItems.list': 1,
+    'playlistItems.insert': 50,
+    'videos.list': 1,
+    'search.list': 100,
+}
+
+# the daily quota resets at midnight Pacific time
+QUOTA_TZ = ZoneInfo('America/Los_Angeles')
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 10
+PRIORITY_LOW = 20
+
+
+class QuotaDeferred(Exception):
+    """Raised instead of issuing a request the remaining quota can't cover"""
+
+    def __init__(self, endpoint, cost, remaining):
+        super().__init__(
+            f"{endpoint} costs {cost} units but only {remaining} remain today")
+        self.endpoint = endpoint
+        self.cost = cost
+        self.remaining = remaining
+
+
+def endpoint_of(request) -> str:
+    """The `resource.method` name of a googleapiclient request"""
+    return request.methodId.split('.', 1)[1]
+
+
+def cost_of(endpoint: str) -> int:
+    return QUOTA_COSTS.get(endpoint, 1)
+
+
+def http_error_reason(e: HttpError) -> str:
+    """The first `reason` of a YouTube API error response"""
+    try:
+        errors = json.loads(e.content)['error']['errors']
+        return errors[0]['reason']
+    except Exception:
+        return None
+
+
+def quota_day() -> str:
+    return datetime.now(QUOTA_TZ).strftime('%Y-%m-%d')
+
+
+class _Job:
+
+    def __init__(self, fn, endpoint, cost, priority, label):
+        self.fn = fn
+        self.endpoint = endpoint
+        self.cost = cost
+        self.priority = priority
+        self.label = label
+
+
+class QuotaScheduler:
+    """
+    Process-wide YouTube API quota accounting.
+
+    The units used today are persisted in `yt_quota` (one document per quota
+    day), so successive CLI runs and parallel workers share one budget.
+    Every request goes through `execute()`, which reserves its cost up front
+    and raises `QuotaDeferred` rather than spending quota that isn't there.
+    Larger units of work can be queued with `submit()` and drained by
+    `run()` in priority order; whatever doesn't fit in today's budget is
+    left in `deferred` instead of failing.
+    """
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super(QuotaScheduler, cls).__new__(cls)
+            cls._instance._lock = threading.Lock()
+            cls._instance._queue = []
+            cls._instance._seq = itertools.count()
+            cls._instance.deferred = []
+        return cls._instance
+
+    @property
+    def daily_quota(self) -> int:
+        return settings.youtube_daily_quota
+
+    def used(self) -> int:
+        doc = get_db().yt_quota.find_one({'_id': quota_day()})
+        return doc['used'] if doc else 0
+
+    def remaining(self) -> int:
+        return max(self.daily_quota - self.used(), 0)
+
+    def reserve(self, endpoint: str, cost: int = None) -> None:
+        """Charge `cost` units to today's budget, or raise `QuotaDeferred`"""
+        cost = cost if cost is not None else cost_of(endpoint)
+        day = quota_day()
+        doc = get_db().yt_quota.find_one_and_update(
+            {'_id': day},
+            {'$inc': {'used': cost, f'endpoints.{endpoint}': cost}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc['used'] > self.daily_quota:
+            get_db().yt_quota.update_one(
+                {'_id': day},
+                {'$inc': {'used': -cost, f'endpoints.{endpoint}': -cost}})
+            raise QuotaDeferred(
+                endpoint, cost, max(self.daily_quota - doc['used'] + cost, 0))
+
+    def exhaust(self) -> None:
+        """Mark today's budget as spent (YouTube said `quotaExceeded`)"""
+        get_db().yt_quota.update_one(
+            {'_id': quota_day()},
+            {'$max': {'used': self.daily_quota}},
+            upsert=True)
+
+    def execute(self, request, etag: str = None):
+        """
+        Execute a googleapiclient request against the quota budget. Given an
+        `etag`, the request is made conditional and None is returned if the
+        resource hasn't changed (304 Not Modified).
+        """
+        endpoint = endpoint_of(request)
+
+        # cached responses cost no quota
+        cache = ResponseCache()
+        response = cache.get(endpoint, request)
+        if response is not None:
+            return None if etag and response.get('etag') == etag else response
+
+        self.reserve(endpoint)
+        if etag:
+            request.headers['If-None-Match'] = etag
+        try:
+            response = request.execute()
+            if request.method == 'GET':
+                cache.put(endpoint, request, response)
+            else:
+                # a write makes the cached listings of that resource stale
+                cache.purge(endpoint.split('.')[0])
+            return response
+        except HttpError as e:
+            if e.resp.status == 304:
+                return None
+            if http_error_reason(e) in ('quotaExceeded', 'dailyLimitExceeded'):
+                self.exhaust()
+                raise QuotaDeferred(endpoint, cost_of(endpoint), 0) from e
+            raise
+
+    def execute_batch(self, batch, requests):
+        """Execute a BatchHttpRequest made of `requests` against the budget"""
+        endpoint = endpoint_of(requests[0])
+        self.reserve(endpoint, sum(cost_of(endpoint_of(x)) for x in requests))
+        batch.execute()
+
+    def submit(self, fn, endpoint: str, priority: int = PRIORITY_NORMAL, cost: int = None, label: str = None) -> None:
+        """
+        Queue `fn` for `run()`. `cost` is the estimated number of units the
+        job will spend on `endpoint` requests (lower priority runs first).
+        """
+        cost = cost if cost is not None else cost_of(endpoint)
+        job = _Job(fn, endpoint, cost, priority, label)
+        with self._lock:
+            heapq.heappush(self._queue, (priority, next(self._seq), job))
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._queue)
+
+    def _pop(self):
+        with self._lock:
+            if not self._queue:
+                return None
+            return heapq.heappop(self._queue)[2]
+
+    def _defer(self, job, remaining) -> None:
+        Logger().warning(
+            f"Deferring {job.label or job.endpoint}: needs ~{job.cost} units, {remaining} remain")
+        with self._lock:
+            self.deferred.append(job)
+
+    def _next_runnable(self):
+        """Pop the next job the remaining budget can cover, deferring others"""
+        while True:
+            job = self._pop()
+            if job is None:
+                return None
+
+            remaining = self.remaining()
+            if job.cost <= remaining:
+                return job
+            self._defer(job, remaining)
+
+    def run(self, max_workers: int = 1, on_result=None) -> list:
+        """
+        Run queued jobs in priority order while the budget lasts, with up to
+        `max_workers` in flight. `on_result(job, result)` is called on the
+        calling thread as each job finishes. Jobs that don't fit are moved
+        to `deferred` (and can be re-submitted once the quota resets);
+        returns the results of the jobs that ran, in completion order.
+        """
+        results = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            running = {}
+            while True:
+                while len(running) < max_workers:
+                    job = self._next_runnable()
+                    if job is None:
+                        break
+                    running[executor.submit(job.fn)] = job
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    try:
+                        result = future.result()
+                    except QuotaDeferred as e:
+                        self._defer(job, e.remaining)
+                        continue
+                    results.append(result)
+                    if on_result:
+                        on_result(job, result)
+
+        return results
+
+    def take_deferred(self) -> list:
+        """Return and forget the jobs deferred so far"""
+        with self._lock:
+            deferred, self.deferred = self.deferred, []
+        return deferred
+
+
+def execute(request, etag: str = None):
+    return QuotaScheduler().execute(request, etag)
@@ -0,0 +1,121 @@
+import random
+import threading
+import time
+#
+from googleapiclient.errors import HttpError
+#
+from cineplex.logger import Logger
+from cineplex.config import Settings
+from cineplex.youtube.quota import http_error_reason
+
+settings = Settings()
+
+# 403 reasons that mean "slow down" rather than "not allowed"
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+
+
+class RateLimiter:
+    """
+    Token bucket whose refill rate adapts to the server (AIMD).
+
+    Every success nudges the rate up by `increase` tokens/s until `max_rate`;
+    every throttling response halves it (down to `min_rate`), so throughput
+    settles just under what the API allows instead of a fixed pace.
+    """
+
+    def __init__(self, rate: float, max_rate: float, min_rate: float = 0.1, capacity: float = 1, increase: float = 0.1):
+        self.rate = rate
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.capacity = capacity
+        self.increase = increase
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens +
+                           (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens: float = 1) -> None:
+        """Block until `tokens` are available and take them"""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.rate = min(self.rate + self.increase, self.max_rate)
+
+    def on_throttle(self) -> None:
+        with self._lock:
+            self.rate = max(self.rate / 2, self.min_rate)
+            self._tokens = 0
+
+
+def backoff_delay(attempt: int, base: float = 1, cap: float = 64) -> float:
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def is_throttled(e: Exception) -> bool:
+    """The request was rejected for going too fast (and so not applied)"""
+    if not isinstance(e, HttpError):
+        return False
+    status = e.resp.status
+    return status == 429 or (status == 403 and http_error_reason(e) in RATE_LIMIT_REASONS)
+
+
+def is_server_error(e: Exception) -> bool:
+    return isinstance(e, HttpError) and e.resp.status >= 500
+
+
+def call_with_retry(fn, limiter: RateLimiter, idempotent: bool, max_retries: int = None):
+    """
+    Call `fn` under `limiter`, retrying with jittered exponential backoff.
+
+    Throttled requests (429, 403 rateLimitExceeded) were never applied and
+    are always retried; 5xx responses are only retried when `idempotent`,
+    as the request may have gone through.
+    """
+    max_retries = max_retries if max_retries is not None else settings.youtube_max_retries
+    attempt = 0
+    while True:
+        limiter.acquire()
+        try:
+            res = fn()
+            limiter.on_success()
+            return res
+        except Exception as e:
+            throttled = is_throttled(e)
+            if throttled:
+                limiter.on_throttle()
+            if attempt >= max_retries or not (throttled or (idempotent and is_server_error(e))):
+                raise
+            delay = backoff_delay(attempt)
+            Logger().warning(
+                f"Retrying in {delay:.1f}s (attempt {attempt + 1}/{max_retries}): {e}")
+            time.sleep(delay)
+            attempt += 1
+
+
+_write_limiter = None
+_write_limiter_lock = threading.Lock()
+
+
+def write_limiter() -> RateLimiter:
+    """The process-wide limiter for YouTube API writes"""
+    global _write_limiter
+    with _write_limiter_lock:
+        if _write_limiter is None:
+            _write_limiter = RateLimiter(
+                rate=settings.youtube_write_rate,
+                max_rate=settings.youtube_write_max_rate)
+        return _write_limiter
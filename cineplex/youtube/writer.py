@@ -0,0 +1,54 @@
+from typing import Dict, List
+#
+import ray
+#
+from cineplex.db import BulkResult, bulk_upsert, get_db
+from cineplex.logger import Logger
+from cineplex.config import Settings
+
+settings = Settings()
+
+#
+# Single writer
+#
+# With `mongo_single_writer` set, Ray workers don't save documents
+# themselves: they send what they would have saved to one `DbWriter` actor,
+# which buffers the documents and writes them with unordered bulk upserts.
+# Actor methods run one at a time, so the actor needs no locking. Download
+# workers still claim and complete their jobs directly (see
+# `playlist._drain_download_jobs`), so they keep a small client of their own.
+#
+
+
+@ray.remote
+class DbWriter:
+
+    def __init__(self, batch_size: int = None):
+        self.batch_size = batch_size or settings.mongo_bulk_chunk_size
+        self.pending: Dict[str, List[dict]] = {}
+        self.result = BulkResult()
+
+    def save(self, collection: str, docs: List[dict]) -> None:
+        """Queue `docs` for upsert into `collection`, writing full batches"""
+        pending = self.pending.setdefault(collection, [])
+        pending.extend(docs)
+        if len(pending) >= self.batch_size:
+            self._write(collection)
+
+    def _write(self, collection: str) -> None:
+        docs = self.pending.pop(collection, [])
+        if not docs:
+            return
+        res = bulk_upsert(get_db()[collection], docs)
+        for id, error in res.errors.items():
+            Logger().error(f"Unable to save {collection} {id}: {error}")
+        self.result.inserted += res.inserted
+        self.result.modified += res.modified
+        self.result.unchanged += res.unchanged
+        self.result.errors.update(res.errors)
+
+    def flush(self) -> BulkResult:
+        """Write everything still queued and return the totals so far"""
+        for collection in list(self.pending):
+            self._write(collection)
+        return self.result
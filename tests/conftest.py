@@ -0,0 +1,64 @@
+from collections import Counter
+from types import SimpleNamespace
+#
+import pytest
+#
+from cineplex.config import Settings
+from cineplex.logger import Logger
+
+settings = Settings()
+
+# the first Logger() re-reads the settings, undoing any fixture's overrides
+Logger()
+
+
+def _without_sort(add):
+    # pymongo passes `sort` to bulk operations, which mongomock doesn't take
+    def add_without_sort(self, *args, sort=None, **kwargs):
+        return add(self, *args, **kwargs)
+    return add_without_sort
+
+
+@pytest.fixture
+def mongo(monkeypatch, tmp_path):
+    """An in-memory database in place of MongoDB, for the `db` helpers and everything using them"""
+    mongomock = pytest.importorskip('mongomock')
+    from mongomock.collection import BulkOperationBuilder
+    from cineplex.backup import BackupLog
+    from cineplex.db import Database
+    from cineplex.doc_cache import DocumentCache
+
+    for name in ['add_update', 'add_replace']:
+        monkeypatch.setattr(BulkOperationBuilder, name, _without_sort(
+            getattr(BulkOperationBuilder, name)))
+
+    client = mongomock.MongoClient()
+    db = client[settings.mongo_db]
+    monkeypatch.setattr(Database, '_instance',
+                        SimpleNamespace(client=client, db=db))
+    monkeypatch.setattr(settings, 'tmp_dir', str(tmp_path / 'tmp'))
+    monkeypatch.setattr(settings, 'bkp_dir', str(tmp_path / 'bkp'))
+    monkeypatch.setattr(BackupLog, '_instance', None)
+    # per-test counters, so nothing is left to log at exit after pytest closes the streams
+    cache = DocumentCache()
+    cache.clear()
+    for name in ['hits', 'shared_hits', 'misses']:
+        monkeypatch.setattr(cache, name, Counter())
+    yield db
+    DocumentCache().clear()
+
+
+@pytest.fixture
+def youtube(monkeypatch, mongo):
+    """The fake YouTube API behind `youtube_api()` (see `cineplex.youtube.fake`)"""
+    from cineplex.youtube import api
+    from cineplex.youtube.cache import ResponseCache
+    from cineplex.youtube.fake import FakeYouTube
+
+    fake = FakeYouTube()
+    monkeypatch.setattr(settings, 'youtube_fake', 'synthetic')
+    monkeypatch.setattr(api, '_fake', fake)
+    monkeypatch.setattr(ResponseCache(), 'enabled', False)
+    api.reset_youtube_api()
+    yield fake
+    api.reset_youtube_api()
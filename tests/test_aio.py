@@ -0,0 +1,75 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+#
+from cineplex.youtube import aio
+from cineplex.youtube.aio import AsyncYouTube
+
+
+def playlist_id(c=0, p=0):
+    return f'PL{c:016d}{p:016d}'
+
+
+def run(coro):
+    async def main():
+        async with AsyncYouTube(concurrency=2) as youtube:
+            return await coro(youtube)
+    return asyncio.run(main())
+
+
+def test_list_all(youtube):
+    youtube.add_synthetic(channels=1, playlists=1, items=120)
+    items = run(lambda yt: yt.list_all(
+        'playlistItems', part='snippet', playlistId=playlist_id(), maxResults=50))
+    assert [x['snippet']['position'] for x in items] == list(range(120))
+    assert youtube.stats['playlistItems.list'] == 3
+
+
+def test_list_not_modified(youtube):
+    youtube.add_synthetic(channels=1, playlists=1, items=10)
+
+    async def list_twice(yt):
+        response = await yt.list(
+            'playlistItems', part='snippet', playlistId=playlist_id(), maxResults=50)
+        return response, await yt.list(
+            'playlistItems', etag=response['etag'], part='snippet', playlistId=playlist_id(), maxResults=50)
+
+    response, unchanged = run(list_twice)
+    assert len(response['items']) == 10
+    assert unchanged is None
+    assert youtube.stats['playlistItems.list'] == 2
+
+
+def test_token_refresh_leaves_the_loop(monkeypatch):
+    threads = []
+
+    def youtube_credentials():
+        threads.append(threading.current_thread())
+        return SimpleNamespace(token='t')
+
+    class Response:
+        status = 200
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *args):
+            pass
+
+        async def read(self):
+            return b'{}'
+
+    sent = []
+
+    def request(method, url, headers, data):
+        sent.append(headers)
+        return Response()
+
+    monkeypatch.setattr(aio, 'youtube_credentials', youtube_credentials)
+    youtube = AsyncYouTube()
+    youtube.fake = None
+    youtube.session = SimpleNamespace(request=request)
+    status, _ = asyncio.run(youtube._send('GET', aio.base_url, {}, None))
+    assert status == 200
+    assert sent[0]['Authorization'] == 'Bearer t'
+    assert threads and threads[0] is not threading.main_thread()
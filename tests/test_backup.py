@@ -0,0 +1,57 @@
+import os
+import time
+#
+import pytest
+#
+from cineplex.backup import BackupLog
+
+
+@pytest.fixture
+def backup(mongo):
+    log = BackupLog()
+    yield log
+    log.close()
+
+
+def test_append_lookup_and_restore(mongo, backup):
+    backup.append('yt_videos', {'_id': 'a', 'title': 'first'})
+    backup.append('yt_channels', {'_id': 'c', 'title': 'channel'})
+    backup.append('yt_videos', {'_id': 'a', 'title': 'second'})
+    backup.append('yt_videos', {'_id': 'b', 'title': 'other'})
+    backup.flush()
+
+    assert len(backup.segments()) == 1
+    assert backup.lookup('yt_videos', 'a')['title'] == 'second'
+    assert backup.lookup('yt_videos', 'x') is None
+
+    assert backup.restore(['yt_videos']) == {'yt_videos': 2}
+    assert mongo.yt_videos.find_one({'_id': 'a'})['title'] == 'second'
+    assert mongo.yt_channels.count_documents({}) == 0
+    assert backup.restore() == {'yt_videos': 2, 'yt_channels': 1}
+
+
+def test_segments_rotate(mongo, backup):
+    backup.max_bytes = 1
+    for i in range(3):
+        backup.append('yt_videos', {'_id': 'a', 'n': i})
+        backup.flush()
+    assert len(backup.segments()) == 3
+    assert backup.lookup('yt_videos', 'a')['n'] == 2
+
+
+def test_latest_save_wins_across_interleaved_segments(mongo, backup):
+    # a long-lived writer keeps saving into the earlier-named segment after
+    # another process has opened a later one
+    early, late = '20211201120000-100-0000', '20211201120500-200-0000'
+    os.makedirs(backup.dir)
+    backup._write(early, [('yt_videos', {'_id': 'a', 'n': 1}, time.time_ns())])
+    backup._write(late, [('yt_videos', {'_id': 'a', 'n': 2}, time.time_ns()),
+                         ('yt_videos', {'_id': 'b', 'n': 2}, time.time_ns())])
+    backup._write(early, [('yt_videos', {'_id': 'a', 'n': 3}, time.time_ns())])
+
+    assert backup.segments() == [early, late]
+    assert backup.lookup('yt_videos', 'a')['n'] == 3
+    assert backup.lookup('yt_videos', 'b')['n'] == 2
+
+    assert backup.restore() == {'yt_videos': 2}
+    assert {x['_id']: x['n'] for x in mongo.yt_videos.find()} == {'a': 3, 'b': 2}
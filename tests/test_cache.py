@@ -0,0 +1,80 @@
+import json
+import os
+import time
+from types import SimpleNamespace
+#
+import pytest
+from typer.testing import CliRunner
+#
+from cineplex import youtube
+from cineplex.youtube import cache as cache_module
+from cineplex.youtube.cache import ResponseCache
+
+
+def request(uri, method='GET'):
+    return SimpleNamespace(method=method, uri=uri)
+
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(cache_module.settings, 'tmp_dir', str(tmp_path))
+    monkeypatch.setattr(cache_module.settings, 'youtube_cache', True)
+    monkeypatch.setattr(ResponseCache, '_instance', None)
+    return ResponseCache()
+
+
+def test_get_and_put(cache):
+    cache.put('videos.list', request('v?id=a'), {'id': 'a'})
+    assert cache.get('videos.list', request('v?id=a')) == {'id': 'a'}
+    assert cache.get('videos.list', request('v?id=b')) is None
+    # only reads of the endpoints with a TTL are cached
+    cache.put('videos.list', request('v?id=c', 'POST'), {'id': 'c'})
+    cache.put('search.list', request('s?q=c'), {'id': 'c'})
+    assert os.listdir(cache.dir) == [os.path.basename(cache._path('videos.list', request('v?id=a')))]
+
+
+def test_expired_entries_are_removed(cache):
+    cache.put('playlistItems.list', request('p?id=a'), {'id': 'a'})
+    path = cache._path('playlistItems.list', request('p?id=a'))
+    with open(path) as f:
+        entry = json.load(f)
+    entry['as_of'] -= cache_module.CACHE_TTLS['playlistItems.list'] + 1
+    with open(path, 'w') as f:
+        json.dump(entry, f)
+
+    assert cache.get('playlistItems.list', request('p?id=a')) is None
+    assert not os.path.exists(path)
+
+
+def test_least_recently_used_are_evicted(cache):
+    uris = ['v?id=a', 'v?id=b', 'v?id=c']
+    cache.put('videos.list', request(uris[0]), {'id': 'a'})
+    cache.put('videos.list', request(uris[1]), {'id': 'b'})
+    size = os.path.getsize(cache._path('videos.list', request(uris[0])))
+    now = time.time()
+    for age, uri in zip([200, 100], uris):
+        os.utime(cache._path('videos.list', request(uri)), (now - age, now - age))
+
+    # a hit makes `a` the most recently used
+    assert cache.get('videos.list', request(uris[0])) == {'id': 'a'}
+    cache.max_bytes = int(2.5 * size)
+    cache.put('videos.list', request(uris[2]), {'id': 'c'})
+    assert [cache.get('videos.list', request(x)) is not None for x in uris] == [True, False, True]
+
+
+def test_entry_removed_while_read_is_a_miss(cache, monkeypatch):
+    cache.put('videos.list', request('v?id=a'), {'id': 'a'})
+
+    def utime(path, *args):
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(cache_module.os, 'utime', utime)
+    assert cache.get('videos.list', request('v?id=a')) is None
+
+
+def test_no_cache_option(cache):
+    cache.put('videos.list', request('v?id=a'), {'id': 'a'})
+    res = CliRunner().invoke(youtube.cli, ['--no-cache', 'channel', '--help'])
+    assert res.exit_code == 0, res.output
+    assert not cache.enabled
+    assert cache.get('videos.list', request('v?id=a')) is None
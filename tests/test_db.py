@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta
+#
+from cineplex import db
+
+
+def test_ensure_indexes_replaces_an_old_text_index(mongo):
+    mongo.yt_videos.create_index([('$**', 'text')])
+    mongo.yt_videos.create_index([('legacy', 1)])
+
+    changes = db.ensure_indexes(prune=False)
+    assert 'dropped $**_text' in changes['yt_videos']
+    indexes = mongo.yt_videos.index_information()
+    assert 'video_text' in indexes and '$**_text' not in indexes
+    # other undeclared indexes are only dropped when pruning
+    assert 'legacy_1' in indexes
+
+
+def test_migrate_timestamps(mongo):
+    mongo.yt_videos.insert_many([
+        {'_id': 'a', 'as_of': '2021-12-01T12:30:00Z'},
+        {'_id': 'b', 'as_of': '2021-12-01T12:30:00+02:00'},
+        {'_id': 'c', 'as_of': datetime(2021, 12, 1)},
+        {'_id': 'd', 'as_of': 'yesterday'},
+    ])
+    assert db.migrate_timestamps(chunk_size=1)['yt_videos'] == 2
+    as_of = {x['_id']: x['as_of'] for x in mongo.yt_videos.find()}
+    assert as_of == {'a': datetime(2021, 12, 1, 12, 30), 'b': datetime(2021, 12, 1, 10, 30),
+                     'c': datetime(2021, 12, 1), 'd': 'yesterday'}
+    assert db.migrate_timestamps()['yt_videos'] == 0
+
+
+def test_find_stale_and_touch(mongo):
+    now = datetime.utcnow()
+    mongo.yt_videos.insert_many([
+        {'_id': 'old', 'as_of': now - timedelta(days=8)},
+        {'_id': 'never'},
+        {'_id': 'fresh', 'as_of': now - timedelta(hours=1)},
+    ])
+    assert sorted(db.find_stale(mongo.yt_videos, timedelta(days=7))) == ['never', 'old']
+    db.touch(mongo.yt_videos, ['old', 'never'])
+    assert db.find_stale(mongo.yt_videos, timedelta(days=7)) == []
+
+
+#
+# Bulk writes
+#
+
+
+def test_bulk_upsert_counts_and_partial_errors(mongo):
+    videos = mongo.yt_videos
+    videos.create_index('key', unique=True)
+    videos.insert_many([{'_id': 'a', 'key': 1, 'n': 0}, {'_id': 'b', 'key': 2, 'n': 0}])
+
+    res = db.bulk_upsert(videos, [
+        {'_id': 'a', 'key': 1, 'n': 1},
+        {'_id': 'b', 'key': 2, 'n': 0},
+        # clashes with `a`'s unique key
+        {'_id': 'c', 'key': 1},
+        {'_id': 'd', 'key': 4},
+        {'_id': 'e', 'key': 5},
+    ], chunk_size=2)
+    assert (res.inserted, res.modified, res.unchanged) == (2, 1, 1)
+    assert list(res.errors) == ['c']
+    assert 'duplicate key' in res.errors['c'].lower()
+    assert str(res) == '2 inserted, 1 modified, 1 unchanged, 1 failed'
+    assert sorted(db.find_ids(videos)) == ['a', 'b', 'd', 'e']
+
+
+def test_bulk_upsert_unset(mongo):
+    videos = mongo.yt_videos
+    videos.insert_one({'_id': 'a', 'items': [1], 'n': 0})
+    res = db.bulk_upsert(videos, [{'_id': 'a', 'n': 1}], unset=['items'])
+    assert res.modified == 1
+    assert videos.find_one({'_id': 'a'}) == {'_id': 'a', 'n': 1}
+
+
+#
+# Chunked reads
+#
+
+
+def test_in_chunks():
+    ids = [f'{i:04d}' for i in range(10)]
+    # each ID costs 1 type byte, 2 key bytes, a 4 byte length and 5 string bytes
+    chunks = list(db._in_chunks(ids, 12 * 4))
+    assert [len(x) for x in chunks] == [4, 4, 2]
+    assert sum(chunks, []) == ids
+    # a value larger than a chunk still goes through, on its own
+    assert list(db._in_chunks(['x' * 100, 'y'], 10)) == [['x' * 100], ['y']]
+
+
+def test_chunked_queries_across_chunks(mongo, monkeypatch):
+    videos = mongo.yt_videos
+    ids = [f'{i:04d}' for i in range(25)]
+    videos.insert_many([{'_id': x} for x in ids])
+    monkeypatch.setattr(db, 'max_in_bytes', 12 * 4)
+    queries = []
+    find = type(videos).find
+
+    def spy_find(self, filter=None, *args, **kwargs):
+        if filter and '_id' in filter:
+            queries.append(len(filter['_id']['$in']))
+        return find(self, filter, *args, **kwargs)
+
+    monkeypatch.setattr(type(videos), 'find', spy_find)
+
+    assert sorted(x['_id'] for x in db.find_in(videos, ids + ['missing'])) == ids
+    assert queries == [4] * 6 + [2]
+    assert db.existing_ids(videos, ids + ['missing']) == set(ids)
+
+    # cached, then deleted across chunks: the cache must not answer for them
+    assert len(db.find_in_cached(videos, ids)) == 25
+    assert db.delete_in(videos, ids[:20]) == 20
+    assert [x['_id'] for x in db.find_in_cached(videos, ids)] == ids[20:]
+    assert db.existing_ids(videos, ids) == set(ids[20:])
@@ -0,0 +1,102 @@
+from collections import Counter
+from datetime import datetime
+#
+import pytest
+#
+from cineplex import db
+from cineplex.doc_cache import DocumentCache, SharedCache
+
+
+@pytest.fixture
+def shared(monkeypatch):
+    """The shared tier on an in-memory Redis"""
+    fakeredis = pytest.importorskip('fakeredis')
+    monkeypatch.setattr(SharedCache, '_instance', None)
+    cache = SharedCache()
+    cache.client = fakeredis.FakeRedis()
+    local = DocumentCache()
+    local.clear()
+    monkeypatch.setattr(local, 'shared', cache)
+    for name in ['hits', 'shared_hits', 'misses']:
+        monkeypatch.setattr(local, name, Counter())
+    yield cache
+    local.clear()
+
+
+def test_get_and_put(shared):
+    as_of = datetime(2021, 12, 1, 12, 30)
+    shared.put_many('yt_videos', [{'_id': 'a', 'as_of': as_of}, {'_id': 'b'}])
+    assert shared.get_many('yt_videos', ['a', 'b', 'c']) == {
+        'a': {'_id': 'a', 'as_of': as_of}, 'b': {'_id': 'b'}}
+    assert shared.client.ttl(shared._key('yt_videos', 'a')) > 0
+
+
+def test_invalidate(shared):
+    shared.put_many('yt_videos', [{'_id': 'a'}, {'_id': 'b'}])
+    shared.put_many('yt_channels', [{'_id': 'c'}])
+
+    shared.invalidate('yt_videos', ['a'])
+    assert list(shared.get_many('yt_videos', ['a', 'b'])) == ['b']
+
+    # dropping all of a collection's documents keeps its known IDs
+    shared.invalidate('yt_videos')
+    assert shared.get_many('yt_videos', ['a', 'b']) == {}
+    assert shared.known('yt_videos', ['a', 'b', 'x']) == {'a', 'b'}
+    assert list(shared.get_many('yt_channels', ['c'])) == ['c']
+
+
+def test_known(shared):
+    shared.add_known('yt_videos', ['a', 'b'])
+    shared.add_known('yt_playlist_entries', ['e'])
+    assert shared.known('yt_videos', ['a', 'b', 'c']) == {'a', 'b'}
+    assert shared.known('yt_playlist_entries', ['e']) == set()
+
+    # the set's lifetime starts with it and isn't extended by later adds
+    key = shared._known_key('yt_videos')
+    assert 0 < shared.client.ttl(key) <= shared.known_ttl
+    shared.client.expire(key, 10)
+    shared.add_known('yt_videos', ['c'])
+    assert shared.client.ttl(key) <= 10
+
+    shared.remove_known('yt_videos', ['a'])
+    assert shared.known('yt_videos', ['a', 'b', 'c']) == {'b', 'c'}
+    shared.remove_known('yt_videos')
+    assert shared.known('yt_videos', ['b', 'c']) == set()
+
+
+def test_redis_failure_disables_the_tier(shared):
+    fakeredis = pytest.importorskip('fakeredis')
+    server = fakeredis.FakeServer()
+    server.connected = False
+    shared.client = fakeredis.FakeRedis(server=server)
+    assert shared.get_many('yt_videos', ['a']) == {}
+    assert not shared.enabled
+    assert shared.known('yt_videos', ['a']) == set()
+
+
+def test_document_cache_reads_through_the_shared_tier(shared):
+    shared.put_many('yt_videos', [{'_id': 'a'}])
+    cache = DocumentCache()
+    found, missing = cache.get_many('yt_videos', ['a', 'b'])
+    assert (found, missing) == ({'a': {'_id': 'a'}}, ['b'])
+    found, _ = cache.get_many('yt_videos', ['a'])
+    assert found == {'a': {'_id': 'a'}}
+    assert cache.stats()['yt_videos'] == {
+        'hits': 1, 'shared_hits': 1, 'misses': 1, 'hit_rate': 67}
+
+
+def test_existing_ids(mongo, shared):
+    videos = mongo.yt_videos
+    db.bulk_upsert(videos, [{'_id': 'a'}, {'_id': 'b'}])
+    assert shared.known('yt_videos', ['a', 'b']) == {'a', 'b'}
+
+    # known IDs are answered by Redis, others by MongoDB
+    videos.insert_one({'_id': 'c'})
+    videos.delete_one({'_id': 'a'})
+    assert db.existing_ids(videos, ['a', 'b', 'c', 'd']) == {'a', 'b', 'c'}
+
+    db.invalidate(videos)
+    assert db.existing_ids(videos, ['a']) == {'a'}
+    db.delete_in(videos, ['b'])
+    db.invalidate(videos, ['a'], deleted=True)
+    assert db.existing_ids(videos, ['a', 'b', 'c']) == {'c'}
@@ -0,0 +1,41 @@
+import pytest
+import ray
+#
+from cineplex.jobs import DONE, JobQueue
+from cineplex.youtube import downloader, playlist
+
+
+@pytest.fixture
+def local_ray(monkeypatch):
+    # actors run in this process, so they see the fixtures' database
+    ray.init(local_mode=True, num_cpus=2, include_dashboard=False)
+    monkeypatch.setattr(downloader.DownloaderPool, '_instance', None)
+    yield
+    ray.shutdown()
+
+
+def test_connect_reuses_the_runtime(local_ray):
+    downloader.connect()
+    assert ray.is_initialized()
+
+
+def test_pool_drains_download_jobs(mongo, local_ray, monkeypatch):
+    downloads = []
+
+    def download(video_id, show_progress, writer, skip_known, ydl):
+        downloads.append((video_id, ydl))
+        return {'_id': video_id}
+
+    monkeypatch.setattr(playlist, '_download_youtube_video', download)
+    monkeypatch.setattr(downloader.settings, 'youtube_download_workers', 2)
+    queue = JobQueue(playlist.DOWNLOAD_JOBS)
+    queue.enqueue(['a'])
+
+    pool = downloader.DownloaderPool()
+    assert len(pool.actors) == 2
+    assert pool.drain(['a']) == 1
+    assert queue.find(['a'])[0]['state'] == DONE
+    # downloaded with the actor's own YoutubeDL
+    assert [x[0] for x in downloads] == ['a']
+    assert downloads[0][1] is not None
+    assert downloader.DownloaderPool() is pool
@@ -0,0 +1,55 @@
+import glob
+import os
+from concurrent.futures import ThreadPoolExecutor
+#
+import pytest
+#
+from cineplex import export
+
+
+@pytest.fixture
+def in_process(monkeypatch):
+    # workers share the in-memory database only as threads
+    monkeypatch.setattr(export, 'ProcessPoolExecutor', ThreadPoolExecutor)
+
+
+def test_export_import_round_trip(mongo, in_process, tmp_path):
+    mongo.yt_videos.insert_many([{'_id': f'v{i}', 'n': i} for i in range(5)])
+    mongo.yt_channels.insert_many([{'_id': f'c{i}'} for i in range(3)])
+    mongo.other.insert_one({'_id': 'x'})
+    dir = str(tmp_path / 'export')
+
+    done = {}
+    counts = export.export_db(dir, workers=2, chunk_size=2,
+                              on_done=lambda name, count: done.update({name: count}))
+    assert counts == done == {'yt_channels': 3, 'yt_videos': 5}
+    assert export.read_manifest(dir)['collections'] == counts
+    assert len(glob.glob(os.path.join(dir, 'yt_videos.*.ndjson.gz'))) == 3
+
+    for name in mongo.list_collection_names():
+        mongo.drop_collection(name)
+    assert export.import_db(dir, workers=2) == counts
+    assert list(mongo.yt_videos.find().sort('_id')) == [
+        {'_id': f'v{i}', 'n': i} for i in range(5)]
+    assert 'other' not in mongo.list_collection_names()
+
+    # without drop, documents already there are skipped and kept
+    mongo.yt_videos.update_one({'_id': 'v0'}, {'$set': {'n': -1}})
+    mongo.yt_videos.delete_one({'_id': 'v4'})
+    assert export.import_db(dir) == {'yt_channels': 0, 'yt_videos': 1}
+    assert mongo.yt_videos.find_one({'_id': 'v0'})['n'] == -1
+    assert mongo.yt_videos.count_documents({}) == 5
+
+    assert export.import_db(dir, ['yt_videos'], drop=True) == {'yt_videos': 5}
+    assert mongo.yt_videos.find_one({'_id': 'v0'})['n'] == 0
+
+
+def test_partial_export_keeps_the_manifest(mongo, in_process, tmp_path):
+    mongo.yt_videos.insert_one({'_id': 'v'})
+    mongo.yt_channels.insert_one({'_id': 'c'})
+    dir = str(tmp_path / 'export')
+    export.export_db(dir)
+
+    mongo.yt_videos.insert_one({'_id': 'w'})
+    assert export.export_db(dir, ['yt_videos']) == {'yt_videos': 2}
+    assert export.read_manifest(dir)['collections'] == {'yt_channels': 1, 'yt_videos': 2}
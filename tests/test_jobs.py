@@ -0,0 +1,93 @@
+import time
+from datetime import datetime, timedelta
+#
+from cineplex.jobs import DONE, FAILED, QUEUED, RUNNING, JobQueue
+from cineplex.youtube import playlist
+
+
+def expire_lease(queue, job):
+    queue.collection.update_one(
+        {'_id': job['_id']}, {'$set': {'lease_expires': datetime.utcnow() - timedelta(seconds=1)}})
+
+
+def test_enqueue_is_idempotent(mongo):
+    queue = JobQueue('download')
+    assert queue.enqueue(['a', 'b', 'a']) == 2
+    assert queue.enqueue(['a', 'b']) == 0
+    assert queue.counts() == {QUEUED: 2}
+    assert mongo.yt_download_jobs.count_documents({}) == 2
+
+
+def test_expired_lease_is_claimed_again(mongo):
+    queue = JobQueue('download')
+    queue.enqueue(['a'])
+
+    job = queue.claim('w1')
+    assert (job['key'], job['state'], job['attempts']) == ('a', RUNNING, 1)
+    # leased: nobody else gets it
+    assert queue.claim('w2') is None
+
+    expire_lease(queue, job)
+    reclaimed = queue.claim('w2')
+    assert (reclaimed['worker'], reclaimed['attempts']) == ('w2', 2)
+    # the first worker lost it
+    assert not queue.renew(job)
+    assert queue.renew(reclaimed)
+
+    queue.complete(reclaimed)
+    assert queue.counts() == {DONE: 1}
+
+
+def test_failed_attempts(mongo):
+    queue = JobQueue('download')
+    queue.max_attempts = 2
+    queue.enqueue(['a'])
+
+    queue.fail(queue.claim('w1'), 'boom')
+    assert queue.find(['a'])[0]['state'] == QUEUED
+    queue.fail(queue.claim('w1'), 'boom')
+    job = queue.find(['a'])[0]
+    assert (job['state'], job['error']) == (FAILED, 'boom')
+    assert queue.claim('w1') is None
+
+    # failed jobs go back in the queue when enqueued again
+    assert queue.enqueue(['a']) == 1
+    assert queue.claim('w1')['attempts'] == 1
+
+
+def test_reap_fails_jobs_out_of_attempts(mongo):
+    queue = JobQueue('download')
+    queue.max_attempts = 1
+    queue.enqueue(['a'])
+    expire_lease(queue, queue.claim('w1'))
+    assert queue.reap() == 1
+    assert queue.find(['a'])[0]['state'] == FAILED
+
+
+def test_heartbeat_renews_the_lease(mongo):
+    queue = JobQueue('download')
+    queue.lease = timedelta(seconds=0.3)
+    queue.enqueue(['a'])
+    job = queue.claim('w1')
+    with queue.heartbeat(job):
+        time.sleep(0.5)
+    assert queue.find(['a'])[0]['lease_expires'] > datetime.utcnow()
+
+
+def test_drain_download_jobs(mongo, monkeypatch):
+    downloaded = []
+
+    def download(video_id, *args):
+        downloaded.append(video_id)
+        return {'_id': video_id} if video_id != 'bad' else None
+
+    monkeypatch.setattr(playlist, '_download_youtube_video', download)
+    queue = JobQueue(playlist.DOWNLOAD_JOBS)
+    queue.enqueue(['a', 'b', 'bad', 'other'])
+
+    assert playlist._drain_download_jobs(['a', 'b', 'bad']) == 2
+    assert {x['key'] for x in queue.find(state=DONE)} == {'a', 'b'}
+    assert queue.find(['bad'])[0]['state'] == FAILED
+    assert downloaded.count('bad') == queue.max_attempts
+    # jobs of other keys are left for whoever queued them
+    assert queue.find(['other'])[0]['state'] == QUEUED
@@ -0,0 +1,256 @@
+import time
+from datetime import datetime, timedelta
+#
+from typer.testing import CliRunner
+#
+from cineplex import db, youtube as youtube_cli
+from cineplex.youtube import playlist
+from cineplex.youtube.api import youtube_api
+from cineplex.youtube.quota import PRIORITY_HIGH, PRIORITY_NORMAL
+
+
+def playlist_id(c=0, p=0):
+    return f'PL{c:016d}{p:016d}'
+
+
+def spy_bulk_upsert(monkeypatch):
+    """Count the documents `playlist` upserts, per collection"""
+    writes = {}
+
+    def bulk_upsert(collection, docs, *args, **kwargs):
+        writes[collection.name] = writes.get(collection.name, 0) + len(docs)
+        return db.bulk_upsert(collection, docs, *args, **kwargs)
+
+    monkeypatch.setattr(playlist, 'bulk_upsert', bulk_upsert)
+    return writes
+
+
+def insert_item(playlist_id, video_id, position):
+    youtube_api().playlistItems().insert(part="snippet", body={"snippet": {
+        "playlistId": playlist_id,
+        "position": position,
+        "resourceId": {"kind": "youtube#video", "videoId": video_id},
+    }}).execute()
+
+
+def stored_video_ids(playlist_id):
+    items = playlist.get_playlist_items_from_db(playlist_id)['items']
+    assert [x['snippet']['position'] for x in items] == list(range(len(items)))
+    return [x['contentDetails']['videoId'] for x in items]
+
+
+def youtube_video_ids(youtube, playlist_id):
+    return [x['contentDetails']['videoId'] for x in youtube.playlist_items[playlist_id]]
+
+
+#
+# Playlist entries
+#
+
+
+def test_head_insert_writes_only_new_entries(youtube, monkeypatch):
+    youtube.add_synthetic(channels=1, playlists=1, items=120)
+    writes = spy_bulk_upsert(monkeypatch)
+
+    playlist.sync_youtube_playlist_items([playlist_id()], concurrency=1)
+    assert writes == {'yt_playlist_entries': 120}
+    assert stored_video_ids(playlist_id()) == youtube_video_ids(
+        youtube, playlist_id())
+
+    writes.clear()
+    insert_item(playlist_id(), 'dQw4w9WgXcQ', 0)
+    insert_item(playlist_id(), 'oHg5SJYRHA0', 60)
+    playlist.sync_youtube_playlist_items([playlist_id()], concurrency=1)
+    assert writes == {'yt_playlist_entries': 2}
+    video_ids = stored_video_ids(playlist_id())
+    assert video_ids == youtube_video_ids(youtube, playlist_id())
+    assert video_ids[0] == 'dQw4w9WgXcQ' and video_ids[60] == 'oHg5SJYRHA0'
+
+
+def test_removed_and_moved_entries(youtube, monkeypatch):
+    youtube.add_synthetic(channels=1, playlists=1, items=10)
+    playlist.sync_youtube_playlist_items([playlist_id()], concurrency=1)
+
+    items = list(youtube.playlist_items[playlist_id()])
+    # the last item moves to the head, the third is removed
+    items = [items[-1]] + items[:2] + items[3:-1]
+    for position, item in enumerate(items):
+        item['snippet']['position'] = position
+    youtube.playlist_items[playlist_id()] = items
+
+    writes = spy_bulk_upsert(monkeypatch)
+    playlist.sync_youtube_playlist_items([playlist_id()], concurrency=1)
+    assert writes == {'yt_playlist_entries': 1}
+    assert stored_video_ids(playlist_id()) == youtube_video_ids(
+        youtube, playlist_id())
+    assert db.get_db().yt_playlist_entries.count_documents({}) == 9
+
+
+def test_migrate_embedded_playlist_items(youtube):
+    youtube.add_synthetic(channels=1, playlists=1, items=12)
+    items = [dict(x) for x in youtube.playlist_items[playlist_id()]]
+    db.get_db().yt_playlist_items.insert_one(
+        {'_id': playlist_id(), 'as_of': datetime.utcnow(), 'items': items})
+
+    res = CliRunner().invoke(
+        youtube_cli.cli, ['playlist', 'migrate-youtube-playlist-items'])
+    assert res.exit_code == 0, res.output
+    assert 'Migrated 12 items of 1 playlist(s)' in res.output
+    assert 'items' not in db.get_db().yt_playlist_items.find_one()
+    migrated = list(playlist.iter_playlist_items_from_db(playlist_id()))
+    assert [x['id'] for x in migrated] == [x['id'] for x in items]
+    assert [x['snippet']['position'] for x in migrated] == list(range(12))
+
+
+def test_entry_positions():
+    assert playlist._entry_positions([None, None]) == [0, 1]
+    assert playlist._entry_positions([None, 0, 1]) == [-1, 0, 1]
+    assert playlist._entry_positions([0, 1, None]) == [0, 1, 2]
+    assert playlist._entry_positions([0, None, 1]) == [0, 0.5, 1]
+    # the longest increasing run stays put
+    assert playlist._entry_positions([3, 0, 1, 2]) == [-1, 0, 1, 2]
+    assert playlist._entry_positions(
+        [0, None, 0 + playlist.MIN_POSITION_STEP]) == [0, 1, 2]
+
+
+#
+# Concurrent sync
+#
+
+
+def test_sync_playlist_items_concurrently(youtube, monkeypatch):
+    youtube.add_synthetic(channels=1, playlists=8, items=60)
+    in_flight = []
+    peak = []
+    handle = youtube.handle
+
+    def slow_handle(*args, **kwargs):
+        in_flight.append(1)
+        peak.append(len(in_flight))
+        time.sleep(0.05)
+        in_flight.pop()
+        return handle(*args, **kwargs)
+
+    monkeypatch.setattr(youtube, 'handle', slow_handle)
+    playlist_ids = [playlist_id(0, p) for p in range(8)]
+    res = playlist.sync_youtube_playlist_items(playlist_ids, concurrency=4)
+
+    assert sorted(x['_id'] for x in res) == playlist_ids
+    assert 1 < max(peak) <= 4
+    for x in playlist_ids:
+        assert len(stored_video_ids(x)) == 60
+
+
+def test_aio_rejects_incremental(youtube):
+    res = CliRunner().invoke(youtube_cli.cli, [
+        'playlist', 'sync-youtube-playlist-items', '--aio', '--incremental', playlist_id()])
+    assert res.exit_code == 2
+    assert '--incremental' in res.output
+
+
+def test_playlist_items_job():
+    def playlist_with_meta(item_count, **kwargs):
+        return {'playlist': {'contentDetails': {'itemCount': item_count}}, **kwargs}
+
+    assert playlist._playlist_items_job(None, False) == (PRIORITY_NORMAL, 1)
+    assert playlist._playlist_items_job(playlist_with_meta(0), False) == (PRIORITY_NORMAL, 1)
+    assert playlist._playlist_items_job(playlist_with_meta(101), False) == (PRIORITY_NORMAL, 3)
+    assert playlist._playlist_items_job(
+        playlist_with_meta(101, offline=False, offline_as_of='x'), True) == (PRIORITY_HIGH, 1)
+
+
+def test_sync_playlist_items_within_quota(youtube, monkeypatch):
+    youtube.add_synthetic(channels=1, playlists=2, items=120)
+    large, offline = playlist_id(0, 0), playlist_id(0, 1)
+    youtube.playlist_items[offline] = youtube.playlist_items[offline][:10]
+    mongo = db.get_db()
+    mongo.yt_playlists.insert_many([
+        {'_id': large, 'playlist': {'contentDetails': {'itemCount': 120}}},
+        {'_id': offline, 'playlist': {'contentDetails': {'itemCount': 10}}, 'offline': True},
+    ])
+    monkeypatch.setattr(playlist.QuotaScheduler, '_instance', None)
+    monkeypatch.setattr(playlist.settings, 'youtube_daily_quota', 3)
+
+    # the offline playlist goes first, leaving too little for the large one,
+    # which is deferred without spending any of it
+    res = playlist.sync_youtube_playlist_items([large, offline], concurrency=1)
+    assert [x['_id'] for x in res] == [offline]
+    assert youtube.stats['playlistItems.list'] == 1
+    assert mongo.yt_quota.find_one()['used'] == 1
+
+
+#
+# Incremental sync
+#
+
+
+def test_incremental_sync_fetches_only_the_head(youtube, monkeypatch):
+    youtube.add_synthetic(channels=1, playlists=0, items=120)
+    uploads_id = f'UU{0:022d}'
+
+    playlist.sync_youtube_playlist_items(
+        [uploads_id], concurrency=1, incremental=True)
+    assert youtube.stats['playlistItems.list'] == 3
+
+    # unchanged: the head page comes back 304
+    playlist.sync_youtube_playlist_items(
+        [uploads_id], concurrency=1, incremental=True)
+    assert youtube.stats['playlistItems.list'] == 4
+
+    insert_item(uploads_id, 'dQw4w9WgXcQ', 0)
+    insert_item(uploads_id, 'oHg5SJYRHA0', 0)
+    writes = spy_bulk_upsert(monkeypatch)
+    playlist.sync_youtube_playlist_items(
+        [uploads_id], concurrency=1, incremental=True)
+    assert youtube.stats['playlistItems.list'] == 5
+    assert writes == {'yt_playlist_entries': 2}
+    assert stored_video_ids(uploads_id) == youtube_video_ids(
+        youtube, uploads_id)
+
+
+#
+# Playlist inserts
+#
+
+
+def test_add_items_reports_failures(youtube):
+    youtube.add_synthetic(channels=1, playlists=1, items=3)
+
+    # an item without a video ID is rejected
+    failed = playlist.add_item_to_youtube_playlist_batch(
+        playlist_id(), ['dQw4w9WgXcQ', '', 'oHg5SJYRHA0'])
+    assert failed == ['']
+    assert youtube_video_ids(youtube, playlist_id())[3:] == [
+        'dQw4w9WgXcQ', 'oHg5SJYRHA0']
+
+    # a rerun skips the items already inserted
+    assert playlist.add_item_to_youtube_playlist_batch(
+        playlist_id(), ['dQw4w9WgXcQ', 'oHg5SJYRHA0']) == []
+    assert len(youtube.playlist_items[playlist_id()]) == 5
+
+
+#
+# Refresh
+#
+
+
+def test_refresh_stale_playlist_items(youtube):
+    youtube.add_synthetic(channels=1, playlists=1, items=60)
+    uploads_id = f'UU{0:022d}'
+    playlist.sync_youtube_playlist_items([playlist_id()], concurrency=1)
+    playlist.sync_youtube_playlist_items(
+        [uploads_id], concurrency=1, incremental=True)
+
+    # new videos go at the end of a playlist, at the head of uploads
+    insert_item(playlist_id(), 'dQw4w9WgXcQ', 60)
+    insert_item(uploads_id, 'oHg5SJYRHA0', 0)
+    playlist_items = db.get_db().yt_playlist_items
+    playlist_items.update_many(
+        {}, {'$set': {'as_of': datetime.utcnow() - timedelta(days=8)}})
+    db.invalidate(playlist_items)
+
+    playlist.refresh_stale(timedelta(days=7))
+    assert stored_video_ids(playlist_id())[-1] == 'dQw4w9WgXcQ'
+    assert stored_video_ids(uploads_id)[0] == 'oHg5SJYRHA0'
+    assert db.find_stale(playlist_items, timedelta(days=7)) == []
+
@@ -0,0 +1,129 @@
+import threading
+from datetime import datetime, timedelta
+#
+import pytest
+from google.oauth2.credentials import Credentials
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpMock
+#
+from cineplex.youtube import api
+from cineplex.youtube.api import build_youtube_api, youtube_api, youtube_api_stats
+from cineplex.youtube.fake import FakeHttp, FakeYouTube
+
+
+def test_build_youtube_api_offline():
+    youtube = build_youtube_api(http=HttpMock(None, {'status': '200'}))
+    request = youtube.playlistItems().list(
+        part="id,snippet,contentDetails",
+        playlistId="PL0123456789abcdefghijklmnopqrstuv",
+        maxResults=50,
+    )
+    assert request.uri.startswith(
+        'https://youtube.googleapis.com/youtube/v3/playlistItems?')
+    assert request.method == 'GET'
+
+
+def fake_youtube(**kwargs):
+    api = FakeYouTube(**kwargs)
+    api.add_synthetic(channels=2, playlists=3, items=120)
+    return api, build_youtube_api(http=FakeHttp(api))
+
+
+def test_fake_youtube_paging():
+    api, youtube = fake_youtube()
+    collection = youtube.playlistItems()
+    request = collection.list(
+        part="snippet", playlistId=f'PL{0:016d}{1:016d}', maxResults=50)
+    positions = []
+    while request is not None:
+        response = request.execute()
+        positions.extend(x['snippet']['position'] for x in response['items'])
+        request = collection.list_next(request, response)
+    assert positions == list(range(120))
+    assert api.used == 3
+
+
+def test_fake_youtube_etags():
+    _, youtube = fake_youtube()
+    response = youtube.channels().list(
+        part="snippet", id=f'UC{0:022d}', fields="etag,items(id)").execute()
+    assert response['items'] == [{'id': f'UC{0:022d}'}]
+
+    request = youtube.channels().list(
+        part="snippet", id=f'UC{0:022d}', fields="etag,items(id)")
+    request.headers['If-None-Match'] = response['etag']
+    with pytest.raises(HttpError) as e:
+        request.execute()
+    assert e.value.resp.status == 304
+
+
+def test_fake_youtube_insert_and_quota():
+    api, youtube = fake_youtube(quota=60)
+    playlist_id = f'PL{1:016d}{0:016d}'
+    item = youtube.playlistItems().insert(part="snippet", body={"snippet": {
+        "playlistId": playlist_id,
+        "resourceId": {"kind": "youtube#video", "videoId": "dQw4w9WgXcQ"},
+    }}).execute()
+    assert item['snippet']['position'] == 120
+    assert len(api.playlist_items[playlist_id]) == 121
+
+    with pytest.raises(HttpError) as e:
+        youtube.playlistItems().insert(part="snippet", body={"snippet": {
+            "playlistId": playlist_id,
+            "resourceId": {"kind": "youtube#video", "videoId": "dQw4w9WgXcQ"},
+        }}).execute()
+    assert e.value.resp.status == 403
+    assert b'quotaExceeded' in e.value.content
+
+
+def test_fake_youtube_batch():
+    api, youtube = fake_youtube()
+    responses = {}
+    batch = youtube.new_batch_http_request(
+        callback=lambda id, response, e: responses.update({id: response or e}))
+    for c in range(2):
+        batch.add(youtube.playlists().list(part="snippet", channelId=f'UC{c:022d}', maxResults=50),
+                  request_id=str(c))
+    batch.add(youtube.playlistItems().list(part="snippet", playlistId='missing'),
+              request_id='missing')
+    batch.execute()
+    assert [len(responses[str(c)]['items']) for c in range(2)] == [3, 3]
+    assert isinstance(responses['missing'], HttpError)
+    assert api.round_trips == 1
+
+
+def test_youtube_api_is_reused_per_thread(youtube):
+    service = youtube_api()
+    assert youtube_api() is service
+    other = []
+    thread = threading.Thread(target=lambda: other.append(youtube_api()))
+    thread.start()
+    thread.join()
+    assert other[0] is not service
+    assert youtube_api_stats() == {'hits': 1, 'misses': 2, 'refreshes': 0}
+
+
+class RefreshingCredentials(Credentials):
+    """Credentials whose refresh makes no request"""
+
+    def refresh(self, request):
+        self.token = 'refreshed'
+        self.expiry = datetime.utcnow() + timedelta(hours=1)
+
+
+def test_credentials_refreshed_near_expiry(monkeypatch, tmp_path):
+    monkeypatch.setattr(api.settings, 'youtube_fake', None)
+    monkeypatch.setattr(api.settings, 'youtube_record', None)
+    monkeypatch.setattr(api, 'token_file', str(tmp_path / 'token.pickle'))
+    api.reset_youtube_api()
+    monkeypatch.setattr(api, '_credentials', RefreshingCredentials(
+        'token', refresh_token='refresh', expiry=datetime.utcnow() + timedelta(days=1)))
+    service = youtube_api()
+    assert youtube_api() is service
+
+    api._credentials.expiry = datetime.utcnow()
+    assert youtube_api() is service
+    assert api._credentials.token == 'refreshed'
+    assert (tmp_path / 'token.pickle').exists()
+    assert youtube_api_stats() == {'hits': 2, 'misses': 1, 'refreshes': 1}
+    api.reset_youtube_api()